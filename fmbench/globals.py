@@ -178,8 +178,11 @@ METRICS_PER_POLL_EVAL_DIR_NAME: str = "per_poll_eval"
 
 METRICS_PER_INFERENCE_DIR = os.path.join(METRICS_DIR, "per_inference")
 METRICS_PER_CHUNK_DIR = os.path.join(METRICS_DIR, "per_chunk")
+# per token timings side files, see fmbench/scripts/token_timings.py
+METRICS_TOKEN_TIMINGS_DIR = os.path.join(METRICS_DIR, "token_timings")
 ENDPOINT_METRICS_FNAME = "endpoint_metrics.csv"
 ENDPOINT_METRICS_SUMMARIZED_FNAME = "endpoint_metrics_summarized.csv"
+COMBINATION_METRICS_FNAME = "combination_metrics.csv"
 
 # These are the column names that are present in the SageMaker and EC2 instance utilization metrics
 # SageMaker utilization metrics contain an EndpointName column
@@ -222,7 +225,8 @@ METRICS_PATH_FNAME: str = "metrics_path.txt"
 # Name of the .txt file where the HF token is stored
 HF_TOKEN_FNAME: str = "hf_token.txt"
 
-DIR_LIST = [DATA_DIR, PROMPTS_DIR, METRICS_DIR, MODELS_DIR, METRICS_PER_INFERENCE_DIR, METRICS_PER_CHUNK_DIR]
+DIR_LIST = [DATA_DIR, PROMPTS_DIR, METRICS_DIR, MODELS_DIR, METRICS_PER_INFERENCE_DIR, METRICS_PER_CHUNK_DIR,
+            METRICS_TOKEN_TIMINGS_DIR]
 
 # this is for custom tokenizers
 TOKENIZER_DIR_S3 = config['s3_read_data']['tokenizer_prefix']
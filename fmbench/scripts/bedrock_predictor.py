@@ -3,19 +3,25 @@ import math
 import json
 import time
 import boto3
+import asyncio
 import litellm
 import logging
 import pandas as pd
 from datetime import datetime
+from dataclasses import replace
 from fmbench.scripts import constants
 from typing import Dict, Optional, List
 from botocore.exceptions import ClientError
-from litellm import completion, token_counter
-from litellm import completion, RateLimitError
-from fmbench.scripts.stream_responses import get_response_stream
+from litellm import completion, acompletion, token_counter, RateLimitError
+from fmbench.scripts.boto3_clients import get_client
+from fmbench.scripts.rate_limiter import RateLimiter, get_rate_limiter
+from fmbench.scripts.stream_responses import get_response_stream, aget_response_stream
 from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
+                                               PredictionRecord,
                                                FMBenchPredictionResponse)
-from fmbench.scripts.bedrock_predictor_converseAPI import invoke_bedrock_converse
+from fmbench.scripts.bedrock_predictor_converseAPI import (invoke_bedrock_converse,
+                                                           get_bedrock_runtime_client,
+                                                           invoke_bedrock_converse_stream)
 
 
 # set a logger
@@ -28,6 +34,12 @@ EMBEDDING_MODELS: List[str] = ["amazon.titan-embed-text-v1",
                                "cohere.embed-english-v3",
                                "cohere.embed-multilingual-v3"]
 SERVICE_NAME: str = 'bedrock'
+# add logic to retry if there are throttling errors
+INITIAL_RETRY_DELAY: float = 2.0
+MAX_RETRY_DELAY: float = 60.0
+# error codes that are retried, botocore does not retry the requests (see get_bedrock_runtime_client)
+RETRY_ERROR_CODES: List[str] = ['ThrottlingException', 'TooManyRequestsException',
+                                'ServiceUnavailableException', 'ModelNotReadyException']
 
 
 class BedrockPredictor(FMBenchPredictor):
@@ -46,12 +58,15 @@ class BedrockPredictor(FMBenchPredictor):
             self._pt_model_id = None
             self._inference_spec = inference_spec
             self._aws_region = boto3.Session().region_name
+            # the cached clients are shared by all the predictors of the process, the
+            # connection pool is sized to the maximum concurrency level of the run
+            self._max_pool_connections = (metadata or {}).get("max_concurrency")
 
             # check if the endpoint name corresponded to a provisioned throughput
             # endpoint
             if ':provisioned-model/' in self._endpoint_name:
                 logger.info(f"{self._endpoint_name} is a provisioned throughput endpoint")
-                bedrock_client = boto3.client(SERVICE_NAME)
+                bedrock_client = get_client(SERVICE_NAME, region_name=self._aws_region)
                 response = bedrock_client.list_provisioned_model_throughputs()
                 if response['ResponseMetadata']['HTTPStatusCode'] != 200:
                     logger.error(f"error received while calling list_provisioned_model_throughputs, response=\"{response}\", "
@@ -83,6 +98,8 @@ class BedrockPredictor(FMBenchPredictor):
             self._top_p = 0.9
             # not used for now but kept as placeholders for future
             self._stream = None
+            # record the time of every streamed token, see token_timings.py
+            self._token_timings = False
             self._start = None
             self._stop = None
             # Initilialize the use_boto3 parameter to "False". This parameter is used if the 
@@ -101,14 +118,14 @@ class BedrockPredictor(FMBenchPredictor):
                     self._max_tokens = parameters.get('max_tokens', self._max_tokens)
                     self._top_p = parameters.get('top_p', self._top_p)
                     self._stream = inference_spec.get("stream", self._stream)
+                    self._token_timings = inference_spec.get("token_timings", self._token_timings)
                     self._stop = inference_spec.get("stop_token", self._stop)
                     self._start = inference_spec.get("start_token", self._start)
                     self._use_boto3 = parameters.get("use_boto3", self._use_boto3)
-            self._response_json = {}
             logger.info(f"__init__, _bedrock_model={self._bedrock_model}, self._pt_model_id={self._pt_model_id},"
                         f"_temperature={self._temperature} "
                         f"_max_tokens={self._max_tokens}, _top_p={self._top_p} "
-                        f"_stream={self._stream}, _stop={self._stop}, _caching={self._caching} "
+                        f"_stream={self._stream}, _token_timings={self._token_timings}, _stop={self._stop}, _caching={self._caching} "
                         f"_use_boto3={self._use_boto3}")
         except Exception as e:
             exception_msg = f"""exception while creating predictor/initializing variables
@@ -117,151 +134,223 @@ class BedrockPredictor(FMBenchPredictor):
             logger.error(exception_msg)
             raise ValueError(exception_msg)
 
+    def _get_messages(self, prompt_input_data: str, base64_img: Optional[str]) -> List[Dict]:
+        # Get the base64 image if in vision mode
+        if base64_img is not None:
+            logger.info("'base64_img' column provided in the dataset, going to use the multimodal"
+                        "messages API to get inferences on the image")
+            # Add prefix if needed
+            if not base64_img.startswith('data:image/'):
+                base64_img = "data:image/jpeg;base64," + base64_img
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt_input_data},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": base64_img
+                            },
+                        },
+                    ],
+                }
+            ]
+        elif self._use_boto3 is True:
+            logger.info("Going to use the standard text generation messages format to get inferences using the bedrock converse API")
+            messages = [{"role": "user", "content": [{"text": prompt_input_data}]}]
+        else:
+            logger.info("Going to use the standard text generation messages format to get inferences using Litellm")
+            messages = [{"content": prompt_input_data, "role": "user"}]
+        return messages
+
+    def _get_completion_args(self, messages: List[Dict], max_tokens: Optional[int] = None) -> Dict:
+        # This is the logic for getting inference using Litellm when use_boto3 is not enabled in bedrock parameters
+        completion_args = dict(model=self._bedrock_model,
+                               model_id=self._pt_model_id,
+                               messages=messages,
+                               temperature=self._temperature,
+                               # a replayed trace can set max_tokens per request
+                               max_tokens=max_tokens or self._max_tokens,
+                               caching=self._caching,
+                               stream=self._stream)
+        # ask for the token usage at the end of the stream so that
+        # the response does not need to be tokenized
+        if self._stream is True:
+            completion_args['stream_options'] = {"include_usage": True}
+        # cohere does not support top_p and apprarently LiteLLM does not
+        # know that?
+        if 'cohere' not in self._endpoint_name:
+            completion_args['top_p'] = self._top_p
+        logger.info(f"Invoking {self._bedrock_model} to get inference")
+        return completion_args
+
+    def _get_converse_args(self, messages: List[Dict], max_tokens: Optional[int] = None) -> Dict:
+        logger.info(f"user has enabled 'use_boto3' to {self._use_boto3}. Calling the bedrock converse API.")
+        return dict(endpoint_name=self._endpoint_name,
+                    messages=messages,
+                    temperature=self._temperature,
+                    max_tokens=max_tokens or self._max_tokens,
+                    top_p=self._top_p,
+                    bedrock_client=get_bedrock_runtime_client(region_name=self._aws_region,
+                                                              max_pool_connections=self._max_pool_connections))
+
+    def _parse_streaming_response(self,
+                                  response_dict_from_streaming: Dict,
+                                  latency: float) -> PredictionRecord:
+        # Get the response and the TTFT, TPOT, TTLT metrics if the streaming
+        # for responses is set to true
+        response = response_dict_from_streaming['response']
+        generated_text = json.loads(response)[0].get('generated_text')
+        # The input and output tokens come from the usage chunk at the end of the stream. If the
+        # model does not send one they are counted with the tokenizer after the run instead of
+        # here, so that tokenizing is not in the path of the requests
+        prompt_tokens = response_dict_from_streaming.get('prompt_tokens')
+        completion_tokens = response_dict_from_streaming.get('completion_tokens')
+        usage_reported = prompt_tokens is not None and completion_tokens is not None
+        logger.info(f"streaming prompt token count: {prompt_tokens}, "
+                    f"completion token count: {completion_tokens}, latency: {latency}, "
+                    f"usage_reported={usage_reported}")
+        logger.info("Completed streaming for the current UUID, moving to the next prediction.")
+        return PredictionRecord(generated_text=generated_text,
+                                latency=latency,
+                                prompt_tokens=prompt_tokens,
+                                completion_tokens=completion_tokens,
+                                time_to_first_token=response_dict_from_streaming.get('TTFT'),
+                                time_per_output_token=response_dict_from_streaming.get('TPOT'),
+                                time_to_last_token=response_dict_from_streaming.get('TTLT'),
+                                token_times=response_dict_from_streaming.get('token_times'),
+                                token_count_model=None if usage_reported else self._endpoint_name)
+
+    def _parse_completion_response(self, response) -> PredictionRecord:
+        # If streaming is set to false, then get the response in the normal
+        # without streaming format from LiteLLM
+        # Iterate through the entire model response
+        # Since we are not sending batched requests so we only expect a single completion
+        generated_text: Optional[str] = None
+        for choice in response.choices:
+            # Extract the message and the message's content from LiteLLM
+            if choice.message and choice.message.content:
+                # Extract the response from the dict
+                generated_text = choice.message.content
+                break
+
+        # Extract number of input and completion prompt tokens, and the latency in seconds
+        return PredictionRecord(generated_text=generated_text,
+                                latency=response._response_ms / 1000,
+                                prompt_tokens=response.usage.prompt_tokens,
+                                completion_tokens=response.usage.completion_tokens)
+
+    def _parse_converse_response(self, response: Dict, latency: float) -> PredictionRecord:
+        # Extract response and token usage
+        return PredictionRecord(generated_text=response['output']['message']['content'][0]['text'],
+                                latency=latency,
+                                prompt_tokens=response['usage']['inputTokens'],
+                                completion_tokens=response['usage']['outputTokens'])
+
+    def _parse_converse_stream_response(self, result: Dict) -> PredictionRecord:
+        # the token counts come from the metadata event at the end of the stream
+        return PredictionRecord(generated_text=result['generated_text'],
+                                latency=result['latency'],
+                                prompt_tokens=result['prompt_tokens'],
+                                completion_tokens=result['completion_tokens'],
+                                time_to_first_token=result['TTFT'],
+                                time_per_output_token=result['TPOT'],
+                                time_to_last_token=result['TTLT'],
+                                token_times=result['token_times'])
+
+    def _invoke_converse(self, converse_args: Dict) -> PredictionRecord:
+        # use the streaming converse API if streaming is enabled to get the TTFT, TPOT and TTLT
+        if self._stream is True:
+            return self._parse_converse_stream_response(
+                invoke_bedrock_converse_stream(**converse_args, record_token_times=self._token_timings))
+        response, latency = invoke_bedrock_converse(**converse_args)
+        return self._parse_converse_response(response, latency)
+
+    def _get_retry_wait_time(self, e: Exception, retry_count: int) -> float:
+        # if the error is a throttling or too many requests exception, wait and retry again. The wait time between
+        # each failed request increases exponentially
+        if isinstance(e, ClientError) and e.response['Error']['Code'] not in RETRY_ERROR_CODES:
+            logger.error(f"Unhandled ClientError: {str(e)}")
+            raise e  # Re-raise if it's not a throttling error
+        wait_time = min(INITIAL_RETRY_DELAY * (2 ** (retry_count - 1)), MAX_RETRY_DELAY)
+        logger.warning(f"Throttling error encountered: {str(e)}. Retrying in {wait_time:.2f} seconds... (Attempt {retry_count})")
+        return wait_time
+
+    @property
+    def _rate_limiter(self) -> Optional[RateLimiter]:
+        # requests are paced by the client side rate limiter if the config file has rate
+        # limits for this model id (or provisioned throughput). It is looked up for every
+        # request since the runner replaces the limiters when it sets the share of the
+        # quota of a worker (see InferenceSender.set_rate_limit_share)
+        return get_rate_limiter(self._pt_model_id or self._endpoint_name)
+
+    def _get_rate_limit_tokens(self,
+                               rate_limiter: RateLimiter,
+                               prompt: str,
+                               max_tokens: Optional[int]) -> int:
+        # the tokens per minute quota is charged for the prompt and max_tokens
+        # when the request is received, count them the same way. The prompt is
+        # counted as text since litellm cannot count the converse API messages
+        if not rate_limiter.limits_tokens:
+            return 0
+        return token_counter(model=self._endpoint_name, text=prompt) + (max_tokens or self._max_tokens)
+
+    def _add_wait_times(self,
+                        prediction: PredictionRecord,
+                        rate_limit_wait_time: float,
+                        retry_wait_time: float) -> FMBenchPredictionResponse:
+        # time spent waiting for the rate limiter and sleeping between throttled retries
+        # is not part of the latency, it is reported separately
+        return replace(prediction,
+                       rate_limit_wait_time=rate_limit_wait_time,
+                       retry_wait_time=retry_wait_time).to_response()
+
     def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
         # Represents the prompt payload
         prompt_input_data = payload['inputs']
         base64_img = payload.get('base64_img')
         os.environ["AWS_REGION_NAME"] = self._aws_region
-        latency: Optional[float] = None
-        completion_tokens: Optional[int] = None
-        prompt_tokens: Optional[int] = None
-        response_dict_from_streaming: Optional[Dict] = None
-        TTFT: Optional[float] = None
-        TPOT: Optional[float] = None
-        TTLT: Optional[float] = None
         # add logic to retry if there are throttling errors
-        INITIAL_RETRY_DELAY: float = 2.0 
-        MAX_RETRY_DELAY: float = 60.0  
         retry_count = 0
+        rate_limit_wait_time = 0.0
+        retry_wait_time = 0.0
         while True:
             try:
-                # Get the base64 image if in vision mode
-                if base64_img is not None:
-                    logger.info("'base64_img' column provided in the dataset, going to use the multimodal"
-                                "messages API to get inferences on the image")
-                    # Add prefix if needed
-                    if not base64_img.startswith('data:image/'):
-                        base64_img = "data:image/jpeg;base64," + base64_img
-                    messages = [
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt_input_data},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": base64_img
-                                    },
-                                },
-                            ],
-                        }
-                    ]
-                elif self._use_boto3 is True:
-                    logger.info("Going to use the standard text generation messages format to get inferences using the bedrock converse API")
-                    messages = [{"role": "user", "content": [{"text": prompt_input_data}]}]
-                else:
-                    logger.info("Going to use the standard text generation messages format to get inferences using Litellm")
-                    messages = [{"content": prompt_input_data, "role": "user"}]
-
-                # This is the logic for getting inference using Litellm when use_boto3 is not enabled in bedrock parameters
-                if self._use_boto3 is False:
-                    # cohere does not support top_p and apprarently LiteLLM does not
-                    # know that?
-                    if 'cohere' not in self._endpoint_name:
-                        logger.info(f"Invoking {self._bedrock_model} to get inference")
-                        st = time.perf_counter()
-                        response = completion(model=self._bedrock_model,
-                                            model_id=self._pt_model_id,
-                                            messages=messages,
-                                            temperature=self._temperature,
-                                            max_tokens=self._max_tokens,
-                                            top_p=self._top_p,
-                                            caching=self._caching,
-                                            stream=self._stream)
-                        # Extract latency in seconds
-                        latency = time.perf_counter() - st
-                    else:
-                        logger.info(f"Invoking {self._bedrock_model} to get inference")
-                        st = time.perf_counter()
-                        response = completion(model=self._bedrock_model,
-                                            model_id=self._pt_model_id,
-                                            messages=messages,
-                                            temperature=self._temperature,
-                                            max_tokens=self._max_tokens,
-                                            caching=self._caching,
-                                            stream=self._stream)
-                        latency = time.perf_counter() - st
-                    logger.info(f"stop token: {self._stop}, streaming: {self._stream}, "
-                                f"response: {response}")
-                    # Get the response and the TTFT, TPOT, TTLT metrics if the streaming
-                    # for responses is set to true
-                    if self._stream is True:
-                        response_dict_from_streaming = get_response_stream(response,
-                                                                        st,
-                                                                        self._start,
-                                                                        self._stop,
-                                                                        is_sagemaker=False)
-                        TTFT = response_dict_from_streaming.get('TTFT')
-                        TPOT = response_dict_from_streaming.get('TPOT')
-                        TTLT = response_dict_from_streaming.get('TTLT')
-                        response = response_dict_from_streaming['response']
-                        self._response_json["generated_text"] = json.loads(response)[0].get('generated_text')
-                        # Getting in the total input and output tokens using token counter.
-                        # Streaming on liteLLM does not support prompt tokens and completion tokens 
-                        # in the invocation response format
-                        prompt_tokens = token_counter(model=self._endpoint_name, messages=messages)
-                        completion_tokens = token_counter(text=self._response_json["generated_text"])
-                        logger.info(f"streaming prompt token count: {prompt_tokens}, "
-                                    f"completion token count: {completion_tokens}, latency: {latency}")
-                        logger.info("Completed streaming for the current UUID, moving to the next prediction.")
-                        break  # Explicitly exit the loop for the current prediction
-                    # If streaming is set to false, then get the response in the normal
-                    # without streaming format from LiteLLM
-                    else:
-                        # Iterate through the entire model response
-                        # Since we are not sending batched requests so we only expect a single completion
-                        for choice in response.choices:
-                            # Extract the message and the message's content from LiteLLM
-                            if choice.message and choice.message.content:
-                                # Extract the response from the dict
-                                self._response_json["generated_text"] = choice.message.content
-                                break
-
-                        # Extract number of input and completion prompt tokens
-                        prompt_tokens = response.usage.prompt_tokens
-                        completion_tokens = response.usage.completion_tokens
-                        # Extract latency in seconds
-                        latency = response._response_ms / 1000
-                        # If we get here, the call was successful, so we break out of the retry loop
-                        break
-
+                messages = self._get_messages(prompt_input_data, base64_img)
+                rate_limiter = self._rate_limiter
+                if rate_limiter is not None:
+                    rate_limit_wait_time += rate_limiter.acquire(
+                        self._get_rate_limit_tokens(rate_limiter, prompt_input_data, payload.get('max_tokens')))
                 # if use_boto3 is enabled in the bedrock parameters, then use the converseAPI
                 # to invoke the bedrock model, else use litellm. Enable use_boto3 to "yes"
                 # if the current version of litellm does not support the model to benchmark.
+                if self._use_boto3 is True:
+                    prediction = self._invoke_converse(self._get_converse_args(messages, payload.get('max_tokens')))
+                    return self._add_wait_times(prediction, rate_limit_wait_time, retry_wait_time)
+
+                st = time.perf_counter()
+                response = completion(**self._get_completion_args(messages, payload.get('max_tokens')))
+                # Extract latency in seconds
+                latency = time.perf_counter() - st
+                logger.info(f"stop token: {self._stop}, streaming: {self._stream}, "
+                            f"response: {response}")
+                if self._stream is True:
+                    response_dict_from_streaming = get_response_stream(response,
+                                                                       st,
+                                                                       self._start,
+                                                                       self._stop,
+                                                                       is_sagemaker=False,
+                                                                       record_token_times=self._token_timings)
+                    prediction = self._parse_streaming_response(response_dict_from_streaming, latency)
                 else:
-                    logger.info(f"user has enabled 'use_boto3' to {self._use_boto3}. Calling the bedrock converse API.")
-                    response, latency = invoke_bedrock_converse(
-                        endpoint_name=self._endpoint_name,
-                        messages=messages,
-                        temperature=self._temperature,
-                        max_tokens=self._max_tokens,
-                        top_p=self._top_p
-                    )
-                    # Extract response and token usage
-                    self._response_json["generated_text"] = response['output']['message']['content'][0]['text']
-                    prompt_tokens = response['usage']['inputTokens']
-                    completion_tokens = response['usage']['outputTokens']
-                    break
+                    prediction = self._parse_completion_response(response)
+                return self._add_wait_times(prediction, rate_limit_wait_time, retry_wait_time)
 
             except (RateLimitError, ClientError) as e:
-                # if the error is a throttling or too many requests exception, wait and retry again. The wait time between
-                # each failed request increases exponentially
-                if isinstance(e, ClientError) and e.response['Error']['Code'] not in ['ThrottlingException', 'TooManyRequestsException']:
-                    logger.error(f"Unhandled ClientError: {str(e)}")
-                    raise  # Re-raise if it's not a throttling error
                 retry_count += 1
-                wait_time = min(INITIAL_RETRY_DELAY * (2 ** (retry_count - 1)), MAX_RETRY_DELAY)
-                logger.warning(f"Throttling error encountered: {str(e)}. Retrying in {wait_time:.2f} seconds... (Attempt {retry_count})")
+                wait_time = self._get_retry_wait_time(e, retry_count)
+                retry_wait_time += wait_time
                 time.sleep(wait_time)
 
             except Exception as e:
@@ -269,13 +358,60 @@ class BedrockPredictor(FMBenchPredictor):
                             f"exception={e}")
                 raise  # Re-raise unexpected exceptions
 
-        return FMBenchPredictionResponse(response_json=self._response_json,
-                                         latency=latency,
-                                         time_to_first_token=TTFT,
-                                         time_per_output_token=TPOT,
-                                         time_to_last_token=TTLT,
-                                         completion_tokens=completion_tokens,
-                                         prompt_tokens=prompt_tokens)
+    async def aget_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        """Asynchronous version of get_prediction, uses litellm.acompletion so that no
+           thread is blocked while waiting for the model. The converse API path (use_boto3)
+           has no asynchronous boto3 client so it is run in a thread.
+        """
+        prompt_input_data = payload['inputs']
+        base64_img = payload.get('base64_img')
+        os.environ["AWS_REGION_NAME"] = self._aws_region
+        retry_count = 0
+        rate_limit_wait_time = 0.0
+        retry_wait_time = 0.0
+        while True:
+            try:
+                messages = self._get_messages(prompt_input_data, base64_img)
+                rate_limiter = self._rate_limiter
+                if rate_limiter is not None:
+                    # the tokenizer is not run on the event loop
+                    tokens = await asyncio.to_thread(self._get_rate_limit_tokens,
+                                                     rate_limiter,
+                                                     prompt_input_data,
+                                                     payload.get('max_tokens'))
+                    rate_limit_wait_time += await rate_limiter.aacquire(tokens)
+                if self._use_boto3 is True:
+                    prediction = await asyncio.to_thread(self._invoke_converse,
+                                                         self._get_converse_args(messages, payload.get('max_tokens')))
+                    return self._add_wait_times(prediction, rate_limit_wait_time, retry_wait_time)
+
+                st = time.perf_counter()
+                response = await acompletion(**self._get_completion_args(messages, payload.get('max_tokens')))
+                latency = time.perf_counter() - st
+                logger.info(f"stop token: {self._stop}, streaming: {self._stream}, "
+                            f"response: {response}")
+                if self._stream is True:
+                    response_dict_from_streaming = await aget_response_stream(response,
+                                                                              st,
+                                                                              self._start,
+                                                                              self._stop,
+                                                                              record_token_times=self._token_timings)
+                    prediction = self._parse_streaming_response(response_dict_from_streaming, latency)
+                else:
+                    prediction = self._parse_completion_response(response)
+                return self._add_wait_times(prediction, rate_limit_wait_time, retry_wait_time)
+
+            except (RateLimitError, ClientError) as e:
+                retry_count += 1
+                wait_time = self._get_retry_wait_time(e, retry_count)
+                retry_wait_time += wait_time
+                await asyncio.sleep(wait_time)
+
+            except Exception as e:
+                logger.error(f"Unexpected error during prediction, endpoint_name={self._endpoint_name}, "
+                            f"exception={e}")
+                raise
+
     def calculate_cost(self,
                        instance_type: str,
                        instance_count: int,
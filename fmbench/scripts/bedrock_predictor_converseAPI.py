@@ -1,13 +1,33 @@
 import time
-import boto3
 import logging
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional
+from botocore.exceptions import ClientError
+from fmbench.scripts.boto3_clients import get_client
+from fmbench.scripts.token_timings import new_token_times
 
 # set a logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BEDROCK_RUNTIME: str = "bedrock-runtime"
+# botocore does not retry the benchmarked requests, the predictor retries throttled requests
+# so that the time between the attempts is reported as retry_wait_time and not in the latency
+BEDROCK_RUNTIME_RETRY_MODE: str = "standard"
+# botocore max_attempts is the number of retries after the first attempt
+BEDROCK_RUNTIME_MAX_ATTEMPTS: int = 0
+
+
+def get_bedrock_runtime_client(region_name: Optional[str] = None,
+                               max_pool_connections: Optional[int] = None) -> Any:
+    """
+    Get the cached bedrock-runtime client used for the benchmarked requests, without the
+    botocore retries.
+    """
+    return get_client(BEDROCK_RUNTIME,
+                      region_name=region_name,
+                      max_pool_connections=max_pool_connections,
+                      retry_mode=BEDROCK_RUNTIME_RETRY_MODE,
+                      max_attempts=BEDROCK_RUNTIME_MAX_ATTEMPTS)
 
 def invoke_bedrock_converse(
     endpoint_name: str,
@@ -15,7 +35,8 @@ def invoke_bedrock_converse(
     temperature: float,
     max_tokens: int,
     top_p: float,
-    system_prompts: list = [{"text": "You are a helpful AI assistant."}]
+    system_prompts: list = [{"text": "You are a helpful AI assistant."}],
+    bedrock_client: Optional[Any] = None
 ) -> Dict:
     """
     Simple function to invoke Bedrock's converse API.
@@ -26,11 +47,14 @@ def invoke_bedrock_converse(
         max_tokens: Maximum tokens to generate
         top_p: Top-p parameter for inference
         system_prompts: System prompts to use (default provided)
+        bedrock_client: Optional bedrock-runtime client, defaults to the cached client
+                        of the default region
     Returns:
         Dict containing response data
     """
     response: Optional[Dict] = None
-    bedrock_client = boto3.client(BEDROCK_RUNTIME)
+    if bedrock_client is None:
+        bedrock_client = get_bedrock_runtime_client()
     inference_config = {
         "temperature": temperature,
         "maxTokens": max_tokens,
@@ -45,3 +69,115 @@ def invoke_bedrock_converse(
     )
     latency = time.perf_counter() - st
     return response, latency
+
+
+class ConverseStreamParser:
+    """
+    Parses the events of a converse_stream response as they arrive. Each contentBlockDelta
+    is timestamped for the Time To First Token (TTFT) and Time To Last Token (TTLT), the token
+    counts come from the final metadata event so the response does not need to be re-tokenized.
+    A delta can contain more than one token, the Time Per Output Token (TPOT) is the time
+    between the first and the last delta divided by the remaining output tokens. With
+    record_token_times the time of each delta is kept in seconds from the start of the request.
+    """
+
+    def __init__(self, start_time: float, record_token_times: bool = False):
+        self._start_time = start_time
+        self._token_times = new_token_times() if record_token_times else None
+        self._first_delta_time: Optional[float] = None
+        self._last_delta_time: Optional[float] = None
+        self._text: List[str] = []
+        self._usage: Dict = {}
+        self.stop_reason: Optional[str] = None
+
+    def process(self, event: Dict) -> None:
+        """
+        Process a single event of the stream, raises a ClientError for the exception events
+        so that throttling in the middle of a stream is retried like any other throttling error.
+        """
+        if "contentBlockDelta" in event:
+            text = event["contentBlockDelta"]["delta"].get("text")
+            if text:
+                current_time = time.perf_counter()
+                if self._first_delta_time is None:
+                    self._first_delta_time = current_time
+                self._last_delta_time = current_time
+                if self._token_times is not None:
+                    self._token_times.append(current_time - self._start_time)
+                self._text.append(text)
+        elif "messageStop" in event:
+            self.stop_reason = event["messageStop"].get("stopReason")
+        elif "metadata" in event:
+            self._usage = event["metadata"].get("usage", {})
+        else:
+            error = next((k for k in event if k.endswith("Exception")), None)
+            if error is not None:
+                raise ClientError({"Error": {"Code": error[0].upper() + error[1:],
+                                             "Message": event[error].get("message", "")}},
+                                  "ConverseStream")
+
+    def result(self) -> Dict:
+        """
+        Returns:
+            Dictionary with the generated_text, the prompt_tokens and completion_tokens, the
+            latency, TTFT, TPOT and TTLT in seconds and the token_times
+        """
+        latency = time.perf_counter() - self._start_time
+        completion_tokens = self._usage.get("outputTokens")
+        TTFT: Optional[float] = None
+        TTLT: Optional[float] = None
+        TPOT: Optional[float] = None
+        if self._first_delta_time is not None:
+            TTFT = self._first_delta_time - self._start_time
+            TTLT = self._last_delta_time - self._start_time
+            if completion_tokens is not None and completion_tokens > 1:
+                TPOT = (self._last_delta_time - self._first_delta_time) / (completion_tokens - 1)
+        return dict(generated_text="".join(self._text),
+                    prompt_tokens=self._usage.get("inputTokens"),
+                    completion_tokens=completion_tokens,
+                    latency=latency,
+                    TTFT=TTFT,
+                    TPOT=TPOT,
+                    TTLT=TTLT,
+                    token_times=self._token_times)
+
+
+def invoke_bedrock_converse_stream(
+    endpoint_name: str,
+    messages: list,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    system_prompts: list = [{"text": "You are a helpful AI assistant."}],
+    bedrock_client: Optional[Any] = None,
+    record_token_times: bool = False
+) -> Dict:
+    """
+    Invoke Bedrock's converse_stream API and parse the event stream as it arrives.
+    Args:
+        Same as invoke_bedrock_converse
+        record_token_times: Keep the time of each streamed delta
+    Returns:
+        Dict with the generated text, token counts and streaming latency metrics, see ConverseStreamParser
+    """
+    if bedrock_client is None:
+        bedrock_client = get_bedrock_runtime_client()
+    inference_config = {
+        "temperature": temperature,
+        "maxTokens": max_tokens,
+        "topP": top_p,
+    }
+    st = time.perf_counter()
+    response = bedrock_client.converse_stream(
+        modelId=endpoint_name,
+        messages=messages,
+        system=system_prompts,
+        inferenceConfig=inference_config
+    )
+    parser = ConverseStreamParser(st, record_token_times)
+    for event in response["stream"]:
+        parser.process(event)
+    result = parser.result()
+    logger.info(f"invoke_bedrock_converse_stream, endpoint_name={endpoint_name}, stop_reason={parser.stop_reason}, "
+                f"TTFT={result['TTFT']}, TPOT={result['TPOT']}, TTLT={result['TTLT']}")
+    return result
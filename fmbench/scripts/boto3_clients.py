@@ -0,0 +1,85 @@
+"""
+Cached boto3 clients for FMBench
+
+Creating a boto3 client is slow (it loads the service model from disk) and creating clients
+from many threads at once is not thread safe. The clients are created once per combination
+of service, region, profile and client configuration and shared by all the threads of the
+process, boto3 clients themselves are thread safe.
+
+The clients use the adaptive retry mode (client side rate limiting on throttling errors),
+TCP keep-alive and a connection pool sized to the concurrency level so that concurrent
+requests do not wait for a free connection (the botocore default is 10 connections).
+The bedrock-runtime client of the benchmarked requests has no botocore retries, see
+get_bedrock_runtime_client in bedrock_predictor_converseAPI.py.
+"""
+
+import boto3
+import logging
+import threading
+from botocore.config import Config
+from typing import Any, Dict, Optional, Tuple
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# botocore default pool size
+DEFAULT_MAX_POOL_CONNECTIONS: int = 10
+DEFAULT_RETRY_MODE: str = "adaptive"
+# botocore retries after the first attempt (4 attempts in total)
+DEFAULT_MAX_ATTEMPTS: int = 3
+
+_CLIENTS: Dict[Tuple, Any] = {}
+_SESSIONS: Dict[Optional[str], boto3.session.Session] = {}
+_LOCK = threading.Lock()
+
+
+def get_client(service_name: str,
+               region_name: Optional[str] = None,
+               profile_name: Optional[str] = None,
+               max_pool_connections: Optional[int] = None,
+               retry_mode: str = DEFAULT_RETRY_MODE,
+               max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Any:
+    """
+    Get a cached boto3 client, the client is created on first use.
+
+    Args:
+        service_name: The boto3 service name, for example bedrock-runtime
+        region_name: Optional region, defaults to the region of the session
+        profile_name: Optional AWS profile, defaults to the default credential chain
+        max_pool_connections: Size of the connection pool, at least the number of threads using the client
+        retry_mode: botocore retry mode
+        max_attempts: botocore max_attempts, the number of retries after the first attempt
+
+    Returns:
+        The boto3 client
+    """
+    max_pool_connections = max(max_pool_connections or DEFAULT_MAX_POOL_CONNECTIONS, DEFAULT_MAX_POOL_CONNECTIONS)
+    key = (service_name, region_name, profile_name, max_pool_connections, retry_mode, max_attempts)
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+    with _LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            session = _SESSIONS.get(profile_name)
+            if session is None:
+                session = _SESSIONS[profile_name] = boto3.session.Session(profile_name=profile_name)
+            config = Config(max_pool_connections=max_pool_connections,
+                            retries=dict(mode=retry_mode, max_attempts=max_attempts),
+                            tcp_keepalive=True)
+            client = session.client(service_name, region_name=region_name, config=config)
+            _CLIENTS[key] = client
+            logger.info(f"get_client, created {service_name} client, region_name={region_name}, "
+                        f"profile_name={profile_name}, max_pool_connections={max_pool_connections}, "
+                        f"retry_mode={retry_mode}, max_attempts={max_attempts}")
+    return client
+
+
+def clear_clients() -> None:
+    """
+    Drop all the cached clients, for example after the credentials were changed.
+    """
+    with _LOCK:
+        _CLIENTS.clear()
+        _SESSIONS.clear()
@@ -1,10 +1,11 @@
 import os
 import json
 import math
+import asyncio
 import time
 import boto3
+import httpx
 import logging
-import requests
 import pandas as pd
 from datetime import datetime
 from fmbench.scripts import constants
@@ -12,6 +13,11 @@ from fmbench.utils import count_tokens
 from typing import Dict, Optional, List
 from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
                                                FMBenchPredictionResponse)
+from fmbench.scripts.http_client import (RequestTimings,
+                                         AsyncClientHolder,
+                                         create_client,
+                                         get_client_settings)
+from fmbench.scripts.micro_batcher import MicroBatcher, DEFAULT_MAX_WAIT_MS
 
 # set a logger
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +29,13 @@ class CustomRestPredictor(FMBenchPredictor):
     specified in the configuration file with custom headers, authentication parameters
     and the model_id. This rest predictor can be used with custom parameters. View an 
     example of the parameters passed in this config file: configs/byoe/config-byo-custom-rest-predictor.yml
+
+    If the endpoint accepts an array of prompts, set `batching` in the inference spec to send the
+    concurrent requests in batches (see micro_batcher.py):
+
+        batching:
+          batch_size: 8
+          max_wait_ms: 10
     """
     def __init__(self,
                  endpoint_name: str,
@@ -37,93 +50,201 @@ class CustomRestPredictor(FMBenchPredictor):
             """
             self._endpoint_name: str = endpoint_name
             self._inference_spec: Dict = inference_spec 
+            # one pooled client per predictor so that requests reuse kept-alive connections,
+            # there is no timeout unless the inference spec sets one
+            client_settings = get_client_settings(inference_spec, metadata, None)
+            self._client = create_client(client_settings)
+            self._async_client = AsyncClientHolder(client_settings)
+            # the asynchronous requests are sent in batches if batching is configured
+            batching: Optional[Dict] = (inference_spec or {}).get("batching")
+            self._batcher: Optional[MicroBatcher] = None
+            if batching:
+                self._batcher = MicroBatcher(self._send_batch,
+                                             batching["batch_size"],
+                                             batching.get("max_wait_ms", DEFAULT_MAX_WAIT_MS))
         except Exception as e:
             logger.error(f"create_predictor, exception occured while creating predictor "
                          f"for endpoint_name={self._endpoint_name}, exception={e}")
         logger.info(f"_endpoint_name={self._endpoint_name}, _inference_spec={self._inference_spec}")
 
-    def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
-        # Initialize some variables, including the response, latency, streaming variables, prompt and completion tokens.
-        response_json: Optional[Dict] = None
-        response: Optional[str] = None
-        latency: Optional[float] = None
-        # Streaming can be enabled if the model is deployed on SageMaker or Bedrock
-        TTFT: Optional[float] = None
-        TPOT: Optional[float] = None
-        TTLT: Optional[float] = None
-        prompt_tokens: Optional[int] = None
-        completion_tokens: Optional[int] = None
+    def _get_request_body(self, payload: Dict) -> Dict:
+        # define the generation config, custom headers and model id from the inference spec
+        # that will be used in the payload while FMBench makes predictions on the model endpoint
+        inference_param_set = self._inference_spec.get("parameters")
+        model_id = self._inference_spec.get("model_id")
+        # Prepare the request body - in this request body, we are providing the generation config, prompt
+        # and the model id as given in the inference spec within the FMBench config file. If the inference
+        # parameter set does not exist, then just send in the request without the inference specifications
+        if inference_param_set:
+            request_body = {
+                "model_id": model_id,
+                "prompt": payload['inputs'],
+            } | inference_param_set
+        else:
+            logger.info(f"Using the request body without the generation_config variable")
+            request_body = {
+                "model_id": model_id,
+                "prompt": payload['inputs']
+            }
+        return request_body
+
+    def _parse_response(self,
+                        payload: Dict,
+                        response_data: Dict,
+                        latency: float,
+                        timings: RequestTimings) -> FMBenchPredictionResponse:
         # This is the generated text from the model prediction
         generated_text: Optional[str] = None
-        
+        # Extract the generated text from the completions array
+        if response_data.get("completions"):
+            # This is custom to the endpoint based on the completion format. This will change
+            # based on how your inference container responds to requests.
+            generated_text = response_data["completions"][0].get("text", "")
+        response_json = dict(generated_text=generated_text)
+        # Get completion tokens from the usage information if available
+        # otherwise fall back to counting tokens
+        if response_data.get("usage"):
+            # This is assuming the response data contains a usage field with prompt and input tokens
+            completion_tokens = response_data["usage"].get("completion_tokens")
+            prompt_tokens = response_data["usage"].get("prompt_tokens")
+            logger.info(f"Found 'usage' field in the response data. Prompt tokens: {prompt_tokens}, Completion tokens: {completion_tokens}")
+        else:
+            # This uses the count tokens function. If you have an hf tokenizer to be used, then 
+            # place your hf_token.txt file in the fmbench-read/scripts directory and mention the 
+            # hf model id in the experiments section of the config file in the "hf_tokenizer_model_id"
+            # paramter. The count_tokens function will use that custom tokenizer. If you have a custom
+            # tokenizer, then place the "tokenizer.json" and "config.json" files in the fmbench-read/scripts
+            # directory and FMBench will use that. If none of these options are available, FMBench will use
+            # the default 750-1000 tokens tokenizer.
+            prompt_tokens = count_tokens(payload["inputs"])
+            completion_tokens = count_tokens(generated_text) 
+            logger.info(f"Using the default tokenizer to count the prompt and input tokens. Prompt tokens: {prompt_tokens}, Completion tokens: {completion_tokens}")
+        # Streaming can be enabled if the model is deployed on SageMaker or Bedrock
+        return FMBenchPredictionResponse(
+            response_json=response_json,
+            latency=latency,
+            time_to_first_token=None,
+            time_per_output_token=None,
+            time_to_last_token=None,
+            completion_tokens=completion_tokens,
+            prompt_tokens=prompt_tokens,
+            # connect, TLS and time to first byte of the request
+            **timings.to_dict()
+        )
+
+    def _get_batch_item(self, response_data: Dict, index: int) -> Dict:
+        # The response to a batch has one completion per prompt, in the order of the prompts.
+        # The usage of the whole batch cannot be split between the prompts, so the tokens are
+        # only taken from the usage if each completion has its own usage field
+        completions = response_data.get("completions") or []
+        completion = completions[index] if index < len(completions) else None
+        if completion is None:
+            return {}
+        return dict(completions=[completion], usage=completion.get("usage"))
+
+    def _parse_batch_response(self,
+                              payloads: List[Dict],
+                              response_data: Dict,
+                              latency: float,
+                              timings: RequestTimings) -> List[FMBenchPredictionResponse]:
+        items = [self._get_batch_item(response_data, i) for i in range(len(payloads))]
+        # a prompt without a completion in the response is an error
+        return [self._parse_response(p, item, latency, timings) if item else self._get_empty_response()
+                for p, item in zip(payloads, items)]
+
+    async def _send_batch(self, payloads: List[Dict]) -> List[FMBenchPredictionResponse]:
+        response: Optional[httpx.Response] = None
+        timings = RequestTimings()
         try:
-            # define the generation config, custom headers and model id from the inference spec
-            # that will be used in the payload while FMBench makes predictions on the model endpoint
-            inference_param_set = self._inference_spec.get("parameters")
-            headers = self._inference_spec.get("headers")
-            model_id = self._inference_spec.get("model_id")
-            # Prepare the request body - in this request body, we are providing the generation config, prompt
-            # and the model id as given in the inference spec within the FMBench config file. If the inference
-            # parameter set does not exist, then just send in the request without the inference specifications
-            if inference_param_set:
-                request_body = {
-                    "model_id": model_id,
-                    "prompt": payload['inputs'],
-                } | inference_param_set
-            else:
-                logger.info(f"Using the request body without the generation_config variable")
-                request_body = {
-                    "model_id": model_id,
-                    "prompt": payload['inputs']
-                }
+            # one request with the prompts of all the payloads and the parameters of the first one
+            request_body = self._get_request_body(payloads[0]) | dict(prompt=[p['inputs'] for p in payloads])
+            st = time.perf_counter()
+            response = await self._async_client.get().post(
+                self._endpoint_name,
+                headers=self._inference_spec.get("headers"),
+                json=request_body,
+                extensions={"trace": timings.atrace}
+            )
+            latency = time.perf_counter() - st
+            response.raise_for_status()
+            # the tokens are counted off the event loop if the response has no usage
+            return await asyncio.to_thread(self._parse_batch_response, payloads, response.json(), latency, timings)
+        except Exception as e:
+            logger.error(f"_send_batch, exception occurred while getting predictions for {len(payloads)} payloads "
+                         f"from predictor={self._endpoint_name}, response={response}, exception={e}")
+        return [self._get_empty_response() for _ in payloads]
+
+    async def _aget_batched_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        result = await self._batcher.submit(payload)
+        response = result.value
+        # the latency of an item includes the time it waited for its batch to be sent
+        if response["latency"] is not None:
+            response["latency"] += result.wait_time
+        response["batch_size"] = result.batch_size
+        response["batch_wait_time"] = result.wait_time
+        return response
+
+    def _get_empty_response(self) -> FMBenchPredictionResponse:
+        return FMBenchPredictionResponse(
+            response_json=None,
+            latency=None,
+            time_to_first_token=None,
+            time_per_output_token=None,
+            time_to_last_token=None,
+            completion_tokens=None,
+            prompt_tokens=None
+        )
+
+    def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        response: Optional[httpx.Response] = None
+        timings = RequestTimings()
+        try:
+            request_body = self._get_request_body(payload)
             # Start the timer to measure the latency of the prediction made to the endpoint
             st = time.perf_counter()
-            # Make POST request including the headers, the request body, and the endpoint url.
-            response = requests.post(
+            # Make POST request including the headers, the request body, and the endpoint url
+            # on the pooled client of this predictor
+            response = self._client.post(
                 self._endpoint_name,
-                headers=headers,
-                json=request_body
+                headers=self._inference_spec.get("headers"),
+                json=request_body,
+                extensions={"trace": timings.trace}
             )
             # measure the total latency to make the POST request to the endpoint
             latency = time.perf_counter() - st
             response.raise_for_status()
-            response_data = response.json()
-            # Extract the generated text from the completions array
-            if response_data.get("completions"):
-                # This is custom to the endpoint based on the completion format. This will change
-                # based on how your inference container responds to requests.
-                generated_text = response_data["completions"][0].get("text", "")
-            response_json = dict(generated_text=generated_text)
-            # Get completion tokens from the usage information if available
-            # otherwise fall back to counting tokens
-            if response_data.get("usage"):
-                # This is assuming the response data contains a usage field with prompt and input tokens
-                completion_tokens = response_data["usage"].get("completion_tokens")
-                prompt_tokens = response_data["usage"].get("prompt_tokens")
-                logger.info(f"Found 'usage' field in the response data. Prompt tokens: {prompt_tokens}, Completion tokens: {completion_tokens}")
-            else:
-                # This uses the count tokens function. If you have an hf tokenizer to be used, then 
-                # place your hf_token.txt file in the fmbench-read/scripts directory and mention the 
-                # hf model id in the experiments section of the config file in the "hf_tokenizer_model_id"
-                # paramter. The count_tokens function will use that custom tokenizer. If you have a custom
-                # tokenizer, then place the "tokenizer.json" and "config.json" files in the fmbench-read/scripts
-                # directory and FMBench will use that. If none of these options are available, FMBench will use
-                # the default 750-1000 tokens tokenizer.
-                prompt_tokens = count_tokens(payload["inputs"])
-                completion_tokens = count_tokens(generated_text) 
-                logger.info(f"Using the default tokenizer to count the prompt and input tokens. Prompt tokens: {prompt_tokens}, Completion tokens: {completion_tokens}")
-        except requests.exceptions.RequestException as e:
+            return self._parse_response(payload, response.json(), latency, timings)
+        except Exception as e:
             logger.error(f"get_prediction, exception occurred while getting prediction for payload={payload} "
                         f"from predictor={self._endpoint_name}, response={response}, exception={e}")
-        return FMBenchPredictionResponse(
-            response_json=response_json,
-            latency=latency,
-            time_to_first_token=TTFT,
-            time_per_output_token=TPOT,
-            time_to_last_token=TTLT,
-            completion_tokens=completion_tokens,
-            prompt_tokens=prompt_tokens
-        )
+        return self._get_empty_response()
+
+    async def aget_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        """Asynchronous version of get_prediction that does not block a thread while
+           waiting for the endpoint.
+           With batching the payload is sent in a batch with other concurrent payloads.
+        """
+        if self._batcher is not None:
+            return await self._aget_batched_prediction(payload)
+        response: Optional[httpx.Response] = None
+        timings = RequestTimings()
+        try:
+            request_body = self._get_request_body(payload)
+            st = time.perf_counter()
+            response = await self._async_client.get().post(
+                self._endpoint_name,
+                headers=self._inference_spec.get("headers"),
+                json=request_body,
+                extensions={"trace": timings.atrace}
+            )
+            latency = time.perf_counter() - st
+            response.raise_for_status()
+            # the tokens are counted off the event loop if the response has no usage
+            return await asyncio.to_thread(self._parse_response, payload, response.json(), latency, timings)
+        except Exception as e:
+            logger.error(f"aget_prediction, exception occurred while getting prediction for payload={payload} "
+                        f"from predictor={self._endpoint_name}, response={response}, exception={e}")
+        return self._get_empty_response()
         
     @property
     def endpoint_name(self) -> str:
@@ -175,6 +296,8 @@ class CustomRestPredictor(FMBenchPredictor):
         """Represents the function to shutdown the predictor
            cleanup the endpooint/container/other resources
         """
+        self._client.close()
+        self._async_client.close()
         return None
     
     @property
@@ -0,0 +1,399 @@
+"""
+Distributed load generation for FMBench
+
+A single load generator host cannot saturate large endpoints (provisioned throughput,
+big EKS clusters). The distributed runner spreads the requests of each chunk (or the
+request list of the open and closed loop modes) across worker hosts:
+
+- each worker host runs `python -m fmbench.scripts.distributed_runner --host <ip> --port 5555`
+  with the shared token of the run in the FMBENCH_WORKER_TOKEN environment variable
+- the inference notebook (the coordinator) connects to the workers listed in the
+  `load_generation.workers` config parameter, sends each worker the arguments to create
+  the predictor of the experiment, and for every chunk sends each worker its shard of the
+  payloads together with a common start timestamp a little in the future
+- the workers wait until the start timestamp, run their shard and stream every per
+  inference record back to the coordinator, which merges them so that the per inference
+  and per chunk outputs are the same as for a single host run
+
+Messages are JSON objects sent over TCP, each one prefixed with its length as a 4 byte
+big endian integer. The start timestamp is in epoch seconds so the clocks of the hosts
+need to be synchronized (for example with NTP or chrony).
+
+A worker creates predictors and sends requests with its own AWS credentials for whoever
+connects to it, so it only listens on 127.0.0.1 by default and every coordinator has to
+send the shared token in its setup message. The protocol is not encrypted, the workers are
+meant to be reached over a private network.
+"""
+
+import os
+import hmac
+import json
+import time
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+from array import array
+from typing import Dict, List, Tuple, Callable, Any, Optional
+from fmbench.scripts.worker_pool import merge_stats
+from fmbench.scripts.multiprocess_runner import (run_shard,
+                                                 shard_payloads,
+                                                 shard_concurrency,
+                                                 shard_load_generation)
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKER_PORT: int = 5555
+# the common start timestamp is this far in the future when a run is sent to the workers,
+# it needs to be larger than the time it takes to send the payloads to all the workers
+DEFAULT_START_DELAY_SECONDS: float = 2.0
+# how long the coordinator keeps retrying to connect to a worker that is still starting up
+CONNECT_TIMEOUT_SECONDS: float = 60.0
+CONNECT_RETRY_INTERVAL_SECONDS: float = 0.5
+DEFAULT_WORKER_HOST: str = "127.0.0.1"
+# environment variable with the token shared by the coordinator and the workers
+WORKER_TOKEN_ENV_VAR: str = "FMBENCH_WORKER_TOKEN"
+# size limit of the first message of a connection, before the coordinator is authenticated
+MAX_SETUP_MESSAGE_BYTES: int = 1024 * 1024
+
+# message types
+MSG_SETUP: str = "setup"
+MSG_READY: str = "ready"
+MSG_RUN: str = "run"
+MSG_RECORD: str = "record"
+MSG_DONE: str = "done"
+MSG_ERROR: str = "error"
+MSG_SHUTDOWN: str = "shutdown"
+
+_HEADER = struct.Struct(">I")
+
+
+def _json_default(value: Any) -> Any:
+    # the per token timings of a record are sent as a list
+    if isinstance(value, array):
+        return value.tolist()
+    return str(value)
+
+
+def encode_message(message: Dict) -> bytes:
+    """
+    Encode a message as a length prefixed JSON frame.
+    """
+    body = json.dumps(message, default=_json_default).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+
+async def read_message(reader: asyncio.StreamReader, max_size: Optional[int] = None) -> Optional[Dict]:
+    """
+    Read a length prefixed JSON frame, returns None if the connection was closed.
+    Raises ValueError if the frame is larger than max_size bytes.
+    """
+    try:
+        header = await reader.readexactly(_HEADER.size)
+        size = _HEADER.unpack(header)[0]
+        if max_size is not None and size > max_size:
+            raise ValueError(f"message of {size} bytes is larger than {max_size} bytes")
+        body = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+    return json.loads(body)
+
+
+def get_worker_token(token: Optional[str] = None) -> str:
+    """
+    Get the token shared by the coordinator and the workers, the token argument if set
+    and the FMBENCH_WORKER_TOKEN environment variable otherwise.
+    """
+    token = token or os.environ.get(WORKER_TOKEN_ENV_VAR)
+    if not token:
+        raise ValueError(f"a worker token is required, set the {WORKER_TOKEN_ENV_VAR} environment variable "
+                         f"(or load_generation worker_token on the coordinator)")
+    return token
+
+
+async def _authenticate(reader: asyncio.StreamReader, token: str) -> Optional[Dict]:
+    # the first message has to be a setup message with the shared token
+    try:
+        message = await read_message(reader, MAX_SETUP_MESSAGE_BYTES)
+    except ValueError as e:
+        logger.warning(f"worker, invalid first message, exception={e}")
+        return None
+    if not isinstance(message, dict) or message.get("type") != MSG_SETUP:
+        return None
+    if not hmac.compare_digest(str(message.get("token", "")).encode("utf-8"), token.encode("utf-8")):
+        return None
+    return message
+
+
+def parse_worker_address(address: str) -> Tuple[str, int]:
+    """
+    Parse a worker address of the form host:port, the port defaults to DEFAULT_WORKER_PORT.
+    """
+    host, _, port = address.rpartition(":")
+    if host == "":
+        return address, DEFAULT_WORKER_PORT
+    return host, int(port)
+
+
+async def _handle_coordinator(reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter,
+                              sender_factory: Callable[..., Any],
+                              token: str) -> None:
+    peer = writer.get_extra_info("peername")
+    message = await _authenticate(reader, token)
+    if message is None:
+        logger.warning(f"worker, rejected connection from {peer}, authentication failed")
+        writer.write(encode_message(dict(type=MSG_ERROR, message="authentication failed")))
+        writer.close()
+        return
+    logger.info(f"worker, coordinator connected from {peer}")
+    sender: Optional[Any] = None
+
+    def on_response(response: Dict) -> None:
+        writer.write(encode_message(dict(type=MSG_RECORD, record=response)))
+
+    try:
+        while message is not None and message["type"] != MSG_SHUTDOWN:
+            try:
+                if message["type"] == MSG_SETUP:
+                    if sender is not None:
+                        sender.shutdown()
+                    sender = sender_factory(**message["sender_args"])
+                    writer.write(encode_message(dict(type=MSG_READY)))
+                elif message["type"] == MSG_RUN:
+                    delay = message["start_at"] - time.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        logger.warning(f"worker, start timestamp was {-delay:.3f} seconds ago, "
+                                       f"the clocks of the hosts may not be synchronized")
+                    await run_shard(sender,
+                                    message["payloads"],
+                                    message["concurrency"],
+                                    message["payload_file"],
+                                    message["load_generation"],
+                                    on_response)
+                    writer.write(encode_message(dict(type=MSG_DONE,
+                                                     end_time=time.time(),
+                                                     stats=sender.stats())))
+                else:
+                    raise ValueError(f"unknown message type \"{message['type']}\"")
+            except Exception as e:
+                logger.error(f"worker, error while handling message type={message['type']}, exception={e}")
+                writer.write(encode_message(dict(type=MSG_ERROR, message=str(e))))
+            await writer.drain()
+            message = await read_message(reader)
+    finally:
+        if sender is not None:
+            sender.shutdown()
+        writer.close()
+        logger.info(f"worker, coordinator {peer} disconnected")
+
+
+async def serve_worker(host: str, port: int, sender_factory: Callable[..., Any], token: str) -> None:
+    """
+    Run a worker that accepts connections from a coordinator until it is cancelled.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on
+        sender_factory: Called with the sender_args sent by the coordinator, see MultiProcessRunner
+        token: Token the coordinators have to send in their setup message
+    """
+    token = get_worker_token(token)
+    server = await asyncio.start_server(lambda r, w: _handle_coordinator(r, w, sender_factory, token), host, port)
+    logger.info(f"worker, listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def run_worker(host: str,
+               port: int,
+               sender_factory: Optional[Callable[..., Any]] = None,
+               token: Optional[str] = None) -> None:
+    """
+    Blocking entry point for a worker, the predictors are created with
+    fmbench.scripts.inference.InferenceSender unless a sender_factory is provided.
+    The token defaults to the FMBENCH_WORKER_TOKEN environment variable.
+    """
+    token = get_worker_token(token)
+    if sender_factory is None:
+        from fmbench.scripts.inference import InferenceSender
+        sender_factory = InferenceSender
+    asyncio.run(serve_worker(host, port, sender_factory, token))
+
+
+class _WorkerConnection:
+    def __init__(self, address: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.address = address
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, message: Dict) -> None:
+        self.writer.write(encode_message(message))
+        await self.writer.drain()
+
+    async def receive(self) -> Dict:
+        message = await read_message(self.reader)
+        if message is None:
+            raise RuntimeError(f"DistributedRunner, worker {self.address} closed the connection")
+        if message["type"] == MSG_ERROR:
+            raise RuntimeError(f"DistributedRunner, worker {self.address} failed: {message['message']}")
+        return message
+
+
+class DistributedRunner:
+    """
+    Coordinator that shards the payloads across worker hosts, starts them at a common
+    timestamp and merges the per inference records they stream back. Has the same run,
+    stats and shutdown interface as MultiProcessRunner, call start() before the first run.
+    The token defaults to the FMBENCH_WORKER_TOKEN environment variable.
+    """
+
+    def __init__(self,
+                 worker_addresses: List[str],
+                 sender_args: Dict,
+                 start_delay_seconds: float = DEFAULT_START_DELAY_SECONDS,
+                 token: Optional[str] = None):
+        self._worker_addresses = worker_addresses
+        self._sender_args = sender_args
+        self._token = get_worker_token(token)
+        self._start_delay_seconds = start_delay_seconds
+        self._workers: List[_WorkerConnection] = []
+        self._stats: Dict = {}
+        self._is_shutdown = False
+
+    @property
+    def num_processes(self) -> int:
+        """The number of workers."""
+        return len(self._worker_addresses)
+
+    async def _connect(self, address: str) -> _WorkerConnection:
+        host, port = parse_worker_address(address)
+        deadline = time.perf_counter() + CONNECT_TIMEOUT_SECONDS
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                break
+            except OSError as e:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f"DistributedRunner, could not connect to worker {address}, exception={e}")
+                await asyncio.sleep(CONNECT_RETRY_INTERVAL_SECONDS)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return _WorkerConnection(address, reader, writer)
+
+    async def _setup(self, worker: _WorkerConnection) -> None:
+        await worker.send(dict(type=MSG_SETUP, token=self._token, sender_args=self._sender_args))
+        await worker.receive()
+
+    async def start(self) -> None:
+        """
+        Connect to all the workers and have each of them create its sender.
+        """
+        st = time.perf_counter()
+        self._workers = list(await asyncio.gather(*[self._connect(a) for a in self._worker_addresses]))
+        try:
+            await asyncio.gather(*[self._setup(w) for w in self._workers])
+        except Exception:
+            self.shutdown()
+            raise
+        logger.info(f"DistributedRunner, {len(self._workers)} workers ready "
+                    f"in {time.perf_counter() - st:.2f} seconds")
+
+    async def _collect(self, worker: _WorkerConnection, responses: List[Dict]) -> Tuple[float, Dict]:
+        while True:
+            message = await worker.receive()
+            if message["type"] == MSG_RECORD:
+                responses.append(message["record"])
+            elif message["type"] == MSG_DONE:
+                return message["end_time"], message["stats"]
+
+    async def run(self,
+                  payloads: List[Dict],
+                  concurrency: int,
+                  payload_file: str,
+                  load_generation: Dict) -> Tuple[List[Dict], float]:
+        """
+        Shard the payloads across the workers, start them at a common timestamp
+        and wait for all of them.
+
+        Args:
+            payloads: The chunk, or the request list for the open and closed loop modes
+            concurrency: Concurrency level for this combination, split across the workers
+            payload_file: Payload file the payloads come from
+            load_generation: Load generation settings from get_load_generation_config
+
+        Returns:
+            Tuple of the per request records of all the workers and the elapsed time in seconds
+            from the common start timestamp to the end of the last worker
+        """
+        if self._is_shutdown:
+            raise RuntimeError("DistributedRunner has been shut down")
+        num_shards = max(1, min(len(self._workers), concurrency, len(payloads)))
+        payload_shards = shard_payloads(payloads, num_shards)
+        concurrency_shards = shard_concurrency(concurrency, num_shards)
+        start_at = time.time() + self._start_delay_seconds
+        logger.info(f"DistributedRunner, running {len(payloads)} payloads with concurrency={concurrency} "
+                    f"on {num_shards} workers, payloads per worker={[len(s) for s in payload_shards]}, "
+                    f"start_at={start_at}")
+        responses: List[Dict] = []
+        try:
+            await asyncio.gather(*[self._workers[i].send(dict(type=MSG_RUN,
+                                                              payloads=payload_shards[i],
+                                                              concurrency=concurrency_shards[i],
+                                                              payload_file=payload_file,
+                                                              load_generation=shard_load_generation(load_generation,
+                                                                                                    i,
+                                                                                                    num_shards),
+                                                              start_at=start_at))
+                                   for i in range(num_shards)])
+            results = await asyncio.gather(*[self._collect(self._workers[i], responses)
+                                             for i in range(num_shards)])
+        except Exception:
+            # records of a failed run may still be in flight, do not reuse the connections
+            self.shutdown()
+            raise
+        elapsed = max(end_time for end_time, _ in results) - start_at
+        self._stats = merge_stats([stats for _, stats in results])
+        return responses, elapsed
+
+    def stats(self) -> Dict:
+        """
+        Get the merged worker pool stats of the workers for the last run.
+        """
+        return dict(self._stats)
+
+    def shutdown(self) -> None:
+        """
+        Ask the workers to release their senders and close the connections, idempotent.
+        The workers keep running and accept the next coordinator.
+        """
+        if self._is_shutdown:
+            return
+        self._is_shutdown = True
+        logger.info(f"DistributedRunner, disconnecting from {len(self._workers)} workers")
+        for worker in self._workers:
+            if not worker.writer.is_closing():
+                worker.writer.write(encode_message(dict(type=MSG_SHUTDOWN)))
+                worker.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an FMBench distributed load generation worker.')
+    parser.add_argument('--host', type=str, default=DEFAULT_WORKER_HOST,
+                        help=f'Interface to listen on, default {DEFAULT_WORKER_HOST}, use the private IP '
+                             f'of the host (or 0.0.0.0) to accept coordinators on other hosts')
+    parser.add_argument('--port', type=int, default=DEFAULT_WORKER_PORT,
+                        help=f'Port to listen on, default {DEFAULT_WORKER_PORT}')
+    args = parser.parse_args()
+    # the token is read from the environment and not from an argument that other users of the host can see
+    run_worker(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
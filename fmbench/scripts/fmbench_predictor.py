@@ -1,6 +1,9 @@
+import asyncio
 import pandas as pd
+from array import array
 from datetime import datetime
 from typing import Dict, Optional
+from dataclasses import dataclass
 from abc import ABC, abstractmethod, abstractproperty
 
 
@@ -17,6 +20,13 @@ class FMBenchPredictor(ABC):
     def get_prediction(self, payload: Dict) -> Dict:
         pass
 
+    async def aget_prediction(self, payload: Dict) -> Dict:
+        """Represents the asynchronous version of get_prediction.
+           Predictors that can make non-blocking calls to the endpoint
+           override this, the default runs get_prediction in a thread.
+        """
+        return await asyncio.to_thread(self.get_prediction, payload)
+
     @abstractmethod
     def calculate_cost(self,
                        instance_type: str,
@@ -62,6 +72,14 @@ class FMBenchPredictor(ABC):
         pass
 
 
+def has_native_async_prediction(predictor) -> bool:
+    """Returns True if the predictor overrides aget_prediction with
+       a native asynchronous implementation.
+    """
+    aget_prediction = getattr(type(predictor), "aget_prediction", None)
+    return aget_prediction is not None and aget_prediction is not FMBenchPredictor.aget_prediction
+
+
 class FMBenchPredictionResponse(dict):
 
     def __init__(self, *k, **kwargs):
@@ -71,3 +89,42 @@ class FMBenchPredictionResponse(dict):
         self.__dict__['prompt_tokens'] = kwargs['prompt_tokens']
         self.__dict__['completion_tokens'] = kwargs['completion_tokens']
         super().__init__(*k, **kwargs)
+
+
+@dataclass(frozen=True, slots=True)
+class PredictionRecord:
+    """Immutable result of a single prediction. Each call of a predictor builds its own
+       record from local variables, nothing is kept on the predictor instance that is
+       shared by the concurrent calls. to_response converts it to the response returned
+       by get_prediction.
+    """
+    generated_text: Optional[str]
+    latency: Optional[float]
+    prompt_tokens: Optional[int]
+    completion_tokens: Optional[int]
+    time_to_first_token: Optional[float] = None
+    time_per_output_token: Optional[float] = None
+    time_to_last_token: Optional[float] = None
+    rate_limit_wait_time: Optional[float] = None
+    retry_wait_time: Optional[float] = None
+    # set when the provider did not report the token counts, they are then counted
+    # with the tokenizer of this model after the run (see inference.count_missing_tokens)
+    token_count_model: Optional[str] = None
+    # seconds from the start of the request to each streamed token, only with
+    # token_timings enabled (see token_timings.py)
+    token_times: Optional[array] = None
+
+    def to_response(self) -> FMBenchPredictionResponse:
+        """Get a new FMBenchPredictionResponse with the values of this record."""
+        return FMBenchPredictionResponse(
+            response_json=dict(generated_text=self.generated_text) if self.generated_text is not None else {},
+            latency=self.latency,
+            time_to_first_token=self.time_to_first_token,
+            time_per_output_token=self.time_per_output_token,
+            time_to_last_token=self.time_to_last_token,
+            completion_tokens=self.completion_tokens,
+            prompt_tokens=self.prompt_tokens,
+            rate_limit_wait_time=self.rate_limit_wait_time,
+            retry_wait_time=self.retry_wait_time,
+            token_count_model=self.token_count_model,
+            token_times=self.token_times)
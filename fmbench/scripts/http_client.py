@@ -0,0 +1,190 @@
+"""
+Pooled HTTP clients for the REST predictors
+
+Each predictor keeps one httpx client for all of its requests instead of opening a new
+connection per request, so that requests reuse kept-alive connections and do not pay the
+TCP and TLS setup (or run out of ephemeral ports) at high concurrency. HTTP/2 is used if
+the h2 package is installed and the endpoint supports it.
+
+The clients are configured from the inference_spec of the experiment:
+
+    inference_spec:
+      # total timeout of a request in seconds
+      timeout: 180
+      # optional, timeout to establish a connection in seconds
+      connect_timeout: 10
+      # optional, defaults to the maximum concurrency level of the run
+      max_connections: 64
+      # optional, defaults to yes if the h2 package is installed
+      http2: yes
+
+Every request also records when its connection was established, when the TLS handshake
+finished and when the first byte of the response was received (see RequestTimings).
+"""
+
+import time
+import httpx
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional h2 package
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# connections kept in the pool when the maximum concurrency level is not known
+DEFAULT_MAX_CONNECTIONS: int = 100
+# idle connections are closed after this many seconds
+DEFAULT_KEEPALIVE_EXPIRY: float = 60.0
+
+# tasks closing async clients, referenced until they are done
+_closing_tasks: Set[asyncio.Task] = set()
+
+
+def get_client_settings(inference_spec: Optional[Dict],
+                        metadata: Optional[Dict],
+                        default_timeout: Optional[float]) -> Dict:
+    """
+    Get the HTTP client settings of a predictor.
+
+    Args:
+        inference_spec: Inference spec from the experiment
+        metadata: Predictor metadata, the pool is sized to its max_concurrency if set
+        default_timeout: Total timeout in seconds if the inference spec has none, None for no timeout
+
+    Returns:
+        Dictionary with the timeout, connect_timeout, max_connections and http2 settings
+    """
+    inference_spec = inference_spec or {}
+    metadata = metadata or {}
+    settings = dict(timeout=inference_spec.get("timeout", default_timeout),
+                    connect_timeout=inference_spec.get("connect_timeout"),
+                    max_connections=inference_spec.get("max_connections",
+                                                       metadata.get("max_concurrency", DEFAULT_MAX_CONNECTIONS)),
+                    http2=inference_spec.get("http2", HTTP2_AVAILABLE))
+    if settings["http2"] and not HTTP2_AVAILABLE:
+        logger.warning("get_client_settings, http2 is enabled but the h2 package is not installed, using HTTP/1.1")
+        settings["http2"] = False
+    return settings
+
+
+def _get_client_args(settings: Dict) -> Dict:
+    timeout = settings["timeout"]
+    connect_timeout = settings["connect_timeout"] if settings["connect_timeout"] is not None else timeout
+    return dict(timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=settings["max_connections"],
+                                    max_keepalive_connections=settings["max_connections"],
+                                    keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY),
+                http2=settings["http2"])
+
+
+def create_client(settings: Dict) -> httpx.Client:
+    """
+    Create a pooled client from get_client_settings, the client is thread safe.
+    """
+    logger.info(f"create_client, settings={settings}")
+    return httpx.Client(**_get_client_args(settings))
+
+
+class AsyncClientHolder:
+    """
+    Holds a pooled async client. An async client is bound to the event loop it is first used
+    on, a new client is created if the predictor is used from a different event loop.
+    """
+
+    def __init__(self, settings: Dict):
+        self._settings = settings
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self) -> httpx.AsyncClient:
+        """Get the client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            if self._client is not None:
+                _close_async_client(self._client, self._loop)
+            logger.info(f"AsyncClientHolder, creating async client, settings={self._settings}")
+            self._client = httpx.AsyncClient(**_get_client_args(self._settings))
+            self._loop = loop
+        return self._client
+
+    def close(self) -> None:
+        """Close the client and its pooled connections."""
+        if self._client is not None:
+            _close_async_client(self._client, self._loop)
+        self._client = None
+        self._loop = None
+
+
+def _close_async_client(client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop) -> None:
+    # httpx does not close an async client when it is garbage collected, its connections
+    # can only be closed on the event loop that owns them
+    try:
+        try:
+            running_loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if loop is running_loop:
+            task = loop.create_task(client.aclose())
+            _closing_tasks.add(task)
+            task.add_done_callback(_closing_tasks.discard)
+        elif loop.is_closed():
+            # the transports of a closed loop cannot be closed gracefully, their sockets
+            # are closed when they are garbage collected
+            logger.warning("AsyncClientHolder, the event loop of the async client is closed, "
+                           "its connections are dropped")
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        elif running_loop is None:
+            loop.run_until_complete(client.aclose())
+        else:
+            logger.warning("AsyncClientHolder, the event loop of the async client is not running, "
+                           "its connections are dropped")
+    except Exception as e:
+        logger.warning(f"AsyncClientHolder, exception while closing the async client, exception={e}")
+
+
+class RequestTimings:
+    """
+    Records the phases of a request from the httpcore trace events, pass trace (or atrace
+    for an async client) as the "trace" request extension. Times are in seconds.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._events: Dict[str, float] = {}
+
+    def trace(self, event_name: str, info: Dict) -> None:
+        # only the first occurrence of an event is kept, for example the
+        # response headers of the request and not of a redirect
+        self._events.setdefault(event_name, time.perf_counter())
+
+    async def atrace(self, event_name: str, info: Dict) -> None:
+        self.trace(event_name, info)
+
+    def _get_duration(self, step: str) -> float:
+        started = self._events.get(f"connection.{step}.started")
+        complete = self._events.get(f"connection.{step}.complete")
+        # a request on a kept-alive connection has no connect and TLS steps
+        if started is None or complete is None:
+            return 0.0
+        return complete - started
+
+    def to_dict(self) -> Dict:
+        """
+        Returns:
+            Dictionary with connect_time, tls_time and time_to_first_byte (from the start of
+            the request to the response headers, None if no response was received)
+        """
+        first_byte = next((t for name, t in self._events.items()
+                           if name.endswith("receive_response_headers.complete")), None)
+        return dict(connect_time=self._get_duration("connect_tcp"),
+                    tls_time=self._get_duration("start_tls"),
+                    time_to_first_byte=first_byte - self._start if first_byte is not None else None)
@@ -0,0 +1,172 @@
+"""
+Incremental metric aggregation for FMBench
+
+Keeping every per inference record of a run in memory (with the prompts, completions and
+base64 images) to build the per inference results file at the end takes many GB for long
+context or multimodal runs. The aggregator instead updates running counters and latency
+histograms (see latency_histogram.py) per combination of experiment, concurrency level and
+payload file as the records of each chunk arrive, and spills the records to a local JSON
+lines spool file. At the end of the run:
+
+- summary: one row per combination from the aggregates (requests, error rate, token counts
+  and throughputs, and the latency, TTFT, TPOT and TTLT percentiles of all its requests)
+- write_records_csv: the per inference results file, streamed from the spool one record
+  at a time with the endpoint columns of each experiment added
+
+so that the memory used by the run does not grow with the number of requests.
+"""
+
+import os
+import csv
+import json
+import logging
+import tempfile
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from fmbench.scripts.load_generator import PHASE_MEASURE
+from fmbench.scripts.latency_histogram import (LatencyHistogram,
+                                               HISTOGRAM_METRICS,
+                                               SUMMARY_PERCENTILES)
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# per inference record keys that identify a combination
+COMBINATION_KEYS: List[str] = ["experiment_name", "concurrency", "payload_file"]
+
+
+@dataclass
+class CombinationAggregate:
+    """Running counters and histograms of the records of one combination."""
+    transactions: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    elapsed_seconds: float = 0.0
+    histograms: Dict[str, LatencyHistogram] = field(
+        default_factory=lambda: {key: LatencyHistogram() for key in HISTOGRAM_METRICS})
+
+    def add(self, records: List[Dict], elapsed_seconds: float) -> None:
+        self.transactions += len(records)
+        # same definition of an error as calculate_metrics
+        self.errors += sum(1 for r in records if r.get("completion") is None or r.get("completion_tokens") is None)
+        self.prompt_tokens += sum(r.get("prompt_tokens") or 0 for r in records)
+        self.completion_tokens += sum(r.get("completion_tokens") or 0 for r in records)
+        self.elapsed_seconds += elapsed_seconds
+        for key, histogram in self.histograms.items():
+            # falsy values are skipped as in calculate_metrics
+            histogram.record_values(r.get(key) or None for r in records)
+
+    def to_dict(self) -> Dict:
+        successes = self.transactions - self.errors
+        row = dict(transactions=self.transactions,
+                   successes=successes,
+                   error_rate=self.errors / self.transactions if self.transactions else None,
+                   all_prompts_token_count=self.prompt_tokens,
+                   prompt_token_count_mean=self.prompt_tokens / successes if successes else None,
+                   all_completions_token_count=self.completion_tokens,
+                   completion_token_count_mean=self.completion_tokens / successes if successes else None,
+                   elapsed_seconds=self.elapsed_seconds)
+        elapsed = self.elapsed_seconds or None
+        row["prompt_token_throughput"] = self.prompt_tokens / elapsed if elapsed else None
+        row["completion_token_throughput"] = self.completion_tokens / elapsed if elapsed else None
+        row["transactions_per_minute"] = 60 * successes / elapsed if elapsed else None
+        for key, prefix in HISTOGRAM_METRICS.items():
+            values = self.histograms[key].percentiles(SUMMARY_PERCENTILES)
+            row |= {f"{prefix}_p{q}": v for q, v in zip(SUMMARY_PERCENTILES, values)}
+        return row
+
+
+class IncrementalAggregator:
+    """
+    Aggregates the per inference records of a run chunk by chunk and spills the records to
+    a local spool file, see the module docstring.
+
+    Args:
+        spool_dir: Directory of the spool file, defaults to the temporary directory
+    """
+
+    def __init__(self, spool_dir: Optional[str] = None):
+        fd, self._spool_path = tempfile.mkstemp(prefix="fmbench-records-", suffix=".jsonl", dir=spool_dir)
+        self._spool = os.fdopen(fd, "w", encoding="utf-8")
+        # columns of the records in the order they were first seen
+        self._columns: Dict[str, None] = {}
+        self._aggregates: Dict[Tuple, CombinationAggregate] = {}
+        self.record_count: int = 0
+
+    def add(self, records: List[Dict], elapsed_seconds: float) -> None:
+        """
+        Add the records of a chunk.
+
+        Args:
+            records: Per inference records, with the experiment_name, concurrency and payload_file
+            elapsed_seconds: Time the chunk took (the measure phase with warm-up and cool-down phases),
+                             the throughputs of a combination are over the sum of its chunks
+        """
+        by_combination: Dict[Tuple, List[Dict]] = {}
+        for r in records:
+            self._spool.write(json.dumps(r, default=str))
+            self._spool.write("\n")
+            for k in r:
+                self._columns.setdefault(k, None)
+            # records of the warm-up and cool-down phases are spilled but not aggregated
+            if r.get("phase", PHASE_MEASURE) == PHASE_MEASURE:
+                by_combination.setdefault(tuple(r.get(k) for k in COMBINATION_KEYS), []).append(r)
+        self.record_count += len(records)
+        # the elapsed time is added once per chunk even if the chunk has no measured records
+        if not by_combination and records:
+            by_combination[tuple(records[0].get(k) for k in COMBINATION_KEYS)] = []
+        for key, combination_records in by_combination.items():
+            aggregate = self._aggregates.get(key)
+            if aggregate is None:
+                aggregate = self._aggregates[key] = CombinationAggregate()
+            aggregate.add(combination_records, elapsed_seconds)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Get the metrics of each combination.
+
+        Returns:
+            Dataframe with the experiment_name, concurrency and payload_file and the
+            metrics of each combination
+        """
+        rows = [dict(zip(COMBINATION_KEYS, key)) | aggregate.to_dict()
+                for key, aggregate in self._aggregates.items()]
+        return pd.DataFrame(rows)
+
+    def write_records_csv(self, path: str, experiment_columns: Optional[Dict[str, Dict[str, Any]]] = None) -> int:
+        """
+        Write the spilled records as CSV, one record at a time.
+
+        Args:
+            path: Path of the CSV file
+            experiment_columns: Columns to add to the records of each experiment name, for
+                                example the instance type, these override the record values
+
+        Returns:
+            Number of records written
+        """
+        experiment_columns = experiment_columns or {}
+        self._spool.flush()
+        columns = list(self._columns)
+        for extra in experiment_columns.values():
+            columns += [c for c in extra if c not in columns]
+        count: int = 0
+        with open(self._spool_path, encoding="utf-8") as spool, open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for line in spool:
+                record = json.loads(line)
+                record |= experiment_columns.get(record.get("experiment_name"), {})
+                writer.writerow(record)
+                count += 1
+        logger.info(f"write_records_csv, wrote {count} records with {len(columns)} columns to {path}")
+        return count
+
+    def close(self) -> None:
+        """Delete the spool file."""
+        self._spool.close()
+        if os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
@@ -0,0 +1,326 @@
+"""
+Per request inference functions for FMBench
+
+These functions send a single payload to a predictor and turn the prediction into the
+per inference record that is written to the metrics per inference directory. They are used
+by the run inference notebook and by the worker processes of the multi-process runner, which
+cannot use functions defined in the notebook.
+"""
+
+import sys
+import uuid
+import logging
+import importlib.util
+from pathlib import Path
+import importlib.resources as pkg_resources
+from typing import Dict, Optional
+from fmbench.scripts.worker_pool import InferenceWorkerPool
+from fmbench.scripts.rate_limiter import configure_rate_limits, scale_rate_limits
+from fmbench.scripts.request_policy import RequestPolicy
+from fmbench.scripts.live_metrics import LiveMetrics
+from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
+                                               has_native_async_prediction)
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Try to import the prompt formatter - silently continues if not available
+try:
+    from fmbench.scripts.prompt_formatter import formatter as prompt_formatter
+    PROMPT_FORMATTER_AVAILABLE = True
+except ImportError:
+    PROMPT_FORMATTER_AVAILABLE = False
+
+
+def create_predictor(inference_script: str,
+                     endpoint_name: str,
+                     inference_spec: Optional[Dict],
+                     metadata: Optional[Dict]) -> Optional[FMBenchPredictor]:
+    """
+    Create a predictor using the create_predictor function of an inference script
+    from the fmbench/scripts directory.
+
+    Args:
+        inference_script: Name of the inference script, for example bedrock_predictor.py
+        endpoint_name: Endpoint name (or url or model id) for the predictor
+        inference_spec: Inference spec from the experiment
+        metadata: Optional metadata for the predictor
+
+    Returns:
+        The predictor or None if the inference script does not exist
+    """
+    # Assuming fmbench is a valid Python package and scripts is a subdirectory within it
+    scripts_dir = Path(pkg_resources.files("fmbench"), "scripts")
+    logger.info(f"Using fmbench.scripts directory: {scripts_dir}")
+
+    # Ensure the scripts directory exists
+    scripts_dir.mkdir(parents=True, exist_ok=True)
+    module_name = Path(inference_script).stem
+    logger.info(f"script provided for inference from this model={module_name}")
+    script_path = scripts_dir / f"{module_name}.py"
+    logger.info(f"script path={script_path}")
+
+    # Check and proceed with local script
+    if not script_path.exists():
+        logger.error(f"script {script_path} not found.")
+        return None
+
+    logger.info(f"deploying using local code: {script_path}")
+
+    spec = importlib.util.spec_from_file_location(module_name, str(script_path))
+    inference_module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = inference_module
+    spec.loader.exec_module(inference_module)
+    logger.info(f"ep_name={endpoint_name}, metadata={metadata}")
+    return inference_module.create_predictor(endpoint_name, inference_spec, metadata)
+
+
+def set_metrics(
+    endpoint_name=None,
+    prompt=None,
+    ground_truth=None,
+    base64_img=None,
+    question=None,
+    payload_file=None,
+    inference_params=None,
+    completion=None,
+    prompt_tokens=None,
+    completion_tokens=None,
+    latency=None,
+    time_to_first_token=None,
+    time_per_output_token=None,
+    time_to_last_token=None,
+    uuid=None,
+    rate_limit_wait_time=None,
+    retry_wait_time=None,
+    connect_time=None,
+    tls_time=None,
+    time_to_first_byte=None,
+    token_count_model=None,
+    token_times=None,
+    batch_size=None,
+    batch_wait_time=None,
+) -> Dict:
+    return dict(
+        endpoint_name=endpoint_name,
+        prompt=prompt,
+        question=question,
+        ground_truth=ground_truth,
+        base64_img=base64_img,
+        payload_file=payload_file,
+        **inference_params,
+        completion=completion,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        latency=latency,
+        time_to_first_token=time_to_first_token,
+        time_per_output_token=time_per_output_token,
+        time_to_last_token=time_to_last_token,
+        uuid=uuid,
+        rate_limit_wait_time=rate_limit_wait_time,
+        retry_wait_time=retry_wait_time,
+        connect_time=connect_time,
+        tls_time=tls_time,
+        time_to_first_byte=time_to_first_byte,
+        token_count_model=token_count_model,
+        token_times=token_times,
+        batch_size=batch_size,
+        batch_wait_time=batch_wait_time,
+    )
+
+
+# format the payload for the model with the prompt formatter if it is available
+def format_payload(predictor, payload) -> Dict:
+    if PROMPT_FORMATTER_AVAILABLE:
+        return prompt_formatter.format_prompt_for_model(payload, predictor.endpoint_name)
+    return payload
+
+
+# create the per inference metrics from the prediction response
+def create_inference_response(predictor, payload, formatted_payload, payload_file, resp, request_uuid) -> Dict:
+    # Use the original inputs (if available) for metrics and logging
+    displayed_inputs = formatted_payload.get("original_inputs", formatted_payload["inputs"])
+
+    # handle the case when ground truth is either provided or not provided as a
+    # part of the dataset
+    ground_truth = payload.get("ground_truth", None)
+    logger.info(f"get_inference, response for uuid={request_uuid}, resp={resp}, ground_truth={ground_truth}")
+    base64_img = payload.get("base64_img", None)
+    question = payload.get("question", None)
+    if ground_truth is not None:
+        if isinstance(ground_truth, list):
+            ground_truth = ",".join(ground_truth)
+    else:
+        ground_truth = None
+    # Set metrics and logging for both cases
+    generated_text = (
+        resp["response_json"].get("generated_text", "")
+        if resp.get("response_json") is not None
+        else ""
+    )
+    response = set_metrics(
+        predictor.endpoint_name,
+        displayed_inputs,
+        # the open source long bench dataset has ground truth responses in a list. In this case,
+        # use all of the elements in the list as a source of ground truth and check for whether the
+        # answer matches any. If the ground truth is not a list, then assuming it being a string, we
+        # use the string as the ground truth
+        ground_truth,
+        base64_img,
+        question,
+        payload_file,
+        predictor.inference_parameters,
+        generated_text,
+        resp["prompt_tokens"],
+        resp["completion_tokens"],
+        resp["latency"],
+        resp["time_to_first_token"],
+        resp["time_per_output_token"],
+        resp["time_to_last_token"],
+        request_uuid,
+        # waits before the request was sent, not part of the latency
+        rate_limit_wait_time=resp.get("rate_limit_wait_time"),
+        retry_wait_time=resp.get("retry_wait_time"),
+        # connection setup and time to first byte of the HTTP predictors
+        connect_time=resp.get("connect_time"),
+        tls_time=resp.get("tls_time"),
+        time_to_first_byte=resp.get("time_to_first_byte"),
+        # set if the token counts were not reported by the provider, see count_missing_tokens
+        token_count_model=resp.get("token_count_model"),
+        # per token timings, written to a side file and not with the record (see token_timings.py)
+        token_times=resp.get("token_times"),
+        # size of the batch and time waited for it with client side batching, see micro_batcher.py
+        batch_size=resp.get("batch_size"),
+        batch_wait_time=resp.get("batch_wait_time"),
+    )
+
+    # log the output of the prediction
+    logger.info(
+        f"get_inference, done, uuid={request_uuid}, endpoint={predictor.endpoint_name}, "
+        f"prompt_tokens={resp['prompt_tokens']}, completion_tokens={resp['completion_tokens']}, "
+        f"latency={resp['latency']}"
+    )
+    return response
+
+
+# create the per inference metrics when the prediction failed
+def create_error_response(predictor, payload, payload_file) -> Dict:
+    return set_metrics(
+        endpoint_name=predictor.endpoint_name,
+        prompt=payload["inputs"],
+        inference_params=predictor.inference_parameters or {},
+        payload_file=payload_file,
+    )
+
+
+# function to get inference
+def get_inference(predictor, payload, payload_file) -> Dict:
+    try:
+        # get inference
+        request_uuid = uuid.uuid4().hex
+        logger.info(f"get_inference, sending request with uuid={request_uuid}")
+
+        # Format the prompt for the model if available
+        formatted_payload = format_payload(predictor, payload)
+
+        # Get prediction from the predictor
+        resp = predictor.get_prediction(formatted_payload)
+        response = create_inference_response(predictor, payload, formatted_payload, payload_file, resp, request_uuid)
+
+    except Exception as e:
+        logger.error(
+            f"get_inference, uuid={request_uuid}, error occurred with {predictor.endpoint_name}, exception={str(e)}"
+        )
+        response = create_error_response(predictor, payload, payload_file)
+    return response
+
+
+# asynchronous version of get_inference for predictors with a native aget_prediction,
+# the request is awaited on the event loop instead of blocking a worker thread
+async def aget_inference(predictor, payload, payload_file, worker_pool: InferenceWorkerPool) -> Dict:
+    try:
+        request_uuid = uuid.uuid4().hex
+        logger.info(f"aget_inference, sending request with uuid={request_uuid}")
+        # the prompt formatter is blocking, run it on the worker pool
+        formatted_payload = await worker_pool.run(format_payload, predictor, payload)
+        resp = await predictor.aget_prediction(formatted_payload)
+        response = create_inference_response(predictor, payload, formatted_payload, payload_file, resp, request_uuid)
+
+    except Exception as e:
+        logger.error(
+            f"aget_inference, uuid={request_uuid}, error occurred with {predictor.endpoint_name}, exception={str(e)}"
+        )
+        response = create_error_response(predictor, payload, payload_file)
+    return response
+
+
+# Represents a function to start invoking models asynchronously. Predictors with a native
+# aget_prediction are awaited directly, for the others the blocking get_inference runs
+# in a separate thread, the threads come from the worker pool that is shared
+# by all the chunks of this inference run. With a request policy the request has a
+# deadline and may be hedged, see request_policy.py
+async def async_get_inference(predictor, payload: Dict, payload_file: str,
+                              worker_pool: InferenceWorkerPool,
+                              request_policy: Optional[RequestPolicy] = None,
+                              live_metrics: Optional[LiveMetrics] = None) -> Dict:
+    async def send() -> Dict:
+        if has_native_async_prediction(predictor):
+            return await aget_inference(predictor, payload, payload_file, worker_pool)
+        return await worker_pool.run(get_inference, predictor, payload, payload_file)
+
+    async def send_with_policy() -> Dict:
+        if request_policy is None:
+            return await send()
+        return await request_policy.run(send, lambda: create_error_response(predictor, payload, payload_file))
+
+    if live_metrics is None:
+        return await send_with_policy()
+    labels = live_metrics.request_started()
+    response: Optional[Dict] = None
+    try:
+        response = await send_with_policy()
+        return response
+    finally:
+        live_metrics.request_finished(labels, response)
+
+
+class InferenceSender:
+    """
+    Sends payloads to a predictor created from its inference script, used by the
+    worker processes of the multi-process runner. Each sender has its own predictor
+    and worker pool, and its own rate limiters if rate_limits are provided, with the
+    share of the quota set by the runner for each run (see set_rate_limit_share).
+    request_policy has the RequestPolicy arguments from get_request_policy_config.
+    """
+
+    def __init__(self, predictor_args: Dict, max_workers: int, rate_limits: Optional[Dict] = None,
+                 request_policy: Optional[Dict] = None):
+        self._rate_limits = rate_limits
+        self._rate_limit_share: Optional[float] = None
+        self.set_rate_limit_share(1.0)
+        self._predictor = create_predictor(**predictor_args)
+        if self._predictor is None:
+            raise ValueError(f"predictor could not be created for predictor_args={predictor_args}")
+        self._worker_pool = InferenceWorkerPool(max_workers)
+        self._request_policy = RequestPolicy(**request_policy) if request_policy else None
+
+    async def send(self, payload: Dict, payload_file: str) -> Dict:
+        return await async_get_inference(self._predictor, payload, payload_file, self._worker_pool,
+                                         self._request_policy)
+
+    def set_rate_limit_share(self, share: float) -> None:
+        """
+        Use share of the rate limits, the quota is split across the senders that run at the
+        same time. The limiters are only replaced when the share changes.
+        """
+        if not self._rate_limits or share == self._rate_limit_share:
+            return
+        configure_rate_limits(scale_rate_limits(self._rate_limits, share))
+        self._rate_limit_share = share
+
+    def stats(self) -> Dict:
+        return self._worker_pool.stats()
+
+    def shutdown(self) -> None:
+        self._worker_pool.shutdown()
@@ -0,0 +1,243 @@
+"""
+Mergeable latency histograms for FMBench
+
+The per chunk metrics have the p50, p95 and p99 of the requests of the chunk, and the mean
+of the percentiles of several chunks is not the percentile of their requests: it hides the
+tail of the slowest chunk. Each chunk therefore also records a log bucketed (HDR style)
+histogram of the latency, TTFT, TPOT and TTLT of its requests. The buckets grow
+geometrically so that every value is known to within relative_accuracy (1% by default)
+with a fixed number of buckets for the whole range, the histograms of chunks, workers and
+runs with the same settings merge exactly by adding their bucket counts, and the
+percentiles of the merged histogram are the percentiles of all their requests (to within
+relative_accuracy).
+
+The histograms are stored in the per chunk metrics and in the all metrics file as JSON
+strings in the <prefix>_histogram columns (latency_histogram, TTFT_histogram, ...), see
+get_histograms and summarize_histograms.
+"""
+
+import json
+import math
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Union
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# values are known to within this relative error
+DEFAULT_RELATIVE_ACCURACY: float = 0.01
+# range of the buckets in seconds, smaller values are counted in the first bucket and larger
+# values in the last one, the min and max are recorded exactly
+DEFAULT_MIN_VALUE: float = 1e-5
+DEFAULT_MAX_VALUE: float = 3600.0
+# per inference record keys that get a histogram and the prefix of their metrics columns
+HISTOGRAM_METRICS: Dict[str, str] = {"latency": "latency",
+                                     "time_to_first_token": "TTFT",
+                                     "time_per_output_token": "TPOT",
+                                     "time_to_last_token": "TTLT"}
+HISTOGRAM_COLUMN_SUFFIX: str = "_histogram"
+SUMMARY_PERCENTILES: List[int] = [50, 95, 99]
+
+
+class LatencyHistogram:
+    """
+    Histogram with geometrically growing buckets, bucket i > 0 counts the values in
+    (min_value * gamma^(i-1), min_value * gamma^i] with gamma = (1 + a) / (1 - a) for a
+    relative accuracy a. Its memory is fixed by the settings, not by the number of values.
+    """
+
+    def __init__(self,
+                 relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+                 min_value: float = DEFAULT_MIN_VALUE,
+                 max_value: float = DEFAULT_MAX_VALUE):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"LatencyHistogram relative_accuracy needs to be between 0 and 1, got {relative_accuracy}")
+        if not 0 < min_value < max_value:
+            raise ValueError(f"LatencyHistogram needs 0 < min_value < max_value, got {min_value} and {max_value}")
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._counts = np.zeros(self._index(max_value) + 1, dtype=np.int64)
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return math.ceil(math.log(value / self.min_value) / self._log_gamma)
+
+    def _value(self, index: int) -> float:
+        # the value with the smallest relative error to all the values of the bucket
+        if index == 0:
+            return self.min_value
+        return self.min_value * 2 * self._gamma ** index / (self._gamma + 1)
+
+    def record(self, value: float) -> None:
+        """Add a value."""
+        self.record_values([value])
+
+    def record_values(self, values: Iterable[Optional[float]]) -> None:
+        """Add values, None values are skipped."""
+        values = np.array([v for v in values if v is not None], dtype=np.float64)
+        if len(values) == 0:
+            return
+        indexes = np.zeros(len(values), dtype=np.int64)
+        above_min = values > self.min_value
+        indexes[above_min] = np.ceil(np.log(values[above_min] / self.min_value) / self._log_gamma)
+        np.minimum(indexes, len(self._counts) - 1, out=indexes)
+        self._counts += np.bincount(indexes, minlength=len(self._counts))
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = float(values.min()) if self.min is None else min(self.min, float(values.min()))
+        self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """
+        Add the values of another histogram with the same settings to this one.
+
+        Returns:
+            This histogram
+        """
+        if (other.relative_accuracy, other.min_value, other.max_value) != \
+           (self.relative_accuracy, self.min_value, self.max_value):
+            raise ValueError("LatencyHistogram, cannot merge histograms with different settings")
+        if other.count == 0:
+            return self
+        self._counts += other._counts
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Get the q-th percentile (0 to 100) of the values, None if there are none.
+        """
+        return self.percentiles([q])[0]
+
+    def percentiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        """
+        Get the percentiles (0 to 100) of the values, the value of the nearest rank to within
+        relative_accuracy. None for each percentile if there are no values.
+        """
+        qs = list(qs)
+        if self.count == 0:
+            return [None] * len(qs)
+        cumulative = np.cumsum(self._counts)
+        results: List[Optional[float]] = []
+        for q in qs:
+            if q <= 0 or q >= 100:
+                results.append(self.min if q <= 0 else self.max)
+                continue
+            rank = max(1, math.ceil(q / 100 * self.count))
+            index = int(np.searchsorted(cumulative, rank))
+            # the exact min and max are better than the value of their bucket
+            results.append(min(max(self._value(index), self.min), self.max))
+        return results
+
+    def to_dict(self) -> Dict:
+        """Get the histogram as a dictionary with only the non-empty buckets."""
+        indexes = np.flatnonzero(self._counts)
+        return dict(relative_accuracy=self.relative_accuracy,
+                    min_value=self.min_value,
+                    max_value=self.max_value,
+                    count=self.count,
+                    sum=self.sum,
+                    min=self.min,
+                    max=self.max,
+                    indexes=indexes.tolist(),
+                    counts=self._counts[indexes].tolist())
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, data: Union[Dict, str]) -> "LatencyHistogram":
+        """Create a histogram from to_dict or to_json."""
+        if isinstance(data, str):
+            data = json.loads(data)
+        histogram = cls(data["relative_accuracy"], data["min_value"], data["max_value"])
+        histogram._counts[data["indexes"]] = data["counts"]
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+def get_histograms(responses: List[Dict]) -> Dict[str, Optional[str]]:
+    """
+    Get the histograms of the per inference records for the per chunk metrics.
+
+    Args:
+        responses: Per inference records
+
+    Returns:
+        Dictionary of the <prefix>_histogram columns, the histograms as JSON strings or None
+        if no record has the metric
+    """
+    histograms: Dict[str, Optional[str]] = {}
+    for key, prefix in HISTOGRAM_METRICS.items():
+        histogram = LatencyHistogram()
+        histogram.record_values(r.get(key) for r in responses)
+        histograms[f"{prefix}{HISTOGRAM_COLUMN_SUFFIX}"] = histogram.to_json() if histogram.count else None
+    return histograms
+
+
+def merge_histograms(values: Iterable[Union[Dict, str, None]]) -> Optional[LatencyHistogram]:
+    """
+    Merge serialized histograms, missing values (None or NaN) are skipped.
+
+    Returns:
+        The merged histogram, None if there are no histograms
+    """
+    merged: Optional[LatencyHistogram] = None
+    for value in values:
+        if not isinstance(value, (dict, str)):
+            continue
+        histogram = LatencyHistogram.from_dict(value)
+        merged = histogram if merged is None else merged.merge(histogram)
+    return merged
+
+
+def summarize_histograms(df: pd.DataFrame, group_by_cols: List[str]) -> pd.DataFrame:
+    """
+    Get the percentiles of the merged histograms of each group of the per chunk metrics.
+
+    Args:
+        df: Per chunk metrics with the <prefix>_histogram columns
+        group_by_cols: Columns to group the chunks by, for example the experiment, payload file
+                       and concurrency level
+
+    Returns:
+        Dataframe with the group_by_cols and the <prefix>_p50, <prefix>_p95 and <prefix>_p99
+        columns of the metrics that have histograms, NaN for a group without values
+    """
+    histogram_cols = [f"{prefix}{HISTOGRAM_COLUMN_SUFFIX}" for prefix in HISTOGRAM_METRICS.values()
+                      if f"{prefix}{HISTOGRAM_COLUMN_SUFFIX}" in df.columns]
+    rows: List[Dict] = []
+    for keys, group in df.groupby(group_by_cols, dropna=False):
+        row = dict(zip(group_by_cols, keys if isinstance(keys, tuple) else (keys,)))
+        for col in histogram_cols:
+            prefix = col[:-len(HISTOGRAM_COLUMN_SUFFIX)]
+            merged = merge_histograms(group[col])
+            values = merged.percentiles(SUMMARY_PERCENTILES) if merged is not None \
+                else [np.nan] * len(SUMMARY_PERCENTILES)
+            row |= {f"{prefix}_p{q}": v for q, v in zip(SUMMARY_PERCENTILES, values)}
+        rows.append(row)
+    logger.info(f"summarize_histograms, {len(df)} chunks in {len(rows)} groups, histogram_cols={histogram_cols}")
+    return pd.DataFrame(rows, columns=group_by_cols + [f"{col[:-len(HISTOGRAM_COLUMN_SUFFIX)]}_p{q}"
+                                                      for col in histogram_cols
+                                                      for q in SUMMARY_PERCENTILES])
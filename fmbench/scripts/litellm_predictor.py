@@ -8,15 +8,18 @@ using the LiteLLM library for a unified interface to multiple providers.
 import os
 import time
 import json
+import asyncio
 import logging
 import litellm
 import pandas as pd
+from array import array
 from datetime import datetime
 from fmbench.scripts import constants
 from typing import Dict, Optional, List
-from litellm import completion, token_counter, RateLimitError
-from fmbench.scripts.stream_responses import get_response_stream
+from litellm import completion, RateLimitError
+from fmbench.scripts.stream_responses import get_response_stream, aget_response_stream
 from fmbench.scripts.fmbench_predictor import (FMBenchPredictor, 
+                                              PredictionRecord,
                                               FMBenchPredictionResponse)
 
 # Configure logging
@@ -33,6 +36,10 @@ SUPPORTED_PROVIDERS = {
 # Service name for this predictor type
 SERVICE_NAME = constants.PLATFORM_EXTERNAL
 
+# Retry settings used when there are throttling errors
+INITIAL_RETRY_DELAY: float = 2.0
+MAX_RETRY_DELAY: float = 60.0
+
 class LiteLLMPredictor(FMBenchPredictor):
     """
     Predictor for external models (OpenAI, Azure OpenAI, Google) using LiteLLM.
@@ -65,6 +72,8 @@ class LiteLLMPredictor(FMBenchPredictor):
             self._max_tokens = 100
             self._top_p = 0.9
             self._stream = None
+            # record the time of every streamed token, see token_timings.py
+            self._token_timings = False
             self._start = None
             self._stop = None
             self._caching = False
@@ -88,6 +97,7 @@ class LiteLLMPredictor(FMBenchPredictor):
                     self._max_tokens = parameters.get('max_tokens', self._max_tokens)
                     self._top_p = parameters.get('top_p', self._top_p)
                     self._stream = inference_spec.get("stream", self._stream)
+                    self._token_timings = inference_spec.get("token_timings", self._token_timings)
                     self._stop = inference_spec.get("stop_token", self._stop)
                     self._start = inference_spec.get("start_token", self._start)
                     
@@ -104,10 +114,7 @@ class LiteLLMPredictor(FMBenchPredictor):
                         os.environ["AZURE_API_VERSION"] = metadata.get("azure_api_version")
                 elif self._provider == "google" and metadata.get("google_api_key"):
                     os.environ["GOOGLE_API_KEY"] = metadata.get("google_api_key")
-            
-            # Response placeholder
-            self._response_json = {}
-            
+
             logger.info(f"Initialized {self._provider} predictor for model {self._model}, "
                         f"temp={self._temperature}, max_tokens={self._max_tokens}, "
                         f"top_p={self._top_p}, stream={self._stream}")
@@ -117,6 +124,95 @@ class LiteLLMPredictor(FMBenchPredictor):
             logger.error(exception_msg)
             raise ValueError(exception_msg)
 
+    def _get_request(self, messages: List[Dict], max_tokens: Optional[int] = None) -> Dict:
+        # Prepare the request based on provider
+        request = {
+            "model": self._model,
+            "messages": messages,
+            "temperature": self._temperature,
+            # a replayed trace can set max_tokens per request
+            "max_tokens": max_tokens or self._max_tokens,
+            "top_p": self._top_p,
+            "stream": self._stream
+        }
+        # ask for the token usage at the end of the stream so that
+        # the response does not need to be tokenized
+        if self._stream is True:
+            request["stream_options"] = {"include_usage": True}
+
+        # Add provider-specific parameters
+        if self._provider == "azure":
+            # Azure requires explicit API base and version
+            request["api_base"] = os.environ.get("AZURE_API_BASE")
+            request["api_version"] = os.environ.get("AZURE_API_VERSION")
+        logger.info(f"Invoking {self._model} via {self._provider} to get inference")
+        return request
+
+    def _parse_response(self,
+                        response,
+                        messages: List[Dict],
+                        latency: float,
+                        response_dict_from_streaming: Optional[Dict]) -> FMBenchPredictionResponse:
+        """
+        Build the prediction response from a streaming or non-streaming LiteLLM response.
+        """
+        # the response is built from local variables only, the predictor
+        # instance is shared by all the concurrent requests
+        generated_text: Optional[str] = None
+        TTFT: Optional[float] = None
+        TPOT: Optional[float] = None
+        TTLT: Optional[float] = None
+        token_count_model: Optional[str] = None
+        token_times: Optional[array] = None
+        # Handle streaming responses
+        if response_dict_from_streaming is not None:
+            TTFT = response_dict_from_streaming.get('TTFT')
+            TPOT = response_dict_from_streaming.get('TPOT')
+            TTLT = response_dict_from_streaming.get('TTLT')
+            token_times = response_dict_from_streaming.get('token_times')
+            response = response_dict_from_streaming['response']
+            generated_text = json.loads(response)[0].get('generated_text')
+
+            # Token counts from the usage chunk at the end of the stream, if the provider
+            # does not send one they are counted with the tokenizer after the run
+            prompt_tokens = response_dict_from_streaming.get('prompt_tokens')
+            completion_tokens = response_dict_from_streaming.get('completion_tokens')
+            if prompt_tokens is None or completion_tokens is None:
+                token_count_model = self._model
+            logger.info(f"Streaming prompt token count: {prompt_tokens}, "
+                        f"completion token count: {completion_tokens}, latency: {latency}")
+        else:
+            # Extract completion text from non-streaming response
+            for choice in response.choices:
+                if choice.message and choice.message.content:
+                    generated_text = choice.message.content
+                    break
+
+            # Extract token counts from response usage
+            prompt_tokens = response.usage.prompt_tokens
+            completion_tokens = response.usage.completion_tokens
+
+            # Extract latency
+            latency = response._response_ms / 1000 if hasattr(response, '_response_ms') else latency
+
+        return PredictionRecord(
+            generated_text=generated_text,
+            latency=latency,
+            time_to_first_token=TTFT,
+            time_per_output_token=TPOT,
+            time_to_last_token=TTLT,
+            completion_tokens=completion_tokens,
+            prompt_tokens=prompt_tokens,
+            token_count_model=token_count_model,
+            token_times=token_times
+        ).to_response()
+
+    def _get_retry_wait_time(self, e: Exception, retry_count: int) -> float:
+        # Retry with exponential backoff on rate limit errors
+        wait_time = min(INITIAL_RETRY_DELAY * (2 ** (retry_count - 1)), MAX_RETRY_DELAY)
+        logger.warning(f"Rate limit error: {e}. Retrying in {wait_time:.2f} seconds... (Attempt {retry_count})")
+        return wait_time
+
     def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
         """
         Get a prediction from the external model.
@@ -127,110 +223,80 @@ class LiteLLMPredictor(FMBenchPredictor):
         Returns:
             FMBenchPredictionResponse with generated text and metrics
         """
-        # Extract the prompt from the payload
-        prompt_input_data = payload['inputs']
-        
-        # Variables to track metrics
-        latency: Optional[float] = None
-        completion_tokens: Optional[int] = None
-        prompt_tokens: Optional[int] = None
-        TTFT: Optional[float] = None
-        TPOT: Optional[float] = None
-        TTLT: Optional[float] = None
-        response_dict_from_streaming: Optional[Dict] = None
-        
-        # Add logic to retry if there are throttling errors
-        INITIAL_RETRY_DELAY: float = 2.0 
-        MAX_RETRY_DELAY: float = 60.0  
+        # Format as chat messages
+        messages = [{"role": "user", "content": payload['inputs']}]
         retry_count = 0
         
         while True:
             try:
-                # Format as chat messages
-                messages = [{"role": "user", "content": prompt_input_data}]
-                
-                # Prepare the request based on provider
-                request = {
-                    "model": self._model,
-                    "messages": messages,
-                    "temperature": self._temperature,
-                    "max_tokens": self._max_tokens,
-                    "top_p": self._top_p,
-                    "stream": self._stream
-                }
-                
-                # Add provider-specific parameters
-                if self._provider == "azure":
-                    # Azure requires explicit API base and version
-                    request["api_base"] = os.environ.get("AZURE_API_BASE")
-                    request["api_version"] = os.environ.get("AZURE_API_VERSION")
-                
+                request = self._get_request(messages, payload.get('max_tokens'))
                 # Make the API call
-                logger.info(f"Invoking {self._model} via {self._provider} to get inference")
                 st = time.perf_counter()
-                
                 response = litellm.completion(**request)
-                
                 # Extract latency in seconds
                 latency = time.perf_counter() - st
-                
-                # Handle streaming responses
+
+                response_dict_from_streaming: Optional[Dict] = None
                 if self._stream is True:
                     response_dict_from_streaming = get_response_stream(
                         response,
                         st,
                         self._start,
                         self._stop,
-                        is_sagemaker=False
+                        is_sagemaker=False,
+                        record_token_times=self._token_timings
                     )
-                    TTFT = response_dict_from_streaming.get('TTFT')
-                    TPOT = response_dict_from_streaming.get('TPOT')
-                    TTLT = response_dict_from_streaming.get('TTLT')
-                    response = response_dict_from_streaming['response']
-                    self._response_json["generated_text"] = json.loads(response)[0].get('generated_text')
-                    
-                    # Count tokens for streaming responses
-                    prompt_tokens = token_counter(model=self._model, messages=messages)
-                    completion_tokens = token_counter(text=self._response_json["generated_text"])
-                    logger.info(f"Streaming prompt token count: {prompt_tokens}, "
-                                f"completion token count: {completion_tokens}, latency: {latency}")
-                    break
-                else:
-                    # Extract completion text from non-streaming response
-                    for choice in response.choices:
-                        if choice.message and choice.message.content:
-                            self._response_json["generated_text"] = choice.message.content
-                            break
-                    
-                    # Extract token counts from response usage
-                    prompt_tokens = response.usage.prompt_tokens
-                    completion_tokens = response.usage.completion_tokens
-                    
-                    # Extract latency
-                    latency = response._response_ms / 1000 if hasattr(response, '_response_ms') else latency
-                    break
+                return self._parse_response(response, messages, latency, response_dict_from_streaming)
                     
             except RateLimitError as e:
-                # Retry with exponential backoff on rate limit errors
                 retry_count += 1
-                wait_time = min(INITIAL_RETRY_DELAY * (2 ** (retry_count - 1)), MAX_RETRY_DELAY)
-                logger.warning(f"Rate limit error: {e}. Retrying in {wait_time:.2f} seconds... (Attempt {retry_count})")
-                time.sleep(wait_time)
+                time.sleep(self._get_retry_wait_time(e, retry_count))
                 
             except Exception as e:
                 logger.error(f"Unexpected error during prediction, endpoint_name={self._endpoint_name}, "
                             f"exception={e}")
                 raise
+
+    async def aget_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        """
+        Get a prediction from the external model without blocking a thread,
+        uses litellm.acompletion.
         
-        return FMBenchPredictionResponse(
-            response_json=self._response_json,
-            latency=latency,
-            time_to_first_token=TTFT,
-            time_per_output_token=TPOT,
-            time_to_last_token=TTLT,
-            completion_tokens=completion_tokens,
-            prompt_tokens=prompt_tokens
-        )
+        Args:
+            payload: Dictionary containing the input prompt
+            
+        Returns:
+            FMBenchPredictionResponse with generated text and metrics
+        """
+        messages = [{"role": "user", "content": payload['inputs']}]
+        retry_count = 0
+
+        while True:
+            try:
+                request = self._get_request(messages, payload.get('max_tokens'))
+                st = time.perf_counter()
+                response = await litellm.acompletion(**request)
+                latency = time.perf_counter() - st
+
+                response_dict_from_streaming: Optional[Dict] = None
+                if self._stream is True:
+                    response_dict_from_streaming = await aget_response_stream(
+                        response,
+                        st,
+                        self._start,
+                        self._stop,
+                        record_token_times=self._token_timings
+                    )
+                return self._parse_response(response, messages, latency, response_dict_from_streaming)
+
+            except RateLimitError as e:
+                retry_count += 1
+                await asyncio.sleep(self._get_retry_wait_time(e, retry_count))
+
+            except Exception as e:
+                logger.error(f"Unexpected error during prediction, endpoint_name={self._endpoint_name}, "
+                            f"exception={e}")
+                raise
     
     def calculate_cost(self,
                       instance_type: str,
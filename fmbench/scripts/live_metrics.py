@@ -0,0 +1,266 @@
+"""
+Live metrics endpoint for FMBench
+
+During a long run the only visibility into the endpoint is the log. With the optional
+`live_metrics` section of the config file the inference step serves the current metrics of
+the run in the Prometheus text format on a local HTTP endpoint, so that saturation can be
+watched (with curl, Prometheus or Grafana) while the run is in progress and the run stopped
+early:
+
+    live_metrics:
+      enabled: yes
+      # serves http://127.0.0.1:9464/metrics, port 0 picks a free port
+      host: 127.0.0.1
+      port: 9464
+      # the rates and quantiles are over the requests completed in this many seconds
+      window_seconds: 60
+
+Every metric has the experiment and concurrency labels of the combination being run:
+
+    fmbench_requests_in_flight                    requests sent and not completed
+    fmbench_requests_total{status}                completed requests, status is success or error
+    fmbench_throttled_requests_total              requests retried after throttling by the endpoint
+    fmbench_request_rate                          completed requests per second in the window
+    fmbench_error_rate                            share of the requests in the window that failed
+    fmbench_latency_seconds, fmbench_ttft_seconds cumulative histograms (bucket, sum, count)
+    fmbench_latency_window_seconds{quantile}      p50, p95 and p99 of the requests in the window
+    fmbench_ttft_window_seconds{quantile}         (the same for the time to first token)
+
+The requests sent from this process are tracked as they are sent and completed. With the
+multi-process or distributed runner the requests run in the workers, their records are
+added when the chunk completes (no in-flight requests).
+"""
+
+import time
+import logging
+import threading
+import numpy as np
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Tuple
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST: str = "127.0.0.1"
+DEFAULT_PORT: int = 9464
+DEFAULT_WINDOW_SECONDS: float = 60
+# upper bounds of the histogram buckets in seconds
+LATENCY_BUCKETS: List[float] = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+WINDOW_QUANTILES: List[float] = [0.5, 0.95, 0.99]
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+STATUS_SUCCESS: str = "success"
+STATUS_ERROR: str = "error"
+
+Labels = Tuple[str, str]
+
+
+def get_live_metrics_config(config: Dict) -> Optional[Dict]:
+    """
+    Get the live metrics settings from the optional `live_metrics` section of the config file.
+
+    Args:
+        config: The FMBench config
+
+    Returns:
+        Dictionary with the host, port and window_seconds or None if live metrics are not enabled
+    """
+    section = config.get("live_metrics") or {}
+    if section.get("enabled") is not True:
+        return None
+    return dict(host=section.get("host", DEFAULT_HOST),
+                port=section.get("port", DEFAULT_PORT),
+                window_seconds=section.get("window_seconds", DEFAULT_WINDOW_SECONDS))
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[int(np.searchsorted(LATENCY_BUCKETS, value))] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _CombinationMetrics:
+    def __init__(self):
+        self.in_flight: int = 0
+        self.requests: Dict[str, int] = {STATUS_SUCCESS: 0, STATUS_ERROR: 0}
+        self.throttled: int = 0
+        self.latency = _Histogram()
+        self.ttft = _Histogram()
+        # completion time, error, latency and TTFT of the recent requests
+        self.window: Deque[Tuple[float, bool, Optional[float], Optional[float]]] = deque()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, **extra: str) -> str:
+    pairs = [("experiment", labels[0]), ("concurrency", labels[1])] + list(extra.items())
+    return "{" + ",".join(f"{k}=\"{_escape(str(v))}\"" for k, v in pairs) + "}"
+
+
+class LiveMetrics:
+    """
+    Thread safe registry of the live metrics of a run, see the module docstring.
+    """
+
+    def __init__(self, window_seconds: float = DEFAULT_WINDOW_SECONDS):
+        self._window_seconds = window_seconds
+        self._labels: Labels = ("", "")
+        self._metrics: Dict[Labels, _CombinationMetrics] = {}
+        self._lock = threading.Lock()
+
+    def set_combination(self, experiment_name: str, concurrency: int) -> None:
+        """Set the labels of the requests sent from now on."""
+        with self._lock:
+            self._labels = (experiment_name, str(concurrency))
+
+    def _get(self, labels: Labels) -> _CombinationMetrics:
+        metrics = self._metrics.get(labels)
+        if metrics is None:
+            metrics = self._metrics[labels] = _CombinationMetrics()
+        return metrics
+
+    def request_started(self) -> Labels:
+        """
+        Count a request as in flight.
+
+        Returns:
+            The labels to pass to request_finished
+        """
+        with self._lock:
+            labels = self._labels
+            self._get(labels).in_flight += 1
+            return labels
+
+    def request_finished(self, labels: Labels, record: Optional[Dict]) -> None:
+        """
+        Count a completed request.
+
+        Args:
+            labels: The labels from request_started
+            record: The per inference record of the request, None if the request was cancelled
+        """
+        with self._lock:
+            metrics = self._get(labels)
+            metrics.in_flight -= 1
+            self._observe(metrics, record)
+
+    def add_records(self, records: List[Dict]) -> None:
+        """Count the completed requests of records that were sent by other processes."""
+        with self._lock:
+            metrics = self._get(self._labels)
+            for record in records:
+                self._observe(metrics, record)
+
+    def _observe(self, metrics: _CombinationMetrics, record: Optional[Dict]) -> None:
+        record = record or {}
+        # same definition of an error as calculate_metrics
+        error = record.get("completion") is None or record.get("completion_tokens") is None
+        metrics.requests[STATUS_ERROR if error else STATUS_SUCCESS] += 1
+        if record.get("retry_wait_time"):
+            metrics.throttled += 1
+        latency = record.get("latency")
+        ttft = record.get("time_to_first_token")
+        if latency is not None:
+            metrics.latency.observe(latency)
+        if ttft is not None:
+            metrics.ttft.observe(ttft)
+        now = time.monotonic()
+        metrics.window.append((now, error, latency, ttft))
+        # the window is also trimmed here so that it does not grow when nothing scrapes the metrics
+        self._trim(metrics, now)
+
+    def _trim(self, metrics: _CombinationMetrics, now: float) -> None:
+        while metrics.window and metrics.window[0][0] < now - self._window_seconds:
+            metrics.window.popleft()
+
+    def render(self) -> str:
+        """Get the metrics in the Prometheus text format."""
+        lines: List[str] = []
+        now = time.monotonic()
+        with self._lock:
+            for metrics in self._metrics.values():
+                self._trim(metrics, now)
+            items = list(self._metrics.items())
+
+            def family(name: str, metric_type: str, help_text: str) -> None:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+            family("fmbench_requests_in_flight", "gauge", "Requests sent and not completed")
+            lines += [f"fmbench_requests_in_flight{_format_labels(k)} {m.in_flight}" for k, m in items]
+            family("fmbench_requests_total", "counter", "Completed requests")
+            lines += [f"fmbench_requests_total{_format_labels(k, status=s)} {n}"
+                      for k, m in items for s, n in m.requests.items()]
+            family("fmbench_throttled_requests_total", "counter", "Requests retried after throttling")
+            lines += [f"fmbench_throttled_requests_total{_format_labels(k)} {m.throttled}" for k, m in items]
+            family("fmbench_request_rate", "gauge", f"Completed requests per second in the last {self._window_seconds}s")
+            lines += [f"fmbench_request_rate{_format_labels(k)} {len(m.window) / self._window_seconds}"
+                      for k, m in items]
+            family("fmbench_error_rate", "gauge", f"Share of failed requests in the last {self._window_seconds}s")
+            lines += [f"fmbench_error_rate{_format_labels(k)} "
+                      f"{sum(e for _, e, _, _ in m.window) / len(m.window) if m.window else 0}" for k, m in items]
+            for name, attribute, index, help_text in [("fmbench_latency_seconds", "latency", 2, "Request latency"),
+                                                      ("fmbench_ttft_seconds", "ttft", 3, "Time to first token")]:
+                family(name, "histogram", help_text)
+                for k, m in items:
+                    histogram: _Histogram = getattr(m, attribute)
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(k, le=bound)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(k)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(k)} {histogram.count}")
+                window_name = name.replace("_seconds", "_window_seconds")
+                family(window_name, "gauge", f"{help_text} quantiles in the last {self._window_seconds}s")
+                for k, m in items:
+                    values = [w[index] for w in m.window if w[index] is not None]
+                    if values == []:
+                        continue
+                    for q, v in zip(WINDOW_QUANTILES, np.quantile(values, WINDOW_QUANTILES)):
+                        lines.append(f"{window_name}{_format_labels(k, quantile=q)} {v}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a LiveMetrics on http://host:port/metrics from a daemon thread.
+    """
+
+    def __init__(self, live_metrics: LiveMetrics, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = live_metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="live-metrics", daemon=True)
+        self._thread.start()
+        logger.info(f"MetricsServer, serving live metrics on http://{host}:{self.port}/metrics")
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,453 @@
+"""
+Load generation engine for FMBench
+
+The default way of running inferences ("chunked" mode) sends `concurrency` payloads at
+once and waits for the slowest one to finish before sending the next chunk. This module
+provides additional modes that do not have a chunk barrier:
+
+- open_loop: requests are sent at a target request rate (constant or Poisson inter-arrival
+  times) irrespective of how long previous requests take. The concurrency level only caps
+  the number of requests in flight, time spent waiting for a free slot is recorded as
+  queueing delay.
+- closed_loop: exactly `concurrency` requests are kept in flight, a new request is sent
+  the moment one finishes (a sliding window over the payload list).
+- replay: requests are sent at the arrival times of a production request trace, see
+  fmbench/scripts/trace_replay.py. As in the open loop mode the concurrency level only caps
+  the number of requests in flight.
+
+The open and closed loop modes can run either a fixed number of requests or for a fixed
+wall-clock duration, in which case the payload list is cycled through until the duration
+has elapsed. A fixed duration run can be split into warm-up, measure and cool-down phases, requests are sent
+in all the phases but only the ones in the measure phase are used for the metrics.
+
+Any of the modes can be sharded across multiple worker processes with `num_processes`,
+see fmbench/scripts/multiprocess_runner.py, or across multiple hosts with `workers`, see
+fmbench/scripts/distributed_runner.py.
+
+These modes record the intended start time and the actual start time of every request so
+that queueing delay shows up in the latency numbers (no coordinated omission).
+"""
+
+import time
+import random
+import asyncio
+import logging
+import itertools
+from typing import Dict, List, Iterable, Iterator, Optional, Tuple, Callable, Awaitable
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# supported load generation modes
+LOAD_MODE_CHUNKED: str = "chunked"
+LOAD_MODE_OPEN_LOOP: str = "open_loop"
+LOAD_MODE_CLOSED_LOOP: str = "closed_loop"
+LOAD_MODE_REPLAY: str = "replay"
+LOAD_MODES: List[str] = [LOAD_MODE_CHUNKED, LOAD_MODE_OPEN_LOOP, LOAD_MODE_CLOSED_LOOP, LOAD_MODE_REPLAY]
+
+# supported inter-arrival time distributions for the open loop mode
+ARRIVAL_POISSON: str = "poisson"
+ARRIVAL_CONSTANT: str = "constant"
+ARRIVAL_DISTRIBUTIONS: List[str] = [ARRIVAL_POISSON, ARRIVAL_CONSTANT]
+
+# phases of a run with warm-up and cool-down, only the requests
+# that start in the measure phase are used for the metrics
+PHASE_WARMUP: str = "warmup"
+PHASE_MEASURE: str = "measure"
+PHASE_COOLDOWN: str = "cooldown"
+
+# defaults for the load_generation section of the config file, chunked
+# mode preserves the original behavior of the inference step
+DEFAULT_LOAD_GENERATION_CONFIG: Dict = dict(mode=LOAD_MODE_CHUNKED,
+                                            request_rate=None,
+                                            arrival_distribution=ARRIVAL_POISSON,
+                                            seed=None,
+                                            request_count=None,
+                                            duration_seconds=None,
+                                            num_processes=1,
+                                            workers=None,
+                                            worker_token=None,
+                                            start_delay_seconds=2.0,
+                                            warmup_seconds=None,
+                                            measure_seconds=None,
+                                            cooldown_seconds=None,
+                                            trace_file=None,
+                                            time_compression=1.0)
+
+# a send function takes a payload and returns the per inference record
+SendFn = Callable[[Dict], Awaitable[Dict]]
+# optional callback that receives every per inference record as soon as it is complete
+ResponseCallback = Optional[Callable[[Dict], None]]
+
+
+def get_load_generation_config(config: Dict, experiment: Dict) -> Dict:
+    """
+    Get the load generation settings for an experiment. The top level `load_generation`
+    section of the config file applies to all experiments and can be overridden
+    per experiment with a `load_generation` section in the experiment.
+
+    Args:
+        config: The FMBench config
+        experiment: The experiment being run
+
+    Returns:
+        Dictionary containing the load generation settings
+    """
+    load_generation = DEFAULT_LOAD_GENERATION_CONFIG \
+                      | (config.get("load_generation") or {}) \
+                      | (experiment.get("load_generation") or {})
+    mode = load_generation["mode"]
+    if mode not in LOAD_MODES:
+        raise ValueError(f"load_generation mode=\"{mode}\" is not supported, "
+                         f"supported modes are {LOAD_MODES}")
+    if mode == LOAD_MODE_OPEN_LOOP:
+        request_rate = load_generation["request_rate"]
+        if request_rate is None or request_rate <= 0:
+            raise ValueError(f"load_generation mode=\"{mode}\" requires a positive request_rate, "
+                             f"got request_rate={request_rate}")
+        if load_generation["arrival_distribution"] not in ARRIVAL_DISTRIBUTIONS:
+            raise ValueError(f"arrival_distribution=\"{load_generation['arrival_distribution']}\" "
+                             f"is not supported, supported values are {ARRIVAL_DISTRIBUTIONS}")
+    num_processes = load_generation["num_processes"]
+    if not isinstance(num_processes, int) or num_processes < 1:
+        raise ValueError(f"load_generation num_processes={num_processes} needs to be a positive integer")
+    workers = load_generation["workers"]
+    if workers is not None:
+        if not isinstance(workers, list) or workers == []:
+            raise ValueError(f"load_generation workers={workers} needs to be a list of host:port addresses")
+        if num_processes > 1:
+            raise ValueError(f"load_generation can either have workers or num_processes > 1, "
+                             f"got workers={workers}, num_processes={num_processes}")
+    if mode == LOAD_MODE_REPLAY:
+        if load_generation["trace_file"] is None:
+            raise ValueError(f"load_generation mode=\"{mode}\" requires a trace_file")
+        time_compression = load_generation["time_compression"]
+        if time_compression is None or time_compression <= 0:
+            raise ValueError(f"load_generation time_compression={time_compression} needs to be positive")
+        if load_generation["request_count"] is not None or load_generation["duration_seconds"] is not None:
+            raise ValueError(f"load_generation mode=\"{mode}\" replays the whole trace, it cannot "
+                             f"have a request_count or a duration_seconds")
+    if mode != LOAD_MODE_CHUNKED:
+        request_count = load_generation["request_count"]
+        duration_seconds = load_generation["duration_seconds"]
+        if request_count is not None and duration_seconds is not None:
+            raise ValueError(f"load_generation can either have a request_count or a duration_seconds, "
+                             f"got request_count={request_count}, duration_seconds={duration_seconds}")
+        if request_count is not None and request_count <= 0:
+            raise ValueError(f"load_generation request_count={request_count} needs to be positive")
+        if duration_seconds is not None and duration_seconds <= 0:
+            raise ValueError(f"load_generation duration_seconds={duration_seconds} needs to be positive")
+    if has_phases(load_generation):
+        _set_phases_duration(load_generation)
+    logger.info(f"get_load_generation_config, experiment={experiment.get('name')}, "
+                f"load_generation={load_generation}")
+    return load_generation
+
+
+def has_phases(load_generation: Dict) -> bool:
+    """
+    Check if the load generation settings have warm-up, measure or cool-down phases.
+    """
+    return any(load_generation.get(k) is not None
+               for k in ("warmup_seconds", "measure_seconds", "cooldown_seconds"))
+
+
+def _set_phases_duration(load_generation: Dict) -> None:
+    # the phases are run back to back as a single run of fixed duration
+    mode = load_generation["mode"]
+    if mode not in (LOAD_MODE_OPEN_LOOP, LOAD_MODE_CLOSED_LOOP):
+        raise ValueError(f"load_generation warmup_seconds, measure_seconds and cooldown_seconds "
+                         f"require the {LOAD_MODE_OPEN_LOOP} or {LOAD_MODE_CLOSED_LOOP} mode, got mode=\"{mode}\"")
+    if load_generation["request_count"] is not None or load_generation["duration_seconds"] is not None:
+        raise ValueError(f"load_generation with a measure_seconds cannot have a request_count "
+                         f"or a duration_seconds, the duration is the sum of the phases")
+    measure_seconds = load_generation["measure_seconds"]
+    if measure_seconds is None or measure_seconds <= 0:
+        raise ValueError(f"load_generation measure_seconds={measure_seconds} needs to be positive")
+    for k in ("warmup_seconds", "cooldown_seconds"):
+        if (load_generation[k] or 0) < 0:
+            raise ValueError(f"load_generation {k}={load_generation[k]} cannot be negative")
+    load_generation["duration_seconds"] = (load_generation["warmup_seconds"] or 0) \
+                                          + measure_seconds \
+                                          + (load_generation["cooldown_seconds"] or 0)
+
+
+def assign_phases(responses: List[Dict], load_generation: Dict) -> Dict:
+    """
+    Set the phase of each record (warmup, measure or cooldown) based on its intended
+    start time and return the phase boundaries. The run starts at the earliest intended
+    start time, for runs sharded across processes or hosts this is the common start.
+
+    Args:
+        responses: Per request records of a run with phases
+        load_generation: Load generation settings from get_load_generation_config
+
+    Returns:
+        Dictionary with the epoch start time of each phase and the number of requests in each phase
+    """
+    run_start = min([r["intended_start_time"] for r in responses], default=time.time())
+    measure_start = run_start + (load_generation["warmup_seconds"] or 0)
+    cooldown_start = measure_start + load_generation["measure_seconds"]
+    counts = {PHASE_WARMUP: 0, PHASE_MEASURE: 0, PHASE_COOLDOWN: 0}
+    for r in responses:
+        if r["intended_start_time"] < measure_start:
+            r["phase"] = PHASE_WARMUP
+        elif r["intended_start_time"] < cooldown_start:
+            r["phase"] = PHASE_MEASURE
+        else:
+            r["phase"] = PHASE_COOLDOWN
+        counts[r["phase"]] += 1
+    return dict(warmup_start_time=run_start,
+                measure_start_time=measure_start,
+                cooldown_start_time=cooldown_start,
+                run_end_time=cooldown_start + (load_generation["cooldown_seconds"] or 0),
+                warmup_requests=counts[PHASE_WARMUP],
+                measure_requests=counts[PHASE_MEASURE],
+                cooldown_requests=counts[PHASE_COOLDOWN])
+
+
+def _arrival_times(request_rate: float,
+                   arrival_distribution: str,
+                   seed: Optional[int]) -> Iterator[float]:
+    if arrival_distribution == ARRIVAL_CONSTANT:
+        for i in itertools.count():
+            yield i / request_rate
+    rng = random.Random(seed)
+    t: float = 0.
+    while True:
+        yield t
+        t += rng.expovariate(request_rate)
+
+
+def arrival_offsets(n: int,
+                    request_rate: float,
+                    arrival_distribution: str = ARRIVAL_POISSON,
+                    seed: Optional[int] = None) -> List[float]:
+    """
+    Compute the intended start time of each request as an offset in seconds
+    from the start of the run.
+
+    Args:
+        n: Number of requests
+        request_rate: Target number of requests per second
+        arrival_distribution: poisson (exponential inter-arrival times) or constant
+        seed: Optional seed for reproducible poisson arrivals
+
+    Returns:
+        List of n non-decreasing offsets, the first request starts at 0
+    """
+    return list(itertools.islice(_arrival_times(request_rate, arrival_distribution, seed), n))
+
+
+def create_request_list(payload_list: List[Dict], request_count: int) -> List[Dict]:
+    """
+    Cycle through the payload list to create a list of exactly request_count payloads.
+    """
+    return [payload_list[i % len(payload_list)] for i in range(request_count)]
+
+
+class _RunClock:
+    """Maps time.perf_counter() readings to epoch seconds for a single run
+    so that timestamps are both precise and comparable across runs."""
+
+    def __init__(self):
+        self.perf_start = time.perf_counter()
+        self.epoch_start = time.time()
+
+    def to_epoch(self, perf_time: float) -> float:
+        return self.epoch_start + (perf_time - self.perf_start)
+
+
+async def _timed_send(send: SendFn,
+                      payload: Dict,
+                      intended_start: float,
+                      clock: _RunClock,
+                      on_response: ResponseCallback = None) -> Dict:
+    actual_start = time.perf_counter()
+    response = await send(payload)
+    end = time.perf_counter()
+    response["intended_start_time"] = clock.to_epoch(intended_start)
+    response["actual_start_time"] = clock.to_epoch(actual_start)
+    # time spent waiting to be sent, this is zero for a client that keeps up
+    # with the intended schedule
+    response["queueing_delay"] = actual_start - intended_start
+    # latency as seen by a user who arrived at the intended start time
+    response["response_time"] = end - intended_start
+    if on_response is not None:
+        on_response(response)
+    return response
+
+
+async def run_open_loop(send: SendFn,
+                        payloads: List[Dict],
+                        request_rate: float,
+                        arrival_distribution: str = ARRIVAL_POISSON,
+                        max_in_flight: Optional[int] = None,
+                        seed: Optional[int] = None,
+                        duration_seconds: Optional[float] = None,
+                        on_response: ResponseCallback = None) -> Tuple[List[Dict], float]:
+    """
+    Send the payloads at a target request rate without waiting for previous requests.
+
+    Args:
+        send: Coroutine function that sends a single payload and returns its record
+        payloads: List of payloads, each payload is sent once unless duration_seconds is set
+        request_rate: Target number of requests per second
+        arrival_distribution: poisson or constant inter-arrival times
+        max_in_flight: Optional cap on the number of requests in flight, waiting
+                       for a free slot counts as queueing delay
+        seed: Optional seed for reproducible poisson arrivals
+        duration_seconds: Optional duration for which requests are sent, the payloads
+                          are cycled through until the duration has elapsed
+        on_response: Optional callback called with each record as soon as it is complete
+
+    Returns:
+        Tuple of the per request records (in send order) and the elapsed time in seconds
+    """
+    if duration_seconds is None:
+        offsets = arrival_offsets(len(payloads), request_rate, arrival_distribution, seed)
+    else:
+        offsets = itertools.takewhile(lambda offset: offset < duration_seconds,
+                                      _arrival_times(request_rate, arrival_distribution, seed))
+    logger.info(f"run_open_loop, sending {len(payloads)} payloads at request_rate={request_rate}/s, "
+                f"arrival_distribution={arrival_distribution}, max_in_flight={max_in_flight}, "
+                f"duration_seconds={duration_seconds}")
+    return await _run_schedule(send, zip(itertools.cycle(payloads), offsets), max_in_flight, on_response)
+
+
+async def run_replay(send: SendFn,
+                     payloads: List[Dict],
+                     max_in_flight: Optional[int] = None,
+                     on_response: ResponseCallback = None) -> Tuple[List[Dict], float]:
+    """
+    Send each payload at its arrival_offset (seconds from the start of the run) from a
+    replayed trace, without waiting for previous requests.
+
+    Args:
+        send: Coroutine function that sends a single payload and returns its record
+        payloads: List of payloads each with an arrival_offset, see fmbench/scripts/trace_replay.py
+        max_in_flight: Optional cap on the number of requests in flight, waiting
+                       for a free slot counts as queueing delay
+        on_response: Optional callback called with each record as soon as it is complete
+
+    Returns:
+        Tuple of the per request records (in send order) and the elapsed time in seconds
+    """
+    schedule = sorted(((p, p["arrival_offset"]) for p in payloads), key=lambda x: x[1])
+    logger.info(f"run_replay, sending {len(payloads)} payloads over "
+                f"{schedule[-1][1] if schedule else 0:.2f} seconds, max_in_flight={max_in_flight}")
+    return await _run_schedule(send, schedule, max_in_flight, on_response)
+
+
+async def _run_schedule(send: SendFn,
+                        schedule: Iterable[Tuple[Dict, float]],
+                        max_in_flight: Optional[int],
+                        on_response: ResponseCallback) -> Tuple[List[Dict], float]:
+    # send each payload at its offset from the start of the run
+    semaphore = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+    clock = _RunClock()
+
+    async def _one(payload: Dict, intended_start: float) -> Dict:
+        if semaphore is None:
+            return await _timed_send(send, payload, intended_start, clock, on_response)
+        async with semaphore:
+            return await _timed_send(send, payload, intended_start, clock, on_response)
+
+    tasks: List[asyncio.Task] = []
+    for payload, offset in schedule:
+        intended_start = clock.perf_start + offset
+        delay = intended_start - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # if we are running late the intended start time is still the scheduled
+        # time so that the delay is accounted for in the queueing delay
+        tasks.append(asyncio.create_task(_one(payload, intended_start)))
+    responses = list(await asyncio.gather(*tasks))
+    elapsed = time.perf_counter() - clock.perf_start
+    return responses, elapsed
+
+
+async def run_closed_loop(send: SendFn,
+                          payloads: List[Dict],
+                          concurrency: int,
+                          duration_seconds: Optional[float] = None,
+                          on_response: ResponseCallback = None) -> Tuple[List[Dict], float]:
+    """
+    Keep exactly `concurrency` requests in flight until all payloads have been sent.
+    There is no chunk barrier, a new request is sent as soon as one finishes.
+
+    Args:
+        send: Coroutine function that sends a single payload and returns its record
+        payloads: List of payloads, each payload is sent once unless duration_seconds is set
+        concurrency: Number of requests to keep in flight
+        duration_seconds: Optional duration for which new requests are sent, the payloads
+                          are cycled through until the duration has elapsed
+        on_response: Optional callback called with each record as soon as it is complete
+
+    Returns:
+        Tuple of the per request records (in send order) and the elapsed time in seconds
+    """
+    responses: Dict[int, Dict] = {}
+    clock = _RunClock()
+    if duration_seconds is None:
+        next_index = iter(range(len(payloads)))
+        num_workers = min(concurrency, len(payloads))
+    else:
+        next_index = itertools.count()
+        num_workers = concurrency
+        deadline = clock.perf_start + duration_seconds
+    logger.info(f"run_closed_loop, sending {len(payloads)} payloads with concurrency={concurrency}, "
+                f"duration_seconds={duration_seconds}")
+
+    async def _worker():
+        for i in next_index:
+            # in a closed loop a request is intended to start as soon as a slot frees up
+            intended_start = time.perf_counter()
+            if duration_seconds is not None and intended_start >= deadline:
+                break
+            responses[i] = await _timed_send(send, payloads[i % len(payloads)], intended_start,
+                                             clock, on_response)
+
+    await asyncio.gather(*[_worker() for _ in range(num_workers)])
+    elapsed = time.perf_counter() - clock.perf_start
+    return [responses[i] for i in sorted(responses)], elapsed
+
+
+async def run_load(send: SendFn,
+                   payloads: List[Dict],
+                   concurrency: int,
+                   load_generation: Dict,
+                   on_response: ResponseCallback = None) -> Tuple[List[Dict], float]:
+    """
+    Run the payloads with the configured load generation mode.
+
+    Args:
+        send: Coroutine function that sends a single payload and returns its record
+        payloads: List of payloads
+        concurrency: Concurrency level for this combination
+        load_generation: Load generation settings from get_load_generation_config
+        on_response: Optional callback called with each record as soon as it is complete
+
+    Returns:
+        Tuple of the per request records and the elapsed time in seconds
+    """
+    mode = load_generation["mode"]
+    if mode == LOAD_MODE_OPEN_LOOP:
+        return await run_open_loop(send,
+                                   payloads,
+                                   load_generation["request_rate"],
+                                   load_generation["arrival_distribution"],
+                                   max_in_flight=concurrency,
+                                   seed=load_generation.get("seed"),
+                                   duration_seconds=load_generation.get("duration_seconds"),
+                                   on_response=on_response)
+    elif mode == LOAD_MODE_CLOSED_LOOP:
+        return await run_closed_loop(send,
+                                     payloads,
+                                     concurrency,
+                                     duration_seconds=load_generation.get("duration_seconds"),
+                                     on_response=on_response)
+    elif mode == LOAD_MODE_REPLAY:
+        return await run_replay(send, payloads, max_in_flight=concurrency, on_response=on_response)
+    raise ValueError(f"run_load does not handle load_generation mode=\"{mode}\"")
@@ -0,0 +1,106 @@
+"""
+Client side micro-batching for FMBench
+
+Some self-hosted endpoints accept several prompts in one request and batch them on the
+server. The micro-batcher collects the payloads of concurrent requests until it has
+batch_size of them or the first one has waited max_wait_ms, sends them with a single
+call and hands each caller its own result. Every result carries how long its payload
+waited for the batch to be sent and the size of the batch, so that the latency can be
+attributed to each item (the wait plus the latency of the batch request).
+
+A batch can only be as large as the number of requests in flight, so batch_size needs
+to be at most the concurrency level, a lower concurrency level sends partial batches
+after max_wait_ms.
+"""
+
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WAIT_MS: float = 10
+
+
+@dataclass(frozen=True, slots=True)
+class BatchResult:
+    """Result of one item of a batch."""
+    value: Any
+    # seconds from the submission of the item to the sending of its batch
+    wait_time: float
+    batch_size: int
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent callers into batches for send_batch, which
+    is called with a list of items and needs to return one result per item in the same
+    order. The batcher is bound to the event loop it is first used on.
+    """
+
+    def __init__(self,
+                 send_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+                 batch_size: int,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        if batch_size < 1:
+            raise ValueError(f"MicroBatcher batch_size={batch_size} needs to be at least 1")
+        self._send_batch = send_batch
+        self._batch_size = batch_size
+        self._max_wait = max_wait_ms / 1000
+        # item, submit time and future of the items waiting for the next batch
+        self._pending: List[Tuple[Any, float, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # batches in flight, referenced so that their tasks are not garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> BatchResult:
+        """
+        Add an item to the next batch and wait for its result, the exception of
+        send_batch is raised in every caller of the batch.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+        future = loop.create_future()
+        self._pending.append((item, time.perf_counter(), future))
+        if len(self._pending) >= self._batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch == []:
+            return
+        task = self._loop.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[Any, float, asyncio.Future]]) -> None:
+        send_time = time.perf_counter()
+        try:
+            results = await self._send_batch([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"MicroBatcher, send_batch returned {len(results)} results "
+                                 f"for a batch of {len(batch)}")
+        except Exception as e:
+            logger.error(f"MicroBatcher, batch of {len(batch)} failed, exception={e}")
+            for _, _, future in batch:
+                # the caller may have been cancelled, for example by its deadline
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, submit_time, future), value in zip(batch, results):
+            if not future.done():
+                future.set_result(BatchResult(value, send_time - submit_time, len(batch)))
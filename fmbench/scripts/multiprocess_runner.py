@@ -0,0 +1,281 @@
+"""
+Multi-process runner for FMBench
+
+At high concurrency with streaming enabled the client itself becomes the bottleneck:
+per-token parsing of the response stream, logging and token counting all run under a
+single GIL in the notebook kernel and inflate TTFT and TPOT. The multi-process runner
+shards the payloads of a chunk (or the request list of the open and closed loop modes)
+across `num_processes` worker processes. Each worker process has its own event loop,
+predictor and worker pool, and streams every per inference record back to the parent
+as soon as it is complete. The parent merges the records so that the metrics are
+calculated exactly as for a single process run.
+
+Worker processes are started once per experiment and reused for all the chunks of the
+experiment, the time it takes to start them is not part of the measured elapsed time.
+"""
+
+import time
+import queue
+import asyncio
+import logging
+import multiprocessing
+from typing import Dict, List, Tuple, Callable, Any, Set, Optional
+from fmbench.scripts.worker_pool import merge_stats
+from fmbench.scripts.load_generator import (LOAD_MODE_CHUNKED,
+                                            run_load)
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# spawn does not copy the threads and open connections of the parent process
+# into the worker processes, unlike fork
+DEFAULT_START_METHOD: str = "spawn"
+# how often the parent checks that the worker processes are still alive
+# while waiting for messages from them
+LIVENESS_CHECK_INTERVAL_SECONDS: float = 1.0
+# how long to wait for a worker process to exit on shutdown
+SHUTDOWN_TIMEOUT_SECONDS: float = 10.0
+
+# messages sent by the worker processes to the parent
+_MSG_READY: str = "ready"
+_MSG_RECORD: str = "record"
+_MSG_DONE: str = "done"
+_MSG_ERROR: str = "error"
+
+
+def shard_payloads(payloads: List[Dict], num_shards: int) -> List[List[Dict]]:
+    """
+    Split the payloads round robin into num_shards lists so that every shard
+    gets a similar mix of payloads.
+    """
+    return [payloads[i::num_shards] for i in range(num_shards)]
+
+
+def shard_concurrency(concurrency: int, num_shards: int) -> List[int]:
+    """
+    Split the concurrency level across num_shards, the shares add up to concurrency.
+    """
+    return [concurrency // num_shards + (1 if i < concurrency % num_shards else 0)
+            for i in range(num_shards)]
+
+
+def shard_load_generation(load_generation: Dict, shard_index: int, num_shards: int) -> Dict:
+    """
+    Get the load generation settings for one shard. In open loop mode each shard sends
+    at request_rate/num_shards, the superposition of the shards has the configured rate
+    (and is still a Poisson process for Poisson arrivals). Each shard gets its own seed
+    so that the shards do not send at the same instants, and 1/num_shards of the client
+    side rate limits (rate_limit_share) since only num_shards senders run at the same time.
+    """
+    shard = dict(load_generation)
+    shard["rate_limit_share"] = 1 / num_shards
+    if shard.get("request_rate") is not None:
+        shard["request_rate"] = shard["request_rate"] / num_shards
+    if shard.get("seed") is not None:
+        shard["seed"] = shard["seed"] + shard_index
+    return shard
+
+
+async def run_shard(sender: Any,
+                    payloads: List[Dict],
+                    concurrency: int,
+                    payload_file: str,
+                    load_generation: Dict,
+                    on_response: Callable[[Dict], None]) -> None:
+    """
+    Run a shard of payloads with a sender and call on_response with each per inference
+    record as soon as it is complete. Used by the worker processes of this module and by
+    the workers of the distributed runner.
+    """
+    # senders with client side rate limits use their share of the quota for this run
+    if hasattr(sender, "set_rate_limit_share"):
+        sender.set_rate_limit_share(load_generation.get("rate_limit_share", 1.0))
+    async def send(payload: Dict) -> Dict:
+        return await sender.send(payload, payload_file)
+
+    if load_generation["mode"] == LOAD_MODE_CHUNKED:
+        # all the payloads of the shard of a chunk are sent at once
+        async def send_and_report(payload: Dict) -> Dict:
+            response = await send(payload)
+            on_response(response)
+            return response
+        await asyncio.gather(*[send_and_report(payload) for payload in payloads])
+    else:
+        await run_load(send, payloads, concurrency, load_generation, on_response)
+
+
+def _worker_main(worker_index: int,
+                 sender_factory: Callable[..., Any],
+                 sender_args: Dict,
+                 task_queue: multiprocessing.Queue,
+                 result_queue: multiprocessing.Queue) -> None:
+    try:
+        sender = sender_factory(**sender_args)
+    except Exception as e:
+        result_queue.put((_MSG_ERROR, worker_index, f"could not create sender, exception={e}"))
+        return
+    result_queue.put((_MSG_READY, worker_index, None))
+
+    def on_response(response: Dict) -> None:
+        result_queue.put((_MSG_RECORD, worker_index, response))
+
+    # one event loop for the lifetime of the worker so that async clients
+    # created by the predictor can be reused across tasks
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            payloads, concurrency, payload_file, load_generation = task
+            try:
+                loop.run_until_complete(run_shard(sender, payloads, concurrency, payload_file,
+                                                  load_generation, on_response))
+                result_queue.put((_MSG_DONE, worker_index, sender.stats()))
+            except Exception as e:
+                result_queue.put((_MSG_ERROR, worker_index, f"task failed, exception={e}"))
+    finally:
+        sender.shutdown()
+        loop.close()
+
+
+class MultiProcessRunner:
+    """
+    Pool of worker processes that run the payloads of a chunk (or of a load generation
+    run) in parallel and stream the per inference records back to the parent.
+
+    The sender_factory is called in each worker process with sender_args and needs to
+    return an object with an async send(payload, payload_file) method that returns the
+    per inference record, a stats() method and a shutdown() method, for example
+    fmbench.scripts.inference.InferenceSender. Both need to be picklable. Senders with
+    client side rate limits can have a set_rate_limit_share(share) method, it is called
+    before every run with the share of the limits of that run (see shard_load_generation).
+    """
+
+    def __init__(self,
+                 num_processes: int,
+                 sender_factory: Callable[..., Any],
+                 sender_args: Dict,
+                 start_method: str = DEFAULT_START_METHOD):
+        self._num_processes = num_processes
+        self._is_shutdown = False
+        self._stats: Dict = {}
+        ctx = multiprocessing.get_context(start_method)
+        self._result_queue = ctx.Queue()
+        self._task_queues = [ctx.Queue() for _ in range(num_processes)]
+        self._processes = [ctx.Process(target=_worker_main,
+                                       args=(i, sender_factory, sender_args,
+                                             self._task_queues[i], self._result_queue),
+                                       name=f"fmbench-worker-{i}",
+                                       daemon=True)
+                           for i in range(num_processes)]
+        st = time.perf_counter()
+        for p in self._processes:
+            p.start()
+        try:
+            self._wait_for(set(range(num_processes)), _MSG_READY)
+        except Exception:
+            self.shutdown()
+            raise
+        logger.info(f"MultiProcessRunner, started {num_processes} worker processes "
+                    f"in {time.perf_counter() - st:.2f} seconds")
+
+    @property
+    def num_processes(self) -> int:
+        """The number of worker processes."""
+        return self._num_processes
+
+    def _get_message(self) -> Tuple[str, int, Any]:
+        while True:
+            try:
+                return self._result_queue.get(timeout=LIVENESS_CHECK_INTERVAL_SECONDS)
+            except queue.Empty:
+                dead = [p.name for p in self._processes if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"MultiProcessRunner, worker processes {dead} exited unexpectedly")
+
+    def _wait_for(self, pending: Set[int], msg_type: str, responses: Optional[List[Dict]] = None) -> List[Dict]:
+        stats_list: List[Dict] = []
+        while pending:
+            kind, worker_index, data = self._get_message()
+            if kind == _MSG_RECORD:
+                responses.append(data)
+            elif kind == _MSG_ERROR:
+                raise RuntimeError(f"MultiProcessRunner, worker process {worker_index} failed: {data}")
+            elif kind == msg_type:
+                pending.discard(worker_index)
+                if data is not None:
+                    stats_list.append(data)
+        return stats_list
+
+    async def run(self,
+                  payloads: List[Dict],
+                  concurrency: int,
+                  payload_file: str,
+                  load_generation: Dict) -> Tuple[List[Dict], float]:
+        """
+        Shard the payloads across the worker processes and wait for all of them.
+
+        Args:
+            payloads: The chunk, or the request list for the open and closed loop modes
+            concurrency: Concurrency level for this combination, split across the processes
+            payload_file: Payload file the payloads come from
+            load_generation: Load generation settings from get_load_generation_config
+
+        Returns:
+            Tuple of the per request records of all the processes and the elapsed time in seconds
+        """
+        if self._is_shutdown:
+            raise RuntimeError("MultiProcessRunner has been shut down")
+        # every process needs at least one request and one concurrency slot
+        num_shards = max(1, min(self._num_processes, concurrency, len(payloads)))
+        payload_shards = shard_payloads(payloads, num_shards)
+        concurrency_shards = shard_concurrency(concurrency, num_shards)
+        logger.info(f"MultiProcessRunner, running {len(payloads)} payloads with concurrency={concurrency} "
+                    f"on {num_shards} processes, payloads per process={[len(s) for s in payload_shards]}")
+        responses: List[Dict] = []
+        st = time.perf_counter()
+        for i in range(num_shards):
+            self._task_queues[i].put((payload_shards[i],
+                                      concurrency_shards[i],
+                                      payload_file,
+                                      shard_load_generation(load_generation, i, num_shards)))
+        try:
+            # the queue reads are blocking, wait for them on a thread so that the event loop is free
+            stats_list = await asyncio.to_thread(self._wait_for, set(range(num_shards)), _MSG_DONE, responses)
+        except Exception:
+            # records of a failed run may still be in the queue, do not reuse the processes
+            self.shutdown()
+            raise
+        elapsed = time.perf_counter() - st
+        self._stats = merge_stats(stats_list)
+        return responses, elapsed
+
+    def stats(self) -> Dict:
+        """
+        Get the merged worker pool stats of the worker processes for the last run.
+        """
+        return dict(self._stats)
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes, idempotent.
+        """
+        if self._is_shutdown:
+            return
+        self._is_shutdown = True
+        logger.info(f"MultiProcessRunner, shutting down {self._num_processes} worker processes")
+        for q in self._task_queues:
+            q.put(None)
+        for p in self._processes:
+            p.join(timeout=SHUTDOWN_TIMEOUT_SECONDS)
+            if p.is_alive():
+                logger.error(f"MultiProcessRunner, worker process {p.name} did not exit, terminating it")
+                p.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -0,0 +1,354 @@
+"""
+Predictor for OpenAI compatible servers (vLLM, TGI, SGLang, llama.cpp, ...)
+
+Sends the requests to the /chat/completions (or /completions) route of an OpenAI compatible
+server with a pooled HTTP client, without going through LiteLLM. With streaming enabled the
+server-sent events are parsed as they arrive to measure the TTFT, TPOT and TTLT and the token
+counts are taken from the usage chunk at the end of the stream (stream_options.include_usage).
+Select it with `inference_script: openai_compatible_predictor.py` in an experiment, the
+ep_name is the base URL of the server:
+
+    ep_name: http://localhost:8000/v1
+    inference_script: openai_compatible_predictor.py
+    inference_spec:
+      # model name sent with the requests, defaults to the ep_name
+      model_id: meta-llama/Llama-3.1-8B-Instruct
+      # chat (default) or completions
+      api: chat
+      stream: True
+      # optional, sent with every request, for example an Authorization header
+      headers:
+        Authorization: "Bearer your-api-key"
+      # temperature, max_tokens, top_p, ... from the inference_parameters section
+      parameter_set: openai_compatible
+
+The connection pool, timeouts and HTTP/2 are configured as for the other REST predictors
+(see http_client.py) and token_timings records the time of every streamed token (see
+token_timings.py).
+"""
+
+import time
+import json
+import httpx
+import asyncio
+import logging
+import pandas as pd
+from datetime import datetime
+from typing import Dict, List, Optional
+from fmbench.scripts import constants
+from fmbench.scripts.stream_parser import SSEDecoder
+from fmbench.scripts.token_timings import new_token_times
+from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
+                                               PredictionRecord,
+                                               FMBenchPredictionResponse)
+from fmbench.scripts.http_client import (RequestTimings,
+                                         AsyncClientHolder,
+                                         create_client,
+                                         get_client_settings)
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+API_CHAT: str = "chat"
+API_COMPLETIONS: str = "completions"
+_ROUTES: Dict[str, str] = {API_CHAT: "/chat/completions", API_COMPLETIONS: "/completions"}
+# timeout of a request in seconds if the inference spec does not set one
+DEFAULT_TIMEOUT: int = 180
+# retries of requests rejected with HTTP 429 (too many requests)
+MAX_RETRIES: int = 5
+INITIAL_RETRY_DELAY: float = 1.0
+MAX_RETRY_DELAY: float = 30.0
+
+
+class _StreamState:
+    """
+    Collects the chunks of a streamed response and computes the Time To First Token (TTFT),
+    Time Per Output Token (TPOT) and Time To Last Token (TTLT) from the times they were
+    received. A chunk is counted as one token, the TPOT uses the completion tokens from the
+    usage chunk instead if the server reports them.
+    """
+
+    def __init__(self, start_time: float, api: str, record_token_times: bool):
+        self._start_time = start_time
+        self._api = api
+        self._first_time: Optional[float] = None
+        self._last_time: Optional[float] = None
+        self._num_chunks: int = 0
+        self._text: List[str] = []
+        self._usage: Dict = {}
+        self._token_times = new_token_times() if record_token_times else None
+
+    def process(self, data: str, current_time: float) -> None:
+        """Process the data payload of a server-sent event."""
+        chunk = json.loads(data)
+        if chunk.get("usage"):
+            self._usage = chunk["usage"]
+        choices = chunk.get("choices") or []
+        if choices == []:
+            return
+        text = choices[0].get("delta", {}).get("content") if self._api == API_CHAT else choices[0].get("text")
+        if not text:
+            return
+        if self._first_time is None:
+            self._first_time = current_time
+        self._last_time = current_time
+        self._num_chunks += 1
+        if self._token_times is not None:
+            self._token_times.append(current_time - self._start_time)
+        self._text.append(text)
+
+    def result(self, model_id: str) -> PredictionRecord:
+        latency = time.perf_counter() - self._start_time
+        prompt_tokens = self._usage.get("prompt_tokens")
+        completion_tokens = self._usage.get("completion_tokens")
+        TTFT: Optional[float] = None
+        TTLT: Optional[float] = None
+        TPOT: Optional[float] = None
+        if self._first_time is not None:
+            TTFT = self._first_time - self._start_time
+            TTLT = self._last_time - self._start_time
+            tokens = completion_tokens if completion_tokens is not None else self._num_chunks
+            if tokens > 1:
+                TPOT = (self._last_time - self._first_time) / (tokens - 1)
+        usage_reported = prompt_tokens is not None and completion_tokens is not None
+        return PredictionRecord(generated_text="".join(self._text),
+                                latency=latency,
+                                prompt_tokens=prompt_tokens,
+                                completion_tokens=completion_tokens,
+                                time_to_first_token=TTFT,
+                                time_per_output_token=TPOT,
+                                time_to_last_token=TTLT,
+                                token_times=self._token_times,
+                                # counted after the run if the server does not report the usage
+                                token_count_model=None if usage_reported else model_id)
+
+
+class OpenAICompatiblePredictor(FMBenchPredictor):
+    """
+    Predictor for the chat/completions and completions APIs of OpenAI compatible servers,
+    see the module docstring for the configuration.
+    """
+
+    def __init__(self,
+                 endpoint_name: str,
+                 inference_spec: Optional[Dict],
+                 metadata: Optional[Dict]):
+        self._endpoint_name: str = endpoint_name
+        self._inference_spec: Dict = inference_spec or {}
+        self._model_id: str = self._inference_spec.get("model_id", endpoint_name)
+        self._api: str = self._inference_spec.get("api", API_CHAT)
+        if self._api not in _ROUTES:
+            raise ValueError(f"OpenAICompatiblePredictor, api={self._api} needs to be one of {list(_ROUTES)}")
+        self._url: str = endpoint_name.rstrip("/") + _ROUTES[self._api]
+        self._headers: Optional[Dict] = self._inference_spec.get("headers")
+        self._parameters: Dict = self._inference_spec.get("parameters") or {}
+        self._stream: bool = self._inference_spec.get("stream", False) is True
+        self._token_timings: bool = self._inference_spec.get("token_timings", False) is True
+        # one pooled client per predictor so that requests reuse kept-alive connections
+        client_settings = get_client_settings(inference_spec, metadata, DEFAULT_TIMEOUT)
+        self._client = create_client(client_settings)
+        self._async_client = AsyncClientHolder(client_settings)
+        logger.info(f"__init__, _url={self._url}, _model_id={self._model_id}, _stream={self._stream}, "
+                    f"_parameters={self._parameters}")
+
+    def _get_request_body(self, payload: Dict) -> Dict:
+        body = dict(model=self._model_id) | self._parameters
+        if self._api == API_CHAT:
+            body["messages"] = [{"role": "user", "content": payload['inputs']}]
+        else:
+            body["prompt"] = payload['inputs']
+        # the max_tokens of a replayed trace entry overrides the configured max_tokens
+        if payload.get('max_tokens') is not None:
+            body["max_tokens"] = payload['max_tokens']
+        if self._stream:
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    def _parse_response(self, response_data: Dict, latency: float) -> PredictionRecord:
+        choice = (response_data.get("choices") or [{}])[0]
+        generated_text = choice.get("message", {}).get("content") if self._api == API_CHAT else choice.get("text")
+        usage = response_data.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        usage_reported = prompt_tokens is not None and completion_tokens is not None
+        return PredictionRecord(generated_text=generated_text,
+                                latency=latency,
+                                prompt_tokens=prompt_tokens,
+                                completion_tokens=completion_tokens,
+                                token_count_model=None if usage_reported else self._model_id)
+
+    def _get_retry_wait_time(self, response: httpx.Response, retry_count: int) -> Optional[float]:
+        # retry requests rejected with too many requests with an exponential backoff
+        if response.status_code != 429 or retry_count > MAX_RETRIES:
+            return None
+        wait_time = min(INITIAL_RETRY_DELAY * (2 ** (retry_count - 1)), MAX_RETRY_DELAY)
+        logger.warning(f"too many requests, endpoint_name={self._endpoint_name}, "
+                       f"retrying in {wait_time:.2f} seconds (attempt {retry_count})")
+        return wait_time
+
+    def _to_response(self, record: PredictionRecord, timings: RequestTimings) -> FMBenchPredictionResponse:
+        response = record.to_response()
+        # connect, TLS and time to first byte of the request
+        response.update(timings.to_dict())
+        return response
+
+    def _get_error_response(self, retry_wait_time: float) -> FMBenchPredictionResponse:
+        # a failed request has no completion and is counted as an error
+        return PredictionRecord(generated_text=None,
+                                latency=None,
+                                prompt_tokens=None,
+                                completion_tokens=None,
+                                retry_wait_time=retry_wait_time).to_response()
+
+    def _send(self, payload: Dict) -> FMBenchPredictionResponse:
+        timings = RequestTimings()
+        st = time.perf_counter()
+        request = self._client.build_request("POST", self._url, headers=self._headers,
+                                             json=self._get_request_body(payload),
+                                             extensions={"trace": timings.trace})
+        response = self._client.send(request, stream=self._stream)
+        try:
+            response.raise_for_status()
+            if not self._stream:
+                return self._to_response(self._parse_response(response.json(), time.perf_counter() - st), timings)
+            state = _StreamState(st, self._api, self._token_timings)
+            decoder = SSEDecoder()
+            for data in response.iter_bytes():
+                for event in decoder.feed(data):
+                    state.process(event, time.perf_counter())
+                if decoder.done:
+                    break
+            for event in decoder.flush():
+                state.process(event, time.perf_counter())
+            return self._to_response(state.result(self._model_id), timings)
+        finally:
+            response.close()
+
+    async def _asend(self, payload: Dict) -> FMBenchPredictionResponse:
+        client = self._async_client.get()
+        timings = RequestTimings()
+        st = time.perf_counter()
+        request = client.build_request("POST", self._url, headers=self._headers,
+                                       json=self._get_request_body(payload),
+                                       extensions={"trace": timings.atrace})
+        response = await client.send(request, stream=self._stream)
+        try:
+            response.raise_for_status()
+            if not self._stream:
+                await response.aread()
+                return self._to_response(self._parse_response(response.json(), time.perf_counter() - st), timings)
+            state = _StreamState(st, self._api, self._token_timings)
+            decoder = SSEDecoder()
+            async for data in response.aiter_bytes():
+                for event in decoder.feed(data):
+                    state.process(event, time.perf_counter())
+                if decoder.done:
+                    break
+            for event in decoder.flush():
+                state.process(event, time.perf_counter())
+            return self._to_response(state.result(self._model_id), timings)
+        finally:
+            await response.aclose()
+
+    def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        retry_count: int = 0
+        retry_wait_time: float = 0.0
+        while True:
+            try:
+                response = self._send(payload)
+                response["retry_wait_time"] = retry_wait_time
+                return response
+            except httpx.HTTPStatusError as e:
+                retry_count += 1
+                wait_time = self._get_retry_wait_time(e.response, retry_count)
+                if wait_time is not None:
+                    retry_wait_time += wait_time
+                    time.sleep(wait_time)
+                    continue
+                error: Exception = e
+            except Exception as e:
+                # transport errors, timeouts and responses that are not valid JSON
+                error = e
+            logger.error(f"get_prediction, endpoint_name={self._endpoint_name}, exception={error}")
+            return self._get_error_response(retry_wait_time)
+
+    async def aget_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        """Asynchronous version of get_prediction on the async pooled client."""
+        retry_count: int = 0
+        retry_wait_time: float = 0.0
+        while True:
+            try:
+                response = await self._asend(payload)
+                response["retry_wait_time"] = retry_wait_time
+                return response
+            except httpx.HTTPStatusError as e:
+                retry_count += 1
+                wait_time = self._get_retry_wait_time(e.response, retry_count)
+                if wait_time is not None:
+                    retry_wait_time += wait_time
+                    await asyncio.sleep(wait_time)
+                    continue
+                error: Exception = e
+            except Exception as e:
+                # transport errors, timeouts and responses that are not valid JSON
+                error = e
+            logger.error(f"aget_prediction, endpoint_name={self._endpoint_name}, exception={error}")
+            return self._get_error_response(retry_wait_time)
+
+    def calculate_cost(self,
+                       instance_type: str,
+                       instance_count: int,
+                       pricing: Dict,
+                       duration: float,
+                       prompt_tokens: int,
+                       completion_tokens: int) -> float:
+        """Calculate the cost of each experiment run, with the token based pricing of the
+           instance type if there is one and the hourly instance based pricing otherwise."""
+        experiment_cost: Optional[float] = None
+        try:
+            token_based_pricing = pricing.get('pricing', {}).get('token_based', {}).get(instance_type)
+            if token_based_pricing:
+                input_token_cost = (prompt_tokens / 1000.0) * token_based_pricing['input-per-1k-tokens']
+                output_token_cost = (completion_tokens / 1000.0) * token_based_pricing['output-per-1k-tokens']
+                experiment_cost = input_token_cost + output_token_cost
+            else:
+                hourly_rate = pricing['pricing']['instance_based'].get(instance_type)
+                experiment_cost = (hourly_rate / 3600) * duration * (instance_count or 1)
+            logger.info(f"calculate_cost, instance_type={instance_type}, experiment_cost={experiment_cost}")
+        except Exception as e:
+            logger.error(f"Exception occurred during experiment cost calculation, exception={e}")
+        return experiment_cost
+
+    def get_metrics(self,
+                    start_time: datetime,
+                    end_time: datetime,
+                    period: int = 60) -> pd.DataFrame:
+        # not implemented
+        return None
+
+    def shutdown(self) -> None:
+        """Close the pooled clients."""
+        self._client.close()
+        self._async_client.close()
+        return None
+
+    @property
+    def endpoint_name(self) -> str:
+        """The endpoint name property."""
+        return self._endpoint_name
+
+    @property
+    def inference_parameters(self) -> Dict:
+        """The inference parameters property."""
+        return self._parameters
+
+    @property
+    def platform_type(self) -> Dict:
+        """The platform type property."""
+        return constants.PLATFORM_EXTERNAL
+
+
+def create_predictor(endpoint_name: str, inference_spec: Optional[Dict], metadata: Optional[Dict]):
+    return OpenAICompatiblePredictor(endpoint_name, inference_spec, metadata)
@@ -0,0 +1,160 @@
+"""
+Client side rate limiter for FMBench
+
+Bedrock quotas are set per model id as requests per minute (RPM) and tokens per minute
+(TPM). Without client side pacing the quota is only enforced by throttling errors, every
+throttled request is retried after an exponential backoff which wastes quota and skews the
+latency. The rate limiter paces the requests before they are sent instead.
+
+The limits are configured per model id in the `rate_limits` section of the config file:
+
+    rate_limits:
+      anthropic.claude-3-haiku-20240307-v1:0:
+        requests_per_minute: 200
+        tokens_per_minute: 200000
+        # optional, the burst allowed after an idle period
+        burst_seconds: 1
+
+The limiters are kept in a module level registry so that all the predictors (and all the
+experiments) of a process that use the same model id share the same quota. The limiter only
+hands out reservations, reserve() returns how long the caller needs to wait, so that it can
+also be shared across processes by hosting it in a single process (for example a Ray actor).
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# by default a limiter allows a burst of one second worth of requests (or tokens)
+DEFAULT_BURST_SECONDS: float = 1.0
+
+# model id -> rate limiter, shared by all the predictors of this process
+_RATE_LIMITERS: Dict[str, "RateLimiter"] = {}
+
+
+class TokenBucket:
+    """
+    Token bucket that refills at rate_per_minute up to a capacity of burst_seconds worth
+    of tokens. A reservation larger than the available tokens puts the bucket in debt, the
+    caller waits until the debt is repaid so that consecutive reservations are served in order.
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = DEFAULT_BURST_SECONDS):
+        if rate_per_minute <= 0:
+            raise ValueError(f"TokenBucket rate_per_minute={rate_per_minute} needs to be positive")
+        self._rate = rate_per_minute / 60
+        self._capacity = self._rate * burst_seconds
+        self._tokens = self._capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount tokens from the bucket.
+
+        Returns:
+            Seconds to wait before the reserved tokens are available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self._rate)
+
+
+class RateLimiter:
+    """
+    Paces requests to stay within a requests per minute and a tokens per minute limit,
+    either limit is optional.
+    """
+
+    def __init__(self,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 burst_seconds: float = DEFAULT_BURST_SECONDS):
+        self._requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+
+    @property
+    def limits_tokens(self) -> bool:
+        """True if there is a tokens per minute limit, the callers then need to provide the token count."""
+        return self._tokens is not None
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Reserve one request with the given number of tokens.
+
+        Returns:
+            Seconds to wait before sending the request
+        """
+        wait_time = self._requests.reserve(1) if self._requests is not None else 0.0
+        if self._tokens is not None:
+            wait_time = max(wait_time, self._tokens.reserve(tokens))
+        return wait_time
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Wait until a request with the given number of tokens can be sent.
+
+        Returns:
+            Seconds spent waiting
+        """
+        wait_time = self.reserve(tokens)
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """
+        Asynchronous version of acquire.
+        """
+        wait_time = self.reserve(tokens)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        return wait_time
+
+
+def scale_rate_limits(rate_limits: Optional[Dict], scale: float) -> Optional[Dict]:
+    """
+    Scale the limits of the rate_limits section of the config file, used to split
+    a quota across processes that each have their own limiters.
+    """
+    if not rate_limits:
+        return rate_limits
+    scaled: Dict = {}
+    for model_id, limits in rate_limits.items():
+        scaled[model_id] = dict(limits)
+        for key in ["requests_per_minute", "tokens_per_minute"]:
+            if limits.get(key) is not None:
+                scaled[model_id][key] = limits[key] * scale
+    return scaled
+
+
+def configure_rate_limits(rate_limits: Optional[Dict]) -> None:
+    """
+    Create the rate limiters of this process from the rate_limits section of the
+    config file, replaces any previously configured limiters.
+
+    Args:
+        rate_limits: Dictionary of model id to requests_per_minute, tokens_per_minute and burst_seconds
+    """
+    _RATE_LIMITERS.clear()
+    for model_id, limits in (rate_limits or {}).items():
+        _RATE_LIMITERS[model_id] = RateLimiter(limits.get("requests_per_minute"),
+                                               limits.get("tokens_per_minute"),
+                                               limits.get("burst_seconds", DEFAULT_BURST_SECONDS))
+        logger.info(f"configure_rate_limits, model_id={model_id}, limits={limits}")
+
+
+def get_rate_limiter(model_id: str) -> Optional[RateLimiter]:
+    """
+    Get the rate limiter for a model id, None if there is no limit for it.
+    """
+    return _RATE_LIMITERS.get(model_id)
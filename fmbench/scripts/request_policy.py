@@ -0,0 +1,162 @@
+"""
+Request timeouts and hedged requests for FMBench
+
+Without a client side deadline a hung request holds its concurrency slot until the endpoint
+gives up, which in the chunked mode stalls the entire chunk. The optional `request_policy`
+section of the config file (top level for all experiments, overridden per experiment) sets
+a deadline per request and optionally hedges slow requests:
+
+    request_policy:
+      # give up on a request after this many seconds
+      timeout_seconds: 60
+      hedging:
+        enabled: yes
+        # send a duplicate of a request that has not completed after this quantile of
+        # the latencies of the last requests
+        quantile: 0.95
+        # no hedges until this many latencies have been observed
+        min_samples: 20
+        # optional, a fixed delay instead of the quantile
+        # delay_seconds: 5
+
+A request that misses the deadline is cancelled if the predictor is asynchronous and
+abandoned otherwise (the blocking call runs to completion on its worker thread but its
+result is discarded), its record has timed_out set and no completion.
+
+Hedging is measured, not applied: the record of a request is always the record of the
+first (primary) request so that the latency percentiles are those of the endpoint. The
+duplicate (hedge) runs to completion as well and the record gets hedge_latency (latency of
+the duplicate) and hedged_latency, the latency the client would have seen with hedging
+(the earlier of the primary and the hedge delay plus the hedge latency). Comparing the
+percentiles of latency and hedged_latency shows how much tail latency hedging would save
+against the endpoint, at the cost of the extra requests (hedged_requests).
+"""
+
+import time
+import asyncio
+import logging
+import numpy as np
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEDGE_QUANTILE: float = 0.95
+DEFAULT_HEDGE_MIN_SAMPLES: int = 20
+# the hedge delay is the quantile of this many of the most recent latencies, so that
+# it follows the latency of the current concurrency level
+LATENCY_WINDOW: int = 200
+
+
+def get_request_policy_config(config: Dict, experiment: Dict) -> Optional[Dict]:
+    """
+    Get the request policy settings for an experiment from the top level `request_policy`
+    section of the config file and the `request_policy` section of the experiment.
+
+    Args:
+        config: The FMBench config
+        experiment: The experiment being run
+
+    Returns:
+        Dictionary of RequestPolicy arguments or None if there is no request policy
+    """
+    section = (config.get("request_policy") or {}) | (experiment.get("request_policy") or {})
+    hedging = section.get("hedging") or {}
+    settings = dict(timeout_seconds=section.get("timeout_seconds"),
+                    hedging=hedging.get("enabled") is True,
+                    hedge_quantile=hedging.get("quantile", DEFAULT_HEDGE_QUANTILE),
+                    hedge_min_samples=hedging.get("min_samples", DEFAULT_HEDGE_MIN_SAMPLES),
+                    hedge_delay_seconds=hedging.get("delay_seconds"))
+    if settings["timeout_seconds"] is None and settings["hedging"] is False:
+        return None
+    if not 0 < settings["hedge_quantile"] < 1:
+        raise ValueError(f"request_policy hedging quantile needs to be between 0 and 1, "
+                         f"got {settings['hedge_quantile']}")
+    logger.info(f"get_request_policy_config, experiment={experiment.get('name')}, settings={settings}")
+    return settings
+
+
+class RequestPolicy:
+    """
+    Runs requests with a deadline and optional hedging, see the module docstring. One
+    policy is shared by all the requests of an experiment, it keeps the latencies of the
+    recent requests to compute the hedge delay.
+    """
+
+    def __init__(self,
+                 timeout_seconds: Optional[float] = None,
+                 hedging: bool = False,
+                 hedge_quantile: float = DEFAULT_HEDGE_QUANTILE,
+                 hedge_min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+                 hedge_delay_seconds: Optional[float] = None):
+        self._timeout_seconds = timeout_seconds
+        self._hedging = hedging
+        self._hedge_quantile = hedge_quantile
+        self._hedge_min_samples = hedge_min_samples
+        self._hedge_delay_seconds = hedge_delay_seconds
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Get the time after which a request is hedged, None if requests are not hedged
+        (yet, the quantile needs hedge_min_samples latencies).
+        """
+        if self._hedging is False:
+            return None
+        if self._hedge_delay_seconds is not None:
+            return self._hedge_delay_seconds
+        if len(self._latencies) < self._hedge_min_samples:
+            return None
+        return float(np.quantile(self._latencies, self._hedge_quantile))
+
+    def _remaining(self, start_time: float) -> Optional[float]:
+        if self._timeout_seconds is None:
+            return None
+        return max(0.0, self._timeout_seconds - (time.perf_counter() - start_time))
+
+    async def run(self, send: Callable[[], Awaitable[Dict]], on_timeout: Callable[[], Dict]) -> Dict:
+        """
+        Send a request with the deadline and hedging of this policy.
+
+        Args:
+            send: Called to send the request (and again to send the hedge), returns the per inference record
+            on_timeout: Called to create the record of a request that missed the deadline
+
+        Returns:
+            The per inference record of the request
+        """
+        start_time = time.perf_counter()
+        primary = asyncio.ensure_future(send())
+        hedge: Optional[asyncio.Future] = None
+        delay = self.hedge_delay()
+        if delay is not None:
+            remaining = self._remaining(start_time)
+            done, _ = await asyncio.wait({primary}, timeout=delay if remaining is None else min(delay, remaining))
+            if not done and (remaining is None or remaining > delay):
+                hedge = asyncio.ensure_future(send())
+        tasks = {primary} if hedge is None else {primary, hedge}
+        _, pending = await asyncio.wait(tasks, timeout=self._remaining(start_time))
+        # cancels an asynchronous request, a request running on a worker thread is abandoned
+        for task in pending:
+            task.cancel()
+
+        timed_out: bool = primary in pending
+        response = on_timeout() if timed_out else primary.result()
+        response["timed_out"] = timed_out
+        if timed_out:
+            logger.warning(f"RequestPolicy, request timed out after {self._timeout_seconds} seconds")
+        elif response.get("latency") is not None:
+            self._latencies.append(response["latency"])
+        if self._hedging is True:
+            hedge_response = hedge.result() if hedge is not None and hedge not in pending else None
+            hedge_latency = hedge_response.get("latency") if hedge_response is not None else None
+            candidates = [response.get("latency")]
+            if hedge_latency is not None:
+                candidates.append(delay + hedge_latency)
+            response["hedged"] = hedge is not None
+            response["hedge_delay"] = delay if hedge is not None else None
+            response["hedge_latency"] = hedge_latency
+            response["hedged_latency"] = min([c for c in candidates if c is not None], default=None)
+        return response
@@ -1,10 +1,11 @@
 import os
 import json
+import asyncio
 import math
 import time
 import boto3
+import httpx
 import logging
-import requests
 import pandas as pd
 from datetime import datetime
 from fmbench.scripts import constants
@@ -12,11 +13,18 @@ from fmbench.utils import count_tokens
 from typing import Dict, Optional, List
 from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
                                                FMBenchPredictionResponse)
+from fmbench.scripts.http_client import (RequestTimings,
+                                         AsyncClientHolder,
+                                         create_client,
+                                         get_client_settings)
 
 # set a logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# timeout of a request in seconds if the inference spec does not set one
+DEFAULT_TIMEOUT: int = 180
+
 class RESTPredictor(FMBenchPredictor):
     # overriding abstract method
     def __init__(self,
@@ -26,6 +34,10 @@ class RESTPredictor(FMBenchPredictor):
         try:
             self._endpoint_name: str = endpoint_name
             self._inference_spec: Dict = inference_spec 
+            # one pooled client per predictor so that requests reuse kept-alive connections
+            client_settings = get_client_settings(inference_spec, metadata, DEFAULT_TIMEOUT)
+            self._client = create_client(client_settings)
+            self._async_client = AsyncClientHolder(client_settings)
         except Exception as e:
             logger.error(f"create_predictor, exception occured while creating predictor "
                          f"for endpoint_name={self._endpoint_name}, exception={e}")
@@ -40,21 +52,13 @@ class RESTPredictor(FMBenchPredictor):
         TTLT: Optional[float] = None
         prompt_tokens: Optional[int] = None
         completion_tokens: Optional[int] = None
-        timeout: Optional[int] = None
-        auth: Optional[Dict] = None
         # get the prompt for the EKS endpoint
         prompt: str = payload['inputs']
-        # represents the number of tokens in the prompt payload
-        prompt_tokens = count_tokens(payload["inputs"])
         try:
-            st = time.perf_counter()
             split_input_and_inference_params: Optional[bool] = None
             if self._inference_spec is not None:
                 split_input_and_inference_params = self._inference_spec.get("split_input_and_parameters")
                 logger.info(f"split input parameters is: {split_input_and_inference_params}")
-                timeout = self._inference_spec.get("timeout", 180)
-                auth = self._inference_spec.get("auth", None)
-                logger.info(f"Initializing the timeout to: {timeout}, auth to configured authentication information")
                 # Use the parameters that the model needs at inference. In this case, the model does not require inference
                 # parameters and it is handled in the ray serve script that is used to deploy this model 'ray_serve_llama2.py'
                 # parameters: Optional[Dict] = inference_spec.get('parameters')
@@ -66,11 +70,15 @@ class RESTPredictor(FMBenchPredictor):
             # This endpoint only supports the GET method now, you can add support for POST method if your endpoint supports it.
             # As an example, the following URL is used with a query added at the end of the URL.
             # http://<NLB_DNS_NAME>/serve/infer?sentence=what is data parallelism and tensor parallelism and the differences
-            response = requests.get(self._endpoint_name, params={"sentence": prompt,
-                                                                    timeout: timeout,
-                                                                    auth: auth}) # the auth dictionary contains
-                                                                                 # authentication parameters. 
-                                                                                 # You can do any custom auth handling that your endpoint supports.
+            # The timeout comes from the inference spec and is set on the pooled client. You can do any custom auth
+            # handling that your endpoint supports by passing headers or an httpx auth object here.
+            # the timings start right before the request so that they do not include the tokenizer
+            timings = RequestTimings()
+            st = time.perf_counter()
+            response = self._client.get(self._endpoint_name,
+                                        params={"sentence": prompt},
+                                        extensions={"trace": timings.trace})
+            latency = time.perf_counter() - st
 
             # the response from the model on ray serve from the url prompt is given in this format. 
             # For other response types, change the logic below and add the response in the `generated_text` key within the response_json dict
@@ -80,16 +88,53 @@ class RESTPredictor(FMBenchPredictor):
             response_json = dict(generated_text=answer_only)
             # counts the completion tokens for the model using the default/user provided tokenizer
             completion_tokens = count_tokens(response_json.get("generated_text"))
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"get_prediction, exception occurred while getting prediction for payload={payload} "
                          f"from predictor={self._endpoint_name}, response={response}, exception={e}")
+        # represents the number of tokens in the prompt payload
+        prompt_tokens = count_tokens(payload["inputs"])
         return FMBenchPredictionResponse(response_json=response_json,
                                          latency=latency,
                                          time_to_first_token=TTFT,
                                          time_per_output_token=TPOT,
                                          time_to_last_token=TTLT,
                                          completion_tokens=completion_tokens,
-                                         prompt_tokens=prompt_tokens)
+                                         prompt_tokens=prompt_tokens,
+                                         **timings.to_dict())
+
+    async def aget_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        """Asynchronous version of get_prediction that does not block a thread while
+           waiting for the endpoint. The tokenizer is blocking, the tokens are counted
+           on a thread so that the event loop is not blocked.
+        """
+        response_json: Optional[Dict] = None
+        response: Optional[httpx.Response] = None
+        latency: Optional[float] = None
+        completion_tokens: Optional[int] = None
+        prompt: str = payload['inputs']
+        timings = RequestTimings()
+        try:
+            st = time.perf_counter()
+            response = await self._async_client.get().get(self._endpoint_name,
+                                                          params={"sentence": prompt},
+                                                          extensions={"trace": timings.atrace})
+            latency = time.perf_counter() - st
+            response.raise_for_status()
+            answer_only = response.text.replace(prompt, "", 1).strip('["]?\n')
+            response_json = dict(generated_text=answer_only)
+            completion_tokens = await asyncio.to_thread(count_tokens, response_json.get("generated_text"))
+        except httpx.HTTPError as e:
+            logger.error(f"aget_prediction, exception occurred while getting prediction for payload={payload} "
+                         f"from predictor={self._endpoint_name}, response={response}, exception={e}")
+        prompt_tokens: Optional[int] = await asyncio.to_thread(count_tokens, payload["inputs"])
+        return FMBenchPredictionResponse(response_json=response_json,
+                                         latency=latency,
+                                         time_to_first_token=None,
+                                         time_per_output_token=None,
+                                         time_to_last_token=None,
+                                         completion_tokens=completion_tokens,
+                                         prompt_tokens=prompt_tokens,
+                                         **timings.to_dict())
 
     @property
     def endpoint_name(self) -> str:
@@ -141,6 +186,8 @@ class RESTPredictor(FMBenchPredictor):
         """Represents the function to shutdown the predictor
            cleanup the endpooint/container/other resources
         """
+        self._client.close()
+        self._async_client.close()
         return None
     
     @property
@@ -0,0 +1,216 @@
+"""
+Buffered result sink for FMBench
+
+Writing every per inference record to its own JSON file means one PUT per request (100k
+PUTs for a 100k request run) and names from time.time() can collide. The result sink
+buffers the records and writes them as part files of many records each, a part is written
+when the buffer holds max_rows records or about max_bytes bytes, or when its oldest record
+is older than flush_interval_seconds, and on close. Part names have a random run id and a
+sequence number so they never collide.
+
+The parts are Parquet files (one row group per part, zstd compressed) when pyarrow is
+installed, the prompt, image and other repetitive text columns are dictionary encoded so
+that a prompt replayed at every concurrency level is stored once per part. Without pyarrow
+the parts are gzip compressed JSON lines. Values that are not scalars (for example the
+inference parameters) are stored as JSON strings. The optional `result_sink` section of the
+config file sets the limits:
+
+    result_sink:
+      max_rows: 10000
+      max_bytes: 67108864
+      flush_interval_seconds: 60
+      # parquet (the default when pyarrow is installed) or jsonl
+      format: parquet
+
+read_results reads a part of either format into a dataframe.
+"""
+
+import io
+import gzip
+import json
+import time
+import uuid
+import logging
+import threading
+import pandas as pd
+from typing import Callable, Dict, List, Optional
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+RESULT_FORMAT_PARQUET: str = "parquet"
+RESULT_FORMAT_JSONL: str = "jsonl"
+RESULT_FILE_EXTENSIONS: Dict[str, str] = {RESULT_FORMAT_PARQUET: ".parquet",
+                                          RESULT_FORMAT_JSONL: ".jsonl.gz"}
+DEFAULT_MAX_ROWS: int = 10000
+DEFAULT_MAX_BYTES: int = 64 * 1024 * 1024
+DEFAULT_FLUSH_INTERVAL_SECONDS: float = 60
+# text columns with few distinct values (or large values repeated across records)
+DICTIONARY_COLUMNS: List[str] = ["endpoint_name", "prompt", "question", "ground_truth", "base64_img",
+                                 "payload_file", "experiment_name", "token_count_model", "phase"]
+_PARQUET_MAGIC: bytes = b"PAR1"
+# size of a number or None in the size estimate of a record
+_SCALAR_BYTES: int = 8
+
+
+def get_result_sink_config(config: Dict) -> Dict:
+    """
+    Get the ResultSink arguments from the optional `result_sink` section of the config file.
+
+    Args:
+        config: The FMBench config
+
+    Returns:
+        Dictionary of ResultSink arguments
+    """
+    section = config.get("result_sink") or {}
+    result_format = section.get("format", RESULT_FORMAT_PARQUET if PARQUET_AVAILABLE else RESULT_FORMAT_JSONL)
+    if result_format not in RESULT_FILE_EXTENSIONS:
+        raise ValueError(f"result_sink format={result_format} needs to be one of {list(RESULT_FILE_EXTENSIONS)}")
+    if result_format == RESULT_FORMAT_PARQUET and not PARQUET_AVAILABLE:
+        logger.warning("get_result_sink_config, parquet format but pyarrow is not installed, using jsonl")
+        result_format = RESULT_FORMAT_JSONL
+    return dict(max_rows=section.get("max_rows", DEFAULT_MAX_ROWS),
+                max_bytes=section.get("max_bytes", DEFAULT_MAX_BYTES),
+                flush_interval_seconds=section.get("flush_interval_seconds", DEFAULT_FLUSH_INTERVAL_SECONDS),
+                result_format=result_format)
+
+
+def _flatten(record: Dict) -> Dict:
+    return {k: json.dumps(v, default=str) if isinstance(v, (dict, list, tuple)) else v
+            for k, v in record.items()}
+
+
+def _size(record: Dict) -> int:
+    return sum(len(v) if isinstance(v, str) else _SCALAR_BYTES for v in record.values())
+
+
+def _to_parquet(rows: List[Dict]) -> bytes:
+    columns: Dict[str, List] = {}
+    for row in rows:
+        for k in row:
+            columns.setdefault(k, None)
+    arrays = {}
+    for name in columns:
+        values = [row.get(name) for row in rows]
+        try:
+            arrays[name] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # a column with mixed types, for example an id that is a number in some records
+            arrays[name] = pa.array([None if v is None else str(v) for v in values])
+    table = pa.table(arrays)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer,
+                   row_group_size=len(rows),
+                   use_dictionary=[c for c in DICTIONARY_COLUMNS if c in arrays],
+                   compression="zstd")
+    return buffer.getvalue()
+
+
+def _to_jsonl(rows: List[Dict]) -> bytes:
+    lines = "\n".join(json.dumps(row, default=str) for row in rows)
+    return gzip.compress(lines.encode("utf-8"))
+
+
+def read_results(data: bytes) -> pd.DataFrame:
+    """
+    Read a part written by a ResultSink.
+
+    Args:
+        data: The content of a .parquet or .jsonl.gz part
+
+    Returns:
+        Dataframe with one row per record
+    """
+    if data[:4] == _PARQUET_MAGIC:
+        if not PARQUET_AVAILABLE:
+            raise ImportError("read_results, pyarrow is needed to read parquet results")
+        return pq.read_table(io.BytesIO(data)).to_pandas()
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    return pd.DataFrame([json.loads(line) for line in lines if line])
+
+
+class ResultSink:
+    """
+    Buffers records and writes them in parts with write(data, file_name), see the module
+    docstring. Records can be appended from several threads.
+    """
+
+    def __init__(self,
+                 write: Callable[[bytes, str], None],
+                 name_prefix: str = "part",
+                 max_rows: int = DEFAULT_MAX_ROWS,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 flush_interval_seconds: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 result_format: Optional[str] = None):
+        if result_format is None:
+            result_format = RESULT_FORMAT_PARQUET if PARQUET_AVAILABLE else RESULT_FORMAT_JSONL
+        if result_format == RESULT_FORMAT_PARQUET and not PARQUET_AVAILABLE:
+            raise ImportError("ResultSink, pyarrow is needed for the parquet format")
+        self._write = write
+        self._name_prefix = f"{name_prefix}-{uuid.uuid4().hex[:8]}"
+        self._max_rows = max_rows
+        self._max_bytes = max_bytes
+        self._flush_interval_seconds = flush_interval_seconds
+        self._result_format = result_format
+        self._rows: List[Dict] = []
+        self._bytes: int = 0
+        self._first_append_time: Optional[float] = None
+        self._parts: int = 0
+        self._lock = threading.Lock()
+        self.records_written: int = 0
+
+    def append(self, records: List[Dict]) -> None:
+        """
+        Add records, a part is written if the buffer is full or its oldest record
+        is older than flush_interval_seconds.
+        """
+        with self._lock:
+            if self._first_append_time is None and records:
+                self._first_append_time = time.perf_counter()
+            for record in records:
+                row = _flatten(record)
+                self._rows.append(row)
+                self._bytes += _size(row)
+                if len(self._rows) >= self._max_rows or self._bytes >= self._max_bytes:
+                    self._flush()
+            if self._first_append_time is not None and \
+               time.perf_counter() - self._first_append_time >= self._flush_interval_seconds:
+                self._flush()
+
+    def flush(self) -> Optional[str]:
+        """
+        Write the buffered records as a part.
+
+        Returns:
+            The file name of the part, None if there were no records
+        """
+        with self._lock:
+            return self._flush()
+
+    def close(self) -> None:
+        """Write the remaining records."""
+        self.flush()
+        logger.info(f"ResultSink, closed, {self.records_written} records in {self._parts} parts")
+
+    def _flush(self) -> Optional[str]:
+        rows, self._rows = self._rows, []
+        self._bytes = 0
+        self._first_append_time = None
+        if rows == []:
+            return None
+        data = _to_parquet(rows) if self._result_format == RESULT_FORMAT_PARQUET else _to_jsonl(rows)
+        file_name = f"{self._name_prefix}-{self._parts:05d}{RESULT_FILE_EXTENSIONS[self._result_format]}"
+        self._write(data, file_name)
+        self._parts += 1
+        self.records_written += len(rows)
+        logger.info(f"ResultSink, wrote {len(rows)} records ({len(data)} bytes) to {file_name}")
+        return file_name
@@ -0,0 +1,152 @@
+"""
+Background S3 uploads for FMBench
+
+Writing results with a new S3 client and a blocking PUT per file puts the S3 request rate on
+the hot path of the run. The uploader sends the files from a few threads that share one
+pooled client (see boto3_clients.py, adaptive retry mode): write calls only enqueue the file,
+the queue is bounded so that a caller waits (backpressure) instead of buffering an unbounded
+amount of data when S3 is slower than the run, and files larger than the multipart threshold
+are sent as multipart uploads. Uploads that still fail after the botocore retries are
+retried with an exponential backoff, flush waits for all the enqueued files and returns the
+keys of the files that could not be written.
+
+fmbench.utils has one uploader per process, see write_to_s3_async and flush_s3_writes.
+"""
+
+import io
+import time
+import queue
+import logging
+import threading
+from boto3.s3.transfer import TransferConfig
+from typing import Any, Callable, List, Optional, Tuple
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY: int = 16
+DEFAULT_MAX_QUEUE_SIZE: int = 1000
+DEFAULT_MAX_RETRIES: int = 5
+INITIAL_RETRY_DELAY: float = 0.5
+MAX_RETRY_DELAY: float = 8.0
+# files larger than this are sent as multipart uploads in parts of this size
+DEFAULT_MULTIPART_THRESHOLD: int = 16 * 1024 * 1024
+
+# stops a worker thread
+_STOP = None
+
+
+class S3Uploader:
+    """
+    Uploads files to S3 from max_concurrency threads, see the module docstring.
+
+    Args:
+        get_client: Called once to get the S3 client shared by the threads
+        max_concurrency: Number of upload threads
+        max_queue_size: Files that can wait for an upload thread before enqueue blocks
+        max_retries: Retries of a failed upload
+        multipart_threshold: Size in bytes from which files are sent as multipart uploads
+    """
+
+    def __init__(self,
+                 get_client: Callable[[], Any],
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD):
+        self._get_client = get_client
+        self._client: Optional[Any] = None
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._multipart_threshold = multipart_threshold
+        self._transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                               multipart_chunksize=multipart_threshold,
+                                               use_threads=False)
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._failed: List[str] = []
+        self.uploaded: int = 0
+
+    def _start(self) -> None:
+        # the threads and the client are created on the first upload
+        with self._lock:
+            if self._threads:
+                return
+            self._client = self._get_client()
+            for i in range(self._max_concurrency):
+                thread = threading.Thread(target=self._run, name=f"s3-uploader-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"S3Uploader, started {self._max_concurrency} upload threads")
+
+    def enqueue(self, data: Any, bucket: str, key: str) -> None:
+        """
+        Upload a file in the background, blocks while the queue is full.
+
+        Args:
+            data: Content of the file, str (written as UTF-8) or bytes
+            bucket: The S3 bucket
+            key: The S3 key
+        """
+        if not self._threads:
+            self._start()
+        self._queue.put((data, bucket, key))
+
+    def flush(self) -> List[str]:
+        """
+        Wait until all the enqueued files are uploaded.
+
+        Returns:
+            The keys of the files that could not be uploaded since the last flush
+        """
+        self._queue.join()
+        with self._lock:
+            failed, self._failed = self._failed, []
+        if failed:
+            logger.error(f"S3Uploader, {len(failed)} files could not be uploaded, first keys={failed[:5]}")
+        return failed
+
+    def close(self) -> List[str]:
+        """Upload the enqueued files and stop the upload threads."""
+        failed = self.flush()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join()
+        return failed
+
+    def _run(self) -> None:
+        while True:
+            item: Optional[Tuple] = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._upload(*item)
+            finally:
+                self._queue.task_done()
+
+    def _upload(self, data: Any, bucket: str, key: str) -> None:
+        body = data.encode("utf-8") if isinstance(data, str) else data
+        for attempt in range(self._max_retries + 1):
+            try:
+                if len(body) > self._multipart_threshold:
+                    self._client.upload_fileobj(io.BytesIO(body), bucket, key, Config=self._transfer_config)
+                else:
+                    self._client.put_object(Bucket=bucket, Key=key, Body=body)
+                with self._lock:
+                    self.uploaded += 1
+                return
+            except Exception as e:
+                if attempt == self._max_retries:
+                    logger.error(f"S3Uploader, s3://{bucket}/{key} failed after {attempt + 1} attempts, exception={e}")
+                    with self._lock:
+                        self._failed.append(key)
+                    return
+                wait_time = min(INITIAL_RETRY_DELAY * (2 ** attempt), MAX_RETRY_DELAY)
+                logger.warning(f"S3Uploader, s3://{bucket}/{key} failed, retrying in {wait_time:.2f} seconds, "
+                               f"exception={e}")
+                time.sleep(wait_time)
@@ -0,0 +1,148 @@
+"""
+Saturation search for FMBench
+
+Instead of running every level in `concurrency_levels`, the saturation search finds the
+highest concurrency level that stays within the latency and error rate budgets from the
+report section of the config file. The concurrency is doubled starting from
+min_concurrency until a level fails the budgets (or max_concurrency is reached), then a
+binary search between the last passing and the first failing level finds the highest
+passing level. Levels that are obviously past saturation are never run.
+
+A level passes with the same criteria as score_run in 5_model_metric_analysis.ipynb:
+the p95 latency (with the latency_latitude) and the error rate are within budget.
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# same defaults as score_run in 5_model_metric_analysis.ipynb
+DEFAULT_LATENCY_BUDGET: float = 10
+DEFAULT_ERROR_RATE_BUDGET: float = 0
+DEFAULT_LATENCY_LATITUDE: float = 0.01
+DEFAULT_MIN_CONCURRENCY: int = 1
+
+
+def get_saturation_search_config(config: Dict, experiment: Dict) -> Optional[Dict]:
+    """
+    Get the saturation search settings for an experiment. The top level
+    `saturation_search` section of the config file applies to all experiments and can
+    be overridden per experiment with a `saturation_search` section in the experiment.
+
+    Args:
+        config: The FMBench config
+        experiment: The experiment being run
+
+    Returns:
+        Dictionary with the saturation search settings or None if it is not enabled
+    """
+    section = (config.get("saturation_search") or {}) | (experiment.get("saturation_search") or {})
+    if section.get("enabled") is not True:
+        return None
+    report = config.get("report") or {}
+    settings = dict(min_concurrency=DEFAULT_MIN_CONCURRENCY,
+                    # the largest configured concurrency level is the upper bound of the search
+                    max_concurrency=max(experiment.get("concurrency_levels") or [DEFAULT_MIN_CONCURRENCY]),
+                    latency_budget=report.get("latency_budget", DEFAULT_LATENCY_BUDGET),
+                    error_rate_budget=report.get("error_rate_budget", DEFAULT_ERROR_RATE_BUDGET),
+                    latency_latitude=report.get("latency_latitude", DEFAULT_LATENCY_LATITUDE))
+    settings.update({k: v for k, v in section.items() if k in settings})
+    if settings["min_concurrency"] < 1 or settings["max_concurrency"] < settings["min_concurrency"]:
+        raise ValueError(f"saturation_search needs 1 <= min_concurrency <= max_concurrency, "
+                         f"got min_concurrency={settings['min_concurrency']}, "
+                         f"max_concurrency={settings['max_concurrency']}")
+    logger.info(f"get_saturation_search_config, experiment={experiment.get('name')}, settings={settings}")
+    return settings
+
+
+class SaturationSearch:
+    """
+    Finds the highest concurrency level within the latency and error rate budgets.
+    Call next_concurrency() to get the level to run next and record() with the
+    results of that level, until next_concurrency() returns None.
+    """
+
+    def __init__(self,
+                 min_concurrency: int,
+                 max_concurrency: int,
+                 latency_budget: float,
+                 error_rate_budget: float,
+                 latency_latitude: float = DEFAULT_LATENCY_LATITUDE):
+        self._min_concurrency = min_concurrency
+        self._max_concurrency = max_concurrency
+        self._latency_budget = latency_budget
+        self._error_rate_budget = error_rate_budget
+        self._latency_latitude = latency_latitude
+        # highest passing and lowest failing concurrency levels so far
+        self._highest_pass: Optional[int] = None
+        self._lowest_fail: Optional[int] = None
+        self._probing: bool = True
+        self._last: Optional[int] = None
+        self._results: List[Dict] = []
+
+    def passes(self, latency_p95: Optional[float], error_rate: Optional[float]) -> bool:
+        """
+        Check if the results of a concurrency level are within the budgets,
+        a level without any successful request fails.
+        """
+        if latency_p95 is None or error_rate is None:
+            return False
+        return error_rate <= self._error_rate_budget \
+            and latency_p95 <= (1 + self._latency_latitude) * self._latency_budget
+
+    def next_concurrency(self) -> Optional[int]:
+        """
+        Get the next concurrency level to run, None when the search is done.
+        """
+        if self._last is None:
+            return self._min_concurrency
+        if self._probing:
+            if self._lowest_fail is None:
+                # exponential probe until a level fails or the maximum passes
+                if self._last >= self._max_concurrency:
+                    return None
+                return min(self._last * 2, self._max_concurrency)
+            self._probing = False
+        if self._highest_pass is None or self._lowest_fail - self._highest_pass <= 1:
+            return None
+        return (self._highest_pass + self._lowest_fail) // 2
+
+    def record(self, concurrency: int, latency_p95: Optional[float], error_rate: Optional[float]) -> bool:
+        """
+        Record the results of a concurrency level.
+
+        Args:
+            concurrency: The concurrency level that was run
+            latency_p95: p95 latency of the level in seconds
+            error_rate: Error rate of the level
+
+        Returns:
+            True if the level is within the budgets
+        """
+        passed = self.passes(latency_p95, error_rate)
+        self._last = concurrency
+        if passed:
+            self._highest_pass = max(concurrency, self._highest_pass or concurrency)
+        else:
+            self._lowest_fail = min(concurrency, self._lowest_fail or concurrency)
+        self._results.append(dict(concurrency=concurrency,
+                                  latency_p95=latency_p95,
+                                  error_rate=error_rate,
+                                  passed=passed))
+        logger.info(f"SaturationSearch, concurrency={concurrency}, latency_p95={latency_p95}, "
+                    f"error_rate={error_rate}, passed={passed}, highest_pass={self._highest_pass}, "
+                    f"lowest_fail={self._lowest_fail}")
+        return passed
+
+    @property
+    def best_concurrency(self) -> Optional[int]:
+        """The highest concurrency level within the budgets, None if no level passed."""
+        return self._highest_pass
+
+    @property
+    def results(self) -> List[Dict]:
+        """The results of every concurrency level in the order they were run."""
+        return list(self._results)
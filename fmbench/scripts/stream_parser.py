@@ -0,0 +1,196 @@
+"""
+Incremental stream parsers for FMBench
+
+The streaming responses arrive as byte chunks that do not line up with the messages in
+them: a SageMaker PayloadPart can end in the middle of a JSON line and an OpenAI compatible
+server can split a server-sent event (SSE) across network reads. The parsers here buffer
+the bytes in a bytearray that is compacted as lines are consumed, find the line ends with
+bytearray.find and decode the lines of a large read straight from a memoryview of the
+buffer, so that a long completion is neither copied nor rescanned for every token.
+
+- LineBuffer: newline delimited lines (SageMaker PayloadPart events, JSON lines over HTTP)
+- SSEDecoder: the data payloads of server-sent events (OpenAI compatible streaming)
+- iter_lines: lines from a SageMaker or Bedrock event stream or an iterable of byte chunks
+"""
+
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# consumed bytes are dropped from the front of the buffer once there are this many of them
+DEFAULT_COMPACT_THRESHOLD: int = 64 * 1024
+# data payload that ends an OpenAI compatible stream
+SSE_DONE: str = "[DONE]"
+
+# lines are decoded from a memoryview of the buffer when it holds more than this many bytes
+_MEMORYVIEW_MIN_BYTES: int = 1024
+_NEWLINE: bytes = b"\n"
+_CR: int = ord("\r")
+
+
+class LineBuffer:
+    """
+    Splits a stream of byte chunks into lines. The bytes are appended to a bytearray with a
+    read position, consumed bytes are dropped from the front of the buffer (compaction) when
+    they are more than half of the buffer or more than compact_threshold bytes, so the buffer
+    only holds the unconsumed tail of the stream. Lines end with \\n or \\r\\n and are returned
+    without the line end.
+    """
+
+    def __init__(self, compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        self._buffer = bytearray()
+        self._pos = 0
+        self._compact_threshold = compact_threshold
+
+    def __len__(self) -> int:
+        """Number of buffered bytes that were not returned as a line yet."""
+        return len(self._buffer) - self._pos
+
+    def feed(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        """Append a chunk of the stream."""
+        self._buffer += data
+
+    def pop_lines(self) -> List[str]:
+        """
+        Get the complete lines in the buffer, a partial line at the end stays in the
+        buffer until the rest of it is fed.
+
+        Returns:
+            List of lines decoded as UTF-8
+        """
+        buffer = self._buffer
+        lines: List[str] = []
+        pos = self._pos
+        end = buffer.find(_NEWLINE, pos)
+        if end == -1:
+            return lines
+        if len(buffer) - pos > _MEMORYVIEW_MIN_BYTES:
+            # the memoryview is released before the buffer is compacted, a bytearray
+            # cannot be resized while it is exported
+            with memoryview(buffer) as view:
+                while end != -1:
+                    line_end = end - 1 if end > pos and buffer[end - 1] == _CR else end
+                    lines.append(str(view[pos:line_end], "utf-8"))
+                    pos = end + 1
+                    end = buffer.find(_NEWLINE, pos)
+        else:
+            # for a few short lines (usually one line per event) creating the memoryview
+            # costs more than copying the line
+            while end != -1:
+                line_end = end - 1 if end > pos and buffer[end - 1] == _CR else end
+                lines.append(buffer[pos:line_end].decode("utf-8"))
+                pos = end + 1
+                end = buffer.find(_NEWLINE, pos)
+        if pos == len(buffer):
+            buffer.clear()
+            pos = 0
+        elif pos > self._compact_threshold or pos * 2 > len(buffer):
+            del buffer[:pos]
+            pos = 0
+        self._pos = pos
+        return lines
+
+    def flush(self) -> Optional[str]:
+        """
+        Get the partial line at the end of the stream and empty the buffer.
+
+        Returns:
+            The remaining bytes decoded as UTF-8, None if the buffer is empty
+        """
+        if len(self) == 0:
+            return None
+        with memoryview(self._buffer) as view:
+            line = str(view[self._pos:], "utf-8")
+        self._buffer.clear()
+        self._pos = 0
+        return line
+
+
+class SSEDecoder:
+    """
+    Decodes server-sent events into their data payloads. The data lines of an event are
+    joined with \\n, comments and the event, id and retry fields are ignored. The [DONE]
+    payload of OpenAI compatible streams sets done and is not returned.
+    """
+
+    def __init__(self, compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        self._lines = LineBuffer(compact_threshold)
+        self._data: List[str] = []
+        self.done: bool = False
+
+    def feed(self, data: Union[bytes, bytearray, memoryview]) -> List[str]:
+        """
+        Append a chunk of the stream.
+
+        Returns:
+            The data payloads of the events completed by this chunk
+        """
+        self._lines.feed(data)
+        return self._decode(self._lines.pop_lines())
+
+    def flush(self) -> List[str]:
+        """
+        Get the data payload of an event that was not terminated by a blank line
+        at the end of the stream.
+        """
+        line = self._lines.flush()
+        # a blank line dispatches the pending event
+        return self._decode(([line] if line is not None else []) + [""])
+
+    def _decode(self, lines: List[str]) -> List[str]:
+        payloads: List[str] = []
+        for line in lines:
+            if line == "":
+                if self._data:
+                    payload = "\n".join(self._data)
+                    self._data.clear()
+                    if payload == SSE_DONE:
+                        self.done = True
+                    else:
+                        payloads.append(payload)
+            elif line.startswith("data:"):
+                # a single space after the colon is not part of the value
+                self._data.append(line[6:] if line.startswith("data: ") else line[5:])
+        return payloads
+
+
+def iter_lines(events: Iterable[Union[bytes, Dict]]) -> Iterator[str]:
+    """
+    Iterate over the lines of a response stream.
+
+    Args:
+        events: Either byte chunks (for example httpx iter_bytes), a SageMaker response
+                stream (PayloadPart events) or a Bedrock invoke_model_with_response_stream
+                body (chunk events, each of which is a complete JSON document)
+
+    Returns:
+        Iterator of the lines decoded as UTF-8, without the line ends
+    """
+    buffer = LineBuffer()
+    for event in events:
+        if isinstance(event, dict) and "PayloadPart" in event:
+            data = event["PayloadPart"]["Bytes"]
+        elif isinstance(event, (bytes, bytearray, memoryview)):
+            data = event
+        elif "chunk" in event:
+            data = event["chunk"]["bytes"]
+            buffer.feed(data)
+            yield from buffer.pop_lines()
+            # a chunk event is a complete message even without a line end
+            line = buffer.flush()
+            if line is not None:
+                yield line
+            continue
+        else:
+            logger.warning(f"iter_lines, unknown event type: {event}")
+            continue
+        buffer.feed(data)
+        lines = buffer.pop_lines()
+        if lines:
+            yield from lines
+    line = buffer.flush()
+    if line is not None:
+        yield line
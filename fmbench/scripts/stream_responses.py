@@ -1,4 +1,3 @@
-import io
 import time
 import json
 import boto3
@@ -6,6 +5,8 @@ import litellm
 import logging
 import botocore
 from typing import Dict, Optional, List, Union
+from fmbench.scripts.stream_parser import iter_lines
+from fmbench.scripts.token_timings import new_token_times
 
 # Set up logger
 logging.basicConfig(level=logging.INFO)
@@ -15,152 +16,193 @@ logger = logging.getLogger(__name__)
 sagemaker_runtime = boto3.client('sagemaker-runtime')
 
 
-class LineIterator:
-
+class _ResponseStreamParser:
     """
-    A helper class for parsing the byte stream input.
-
-    The output of the model will be in the following format:
-    ```
-    b'{"outputs": [" a"]}\n'
-    b'{"outputs": [" challenging"]}\n'
-    b'{"outputs": [" problem"]}\n'
-    ...
-    ```
-
-    While usually each PayloadPart event from the event stream will contain a byte array 
-    with a full json, this is not guaranteed and some of the json objects may be split across
-    PayloadPart events. For example:
-    ```
-    {'PayloadPart': {'Bytes': b'{"outputs": '}}
-    {'PayloadPart': {'Bytes': b'[" problem"]}\n'}}
-    ```
-
-    This class accounts for this by concatenating bytes written via the 'write' function
-    and then exposing a method which will return lines (ending with a '\n' character) within
-    the buffer via the 'scan_lines' function. It maintains the position of the last read 
-    position to ensure that previous bytes are not exposed again. 
+    Parses the events of a response stream one at a time and computes the Time To First Token (TTFT),
+    Time Per Output Token (TPOT) and Time To Last Token (TTLT). This is shared by the synchronous
+    and the asynchronous response stream helpers so that both compute the metrics the same way.
+    The tokens are collected in a list and joined once at the end, and only the tail of the
+    response is searched for the stop token, so the work per token does not grow with the
+    length of the response. With record_token_times the time each token was received is kept
+    in an array of seconds from the start of the request.
     """
 
-    def __init__(self, stream):
-        self.byte_iterator = iter(stream)
-        self.buffer = io.BytesIO()
-        self.read_pos = 0
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        while True:
-            self.buffer.seek(self.read_pos)
-            line = self.buffer.readline()
-            if line and line[-1] == ord('\n'):
-                self.read_pos += len(line)
-                return line[:-1]
-            try:
-                chunk = next(self.byte_iterator)
-            except StopIteration:
-                if self.read_pos < self.buffer.getbuffer().nbytes:
-                    continue
-                raise
-            if 'PayloadPart' not in chunk:
-                logger.warning('Unknown event type:' + str(chunk))
-                continue
-            self.buffer.seek(0, io.SEEK_END)
-            self.buffer.write(chunk['PayloadPart']['Bytes'])
+    SM_START_TOKEN: str = "{"
+
+    def __init__(self, start_time: float, start_token: str, stop_token: str, is_sagemaker: bool,
+                 record_token_times: bool = False):
+        self.start_time = start_time
+        self.start_token = start_token
+        self.stop_token = stop_token
+        self.is_sagemaker = is_sagemaker
+        self.first_token_time: Optional[float] = None
+        self.num_tokens: int = 0
+        self.token_times = new_token_times() if record_token_times else None
+        self.last_token_time = start_time
+        self.response_parts: List[str] = []
+        # the last len(stop_token) - 1 characters of the response, a stop token split across
+        # tokens is found in this tail followed by the new token
+        self._tail: str = ""
+        self.TTFT: Optional[float] = None
+        # token counts from the usage chunk at the end of the stream, if the provider sends one
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+    def process(self, event) -> bool:
+        """
+        Process a single event from the response stream.
+
+        return: True if the end of the stream has been reached, False otherwise
+        """
+        # record the time the event was received, before it is parsed
+        current_time = time.perf_counter()
+        # if the response stream is from a sagemaker call, then the events are
+        # the lines of the streaming response from iter_lines
+        token_id: Optional[int] = None
+        if self.is_sagemaker:
+            if event != '' and self.SM_START_TOKEN in event:
+                data = json.loads(event[event.find(self.SM_START_TOKEN):])
+                #logger.info(f"data={data}")
+                token_id = data['token']['id']
+                if token_id != [-1]:
+                    token_text = data['token']['text']
+                else:
+                    token_text = None
+            else:
+                return False
+        else:
+            # the last chunk has the token usage when the request sets stream_options.include_usage,
+            # it has no choices
+            usage = getattr(event, 'usage', None)
+            if usage is not None:
+                self.prompt_tokens = getattr(usage, 'prompt_tokens', None)
+                self.completion_tokens = getattr(usage, 'completion_tokens', None)
+            # if the response stream is from a bedrock call, then get the chunks from the response
+            # and the first token
+            if getattr(event, 'choices', None) and hasattr(event.choices[0], 'delta'):
+                token_text = event.choices[0].delta.get('content', '')
+            else:
+                return False
+        stop_found: bool = False
+        if token_text and token_text != self.stop_token:
+            if self.first_token_time is None:
+                self.first_token_time = current_time
+                # get the time to first token latency
+                self.TTFT = self.first_token_time - self.start_time
+                logger.info(f"Time to First Token: {self.TTFT:.6f} seconds")
+            self.num_tokens += 1
+            if self.token_times is not None:
+                self.token_times.append(current_time - self.start_time)
+            self.last_token_time = current_time
+            self.response_parts.append(token_text)
+            if self.stop_token:
+                tail = self._tail + token_text
+                stop_found = self.stop_token in tail
+                self._tail = tail[-(len(self.stop_token) - 1):] if len(self.stop_token) > 1 else ""
+
+        if stop_found:
+            logger.info(f"got the last token: {self.stop_token}")
+            return True
+        elif token_id == [-1]:
+            logger.info(f"end of stream because token id is {token_id}")
+            return True
+        return False
+
+    @property
+    def response_text(self) -> str:
+        """The response received so far."""
+        return "".join(self.response_parts)
+
+    def result(self) -> Dict:
+        """
+        Compute the TTLT and TPOT at the reception of the last token.
+
+        return: dictionary containing the entire response, the TTFT, TTLT, TPOT metrics, the
+                token counts reported by the provider (None if they were not reported) and the
+                token_times (None if they were not recorded)
+        """
+        # Calculate TTLT at the reception of the last token
+        current_time = time.perf_counter()
+        TTLT = current_time - self.start_time
+        logger.info(f"Time to Last Token (TTLT): {TTLT:.6f} seconds, total tokens received {self.num_tokens}")
+
+        TPOT: Optional[float] = None
+        if self.num_tokens > 1:
+            # the average of the inter-token latencies after the first token
+            TPOT = (self.last_token_time - self.first_token_time) / (self.num_tokens - 1)
+            logger.info(f"Time Per Output Token (TPOT): {TPOT:.6f} seconds")
+
+        response_data = [{"generated_text": self.response_text}]
+        response_json_str = json.dumps(response_data)
+        return {
+            "TTFT": self.TTFT,
+            "TPOT": TPOT,
+            "TTLT": TTLT,
+            "response": response_json_str,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "token_times": self.token_times
+        }
 
 
 def get_response_stream(response_stream: Union[litellm.utils.CustomStreamWrapper, botocore.eventstream.EventStream],
                         start_time: float,
                         start_token: str,
                         stop_token: str,
-                        is_sagemaker: bool = False) -> Dict:
+                        is_sagemaker: bool = False,
+                        record_token_times: bool = False) -> Dict:
     """
     Helper function to get the response streams from bedrock or sagemaker invocations
     and parse each as appropriate to calculate the Time To First Token (TTFT), Time Per Output Token (TPOT), 
     and Time To Last Token (TTLT)
 
-    return: This function returns a dictionary containing the entire response, and the TTFT, TTLT, TPOT metrics
+    return: This function returns a dictionary containing the entire response, the TTFT, TTLT, TPOT metrics
+            the token counts reported by the provider and the token_times if record_token_times is set
     """
     logger.info(f"get_response_stream, type(response_stream)={type(response_stream)}")
-    sm_start_token = b"{"
-    first_token_time: Optional[float] = None
-    token_times: List[float] = []
-    last_token_time = start_time
-    response_text: str = ""
-    TTFT: Optional[float] = None
-    TPOT: Optional[float] = None
-    TTLT: Optional[float] = None
     result: Optional[Dict] = None
+    parser = _ResponseStreamParser(start_time, start_token, stop_token, is_sagemaker, record_token_times)
 
     try:
         # get the event from the sagemaker or bedrock response streams
-        event_iterator = LineIterator(response_stream) if is_sagemaker else response_stream
+        event_iterator = iter_lines(response_stream) if is_sagemaker else response_stream
 
         for event in event_iterator:
-            # if the response stream is from a sagemaker call, then use the 
-            # line iterator to get the first token from the streaming response
-            token_id: Optional[int] = None
-            if is_sagemaker:
-                if event != b'' and sm_start_token in event:
-                    data = json.loads(event[event.find(sm_start_token):].decode('utf-8'))
-                    #logger.info(f"data={data}")
-                    token_id = data['token']['id']
-                    if token_id != [-1]:
-                        token_text = data['token']['text']
-                    else:
-                        token_text = None
-                else:
-                    continue
-            else:
-                # if the response stream is from a bedrock call, then get the chunks from the response
-                # and the first token
-                if hasattr(event, 'choices') and hasattr(event.choices[0], 'delta'):
-                    token_text = event.choices[0].delta.get('content', '')
-                else:
-                    continue
-            # record the current time
-            current_time = time.perf_counter()
-            if token_text and token_text != stop_token:
-                if first_token_time is None:
-                    first_token_time = current_time
-                    # get the time to first token latency
-                    TTFT = first_token_time - start_time
-                    logger.info(f"Time to First Token: {TTFT:.6f} seconds")
-                else:
-                    # if the token is not the first token, then get the inter-token
-                    # latency
-                    token_time = current_time - last_token_time
-                    # append all token times to get the time per output token
-                    token_times.append(token_time)
-                last_token_time = current_time
-                response_text += token_text
-
-            if stop_token and stop_token in response_text:
-                logger.info(f"got the last token: {stop_token}")
-                break
-            elif token_id == [-1]:
-                logger.info(f"end of stream because token id is {token_id}")
+            if parser.process(event):
                 break
+        result = parser.result()
+    except Exception as e:
+        logger.error(f"Error occurred while generating and computing metrics "
+                     f"associated with the streaming response: {e}", exc_info=True)
+        result = None
 
-        # Calculate TTLT at the reception of the last token
-        current_time = time.perf_counter()
-        TTLT = current_time - start_time
-        logger.info(f"Time to Last Token (TTLT): {TTLT:.6f} seconds, total tokens received {len(token_times)}")
+    logger.info(f"Final result: {result}")
+    return result
 
-        if token_times:
-            # get the average of all token times to compute the time per output token
-            TPOT = sum(token_times) / len(token_times)
-            logger.info(f"Time Per Output Token (TPOT): {TPOT:.6f} seconds")
 
-        response_data = [{"generated_text": response_text}]
-        response_json_str = json.dumps(response_data)
-        result = {
-            "TTFT": TTFT,
-            "TPOT": TPOT,
-            "TTLT": TTLT,
-            "response": response_json_str
-        }
+async def aget_response_stream(response_stream: litellm.utils.CustomStreamWrapper,
+                               start_time: float,
+                               start_token: str,
+                               stop_token: str,
+                               record_token_times: bool = False) -> Dict:
+    """
+    Asynchronous version of get_response_stream for response streams returned by
+    litellm.acompletion, the events are consumed with `async for` so that the event
+    loop is free to serve other requests while waiting for tokens.
+
+    return: This function returns a dictionary containing the entire response, the TTFT, TTLT, TPOT metrics
+            the token counts reported by the provider and the token_times if record_token_times is set
+    """
+    logger.info(f"aget_response_stream, type(response_stream)={type(response_stream)}")
+    result: Optional[Dict] = None
+    parser = _ResponseStreamParser(start_time, start_token, stop_token, is_sagemaker=False,
+                                   record_token_times=record_token_times)
+
+    try:
+        async for event in response_stream:
+            if parser.process(event):
+                break
+        result = parser.result()
     except Exception as e:
         logger.error(f"Error occurred while generating and computing metrics "
                      f"associated with the streaming response: {e}", exc_info=True)
@@ -168,4 +210,3 @@ def get_response_stream(response_stream: Union[litellm.utils.CustomStreamWrapper
 
     logger.info(f"Final result: {result}")
     return result
-
@@ -0,0 +1,58 @@
+"""
+Deferred token counting for FMBench
+
+The streaming predictors take the prompt and completion token counts from the usage the
+provider reports at the end of the stream (stream_options.include_usage, the Bedrock
+metadata event). Tokenizing in the predictor would add the tokenizer time to the requests
+and compete with the timing threads for the CPU, so when a provider does not report the
+usage the predictor leaves the counts empty and sets token_count_model on the response.
+The missing counts are filled in after the measurement window of each concurrency level,
+in one batch for all of its per inference records.
+"""
+
+import asyncio
+import logging
+from typing import Dict, List
+from litellm import token_counter
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def count_missing_tokens(responses: List[Dict]) -> int:
+    """
+    Count the tokens of the per inference records that do not have the counts from
+    the provider, with the tokenizer of their token_count_model. The records are
+    updated in place, counts that are already set are not changed.
+
+    Args:
+        responses: Per inference records of a concurrency level
+
+    Returns:
+        Number of records that were counted
+    """
+    counted: int = 0
+    for r in responses:
+        model = r.get("token_count_model")
+        # failed requests have no completion and keep empty counts
+        if model is None or r.get("completion") is None:
+            continue
+        if r.get("prompt_tokens") is None:
+            r["prompt_tokens"] = token_counter(model=model,
+                                               messages=[{"role": "user", "content": r.get("prompt") or ""}])
+        if r.get("completion_tokens") is None:
+            r["completion_tokens"] = token_counter(model=model, text=r["completion"])
+        counted += 1
+    if counted > 0:
+        logger.info(f"count_missing_tokens, counted the tokens of {counted} of {len(responses)} responses "
+                    f"that had no usage from the provider")
+    return counted
+
+
+async def acount_missing_tokens(responses: List[Dict]) -> int:
+    """
+    Asynchronous version of count_missing_tokens, the tokenizer runs in a separate
+    thread so that it does not block the event loop.
+    """
+    return await asyncio.to_thread(count_missing_tokens, responses)
@@ -0,0 +1,106 @@
+"""
+Per token timings for FMBench
+
+The per inference records only have the mean time per output token (TPOT). With
+`token_timings: yes` in the inference_spec of an experiment the streaming predictors also
+record when each streamed chunk (usually one token) of a response was received, as seconds
+from the start of the request in an array('f') of 4 bytes per token. The arrays are taken
+out of the per inference records before they are written, so the records stay small, and
+are written per chunk of requests as a columnar side file in the token_timings directory
+next to the per inference records:
+
+    uuid, experiment_name, payload_file, concurrency: one value per request
+    offsets: start of the timings of each request in token_times, one more than the requests
+    token_times: the timings of all the requests one after the other (float32 seconds)
+
+so that decode stalls, the latency per token position and the jitter can be compared
+across concurrency levels with numpy, see read_token_timings and split_token_times.
+"""
+
+import io
+import logging
+import numpy as np
+from array import array
+from typing import Dict, List, Optional
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# key of the timings in the prediction response and the per inference record
+TOKEN_TIMES_KEY: str = "token_times"
+# typecode of the timings, 4 byte floats
+TOKEN_TIMES_TYPECODE: str = "f"
+TOKEN_TIMINGS_FILE_EXTENSION: str = ".npz"
+# per request columns of the side file, taken from the per inference records
+_REQUEST_COLUMNS: List[str] = ["uuid", "experiment_name", "payload_file", "concurrency"]
+
+
+def new_token_times() -> array:
+    """Create an empty timings array."""
+    return array(TOKEN_TIMES_TYPECODE)
+
+
+def pop_token_times(responses: List[Dict]) -> List[Dict]:
+    """
+    Take the token timings out of the per inference records.
+
+    Args:
+        responses: Per inference records, updated in place
+
+    Returns:
+        List with the uuid, experiment_name, payload_file and concurrency and the
+        token_times of each record that has timings
+    """
+    rows: List[Dict] = []
+    for r in responses:
+        token_times = r.pop(TOKEN_TIMES_KEY, None)
+        if token_times is None:
+            continue
+        row = {c: r.get(c) for c in _REQUEST_COLUMNS}
+        row[TOKEN_TIMES_KEY] = token_times
+        rows.append(row)
+    return rows
+
+
+def write_token_timings(rows: List[Dict]) -> Optional[bytes]:
+    """
+    Write the token timings from pop_token_times as a columnar side file.
+
+    Returns:
+        The content of the .npz file, None if there are no timings
+    """
+    if rows == []:
+        return None
+    lengths = np.array([len(row[TOKEN_TIMES_KEY]) for row in rows], dtype=np.int64)
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    token_times = np.empty(offsets[-1], dtype=np.float32)
+    for row, start, end in zip(rows, offsets[:-1], offsets[1:]):
+        # an array('f') is read without a copy, the records of the distributed runner have a list
+        token_times[start:end] = np.asarray(row[TOKEN_TIMES_KEY], dtype=np.float32)
+    columns = {c: np.array([str(row[c]) for row in rows]) for c in ["uuid", "experiment_name", "payload_file"]}
+    columns["concurrency"] = np.array([row["concurrency"] or 0 for row in rows], dtype=np.int32)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, offsets=offsets, token_times=token_times, **columns)
+    logger.info(f"write_token_timings, {len(rows)} requests, {len(token_times)} token timings")
+    return buffer.getvalue()
+
+
+def read_token_timings(data: bytes) -> Dict[str, np.ndarray]:
+    """
+    Read a token timings side file.
+
+    Returns:
+        Dictionary of the columns of the file
+    """
+    with np.load(io.BytesIO(data)) as f:
+        return {k: f[k] for k in f.files}
+
+
+def split_token_times(timings: Dict[str, np.ndarray]) -> List[np.ndarray]:
+    """
+    Get the timings of each request of a token timings side file, np.diff of the timings
+    of a request are its inter-token latencies.
+    """
+    return np.split(timings[TOKEN_TIMES_KEY], timings["offsets"][1:-1])
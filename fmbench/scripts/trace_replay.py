@@ -0,0 +1,137 @@
+"""
+Trace replay for FMBench
+
+Replays the arrival pattern of production traffic from a JSONL request trace. Each line
+of the trace has a timestamp and either the prompt itself or its length in tokens, and
+optionally the max_tokens of the request:
+
+    {"timestamp": 1718000000.25, "prompt_tokens": 812, "max_tokens": 256}
+    {"timestamp": "2024-06-10T06:13:20.900+00:00", "prompt": "What is ...?"}
+
+The timestamps are either epoch seconds or ISO 8601 strings. Requests that only have a
+prompt length are matched to the payload files created by 1_generate_data.ipynb: the
+payload file of the dataset filter whose [min_length_in_tokens, max_length_in_tokens)
+range contains the prompt length is used and its payloads are cycled through. The arrival
+time of each request is stored in its payload as arrival_offset, in seconds from the first
+request of the trace divided by the time compression factor.
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Iterable, Tuple, Union
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# payload key with the arrival time of a replayed request, see run_replay
+ARRIVAL_OFFSET_KEY: str = "arrival_offset"
+
+
+def _to_epoch(timestamp: Union[int, float, str]) -> float:
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp).timestamp()
+    return float(timestamp)
+
+
+def parse_trace(lines: Iterable[str]) -> List[Dict]:
+    """
+    Parse the lines of a JSONL request trace.
+
+    Args:
+        lines: Lines of the trace file, blank lines are skipped
+
+    Returns:
+        List of trace entries sorted by arrival time, each with an offset in seconds from the first entry
+    """
+    entries: List[Dict] = []
+    for i, line in enumerate(lines):
+        if line.strip() == "":
+            continue
+        entry = json.loads(line)
+        if "timestamp" not in entry:
+            raise ValueError(f"parse_trace, line {i + 1} of the trace does not have a timestamp")
+        if entry.get("prompt") is None and entry.get("prompt_tokens") is None:
+            raise ValueError(f"parse_trace, line {i + 1} of the trace needs either a prompt or prompt_tokens")
+        entry["timestamp"] = _to_epoch(entry["timestamp"])
+        entries.append(entry)
+    entries.sort(key=lambda e: e["timestamp"])
+    for entry in entries:
+        entry["offset"] = entry["timestamp"] - entries[0]["timestamp"]
+    return entries
+
+
+def get_payload_file_buckets(filters: List[Dict], payload_files: List[str]) -> List[Tuple[int, int, str]]:
+    """
+    Get the prompt length range of each payload file from the dataset filters
+    in the config file, restricted to the payload files of the experiment.
+
+    Args:
+        filters: The datasets.filters section of the config file
+        payload_files: Payload files of the experiment
+
+    Returns:
+        List of (min_length_in_tokens, max_length_in_tokens, payload_file) sorted by min length
+    """
+    buckets = []
+    for f in filters:
+        payload_file = f["payload_file"].format(lang=f.get("language"),
+                                                min=f["min_length_in_tokens"],
+                                                max=f["max_length_in_tokens"])
+        if payload_file in payload_files:
+            buckets.append((f["min_length_in_tokens"], f["max_length_in_tokens"], payload_file))
+    if buckets == []:
+        raise ValueError(f"get_payload_file_buckets, none of the payload_files={payload_files} "
+                         f"match the dataset filters")
+    return sorted(buckets)
+
+
+def _match_bucket(prompt_tokens: int, buckets: List[Tuple[int, int, str]]) -> str:
+    for min_len, max_len, payload_file in buckets:
+        if min_len <= prompt_tokens < max_len:
+            return payload_file
+    # prompts outside all the ranges use the closest one
+    return buckets[0][2] if prompt_tokens < buckets[0][0] else buckets[-1][2]
+
+
+def create_replay_requests(trace: List[Dict],
+                           payloads_by_file: Dict[str, List[Dict]],
+                           buckets: List[Tuple[int, int, str]],
+                           time_compression: float = 1.0) -> List[Dict]:
+    """
+    Create the payloads to replay a trace.
+
+    Args:
+        trace: Trace entries from parse_trace
+        payloads_by_file: Payloads of each payload file of the experiment
+        buckets: Prompt length range of each payload file from get_payload_file_buckets
+        time_compression: Speed up factor, 2 replays the trace in half the time
+
+    Returns:
+        List of payloads in arrival order, each with an arrival_offset
+    """
+    next_index: Dict[str, int] = {payload_file: 0 for payload_file in payloads_by_file}
+    unmatched: int = 0
+    requests: List[Dict] = []
+    for entry in trace:
+        if entry.get("prompt") is not None:
+            payload = dict(inputs=entry["prompt"])
+        else:
+            payload_file = _match_bucket(entry["prompt_tokens"], buckets)
+            if not buckets[0][0] <= entry["prompt_tokens"] < buckets[-1][1]:
+                unmatched += 1
+            payloads = payloads_by_file[payload_file]
+            payload = dict(payloads[next_index[payload_file] % len(payloads)])
+            next_index[payload_file] += 1
+        if entry.get("max_tokens") is not None:
+            payload["max_tokens"] = entry["max_tokens"]
+        payload[ARRIVAL_OFFSET_KEY] = entry["offset"] / time_compression
+        requests.append(payload)
+    if unmatched > 0:
+        logger.warning(f"create_replay_requests, {unmatched} of {len(trace)} trace entries have a prompt "
+                       f"length outside of the payload file ranges, used the closest payload file")
+    logger.info(f"create_replay_requests, {len(requests)} requests over "
+                f"{requests[-1][ARRIVAL_OFFSET_KEY] if requests else 0:.2f} seconds, "
+                f"time_compression={time_compression}")
+    return requests
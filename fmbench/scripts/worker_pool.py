@@ -0,0 +1,186 @@
+"""
+Managed worker pool for running blocking inference calls from asyncio
+
+A single InferenceWorkerPool is created for the whole inference run, sized to the
+maximum concurrency level across all experiments, and reused for every chunk and
+payload file instead of creating a new ThreadPoolExecutor for every chunk. The pool
+keeps track of how many calls are waiting for a free thread (queue depth) and how
+long it takes for a call to start running on a thread (dispatch delay), including
+the overhead of lazily starting new threads.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Set, Callable, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+THREAD_NAME_PREFIX: str = "fmbench-inference"
+
+
+def get_max_concurrency(config: Dict) -> int:
+    """
+    Get the maximum concurrency level across all the experiments in the config,
+    including the upper bound of the saturation search if it is configured.
+    """
+    levels = [1]
+    for e in config["experiments"]:
+        levels.extend(e.get("concurrency_levels") or [])
+        for section in (config.get("saturation_search"), e.get("saturation_search")):
+            if section and section.get("max_concurrency"):
+                levels.append(section["max_concurrency"])
+    return max(levels)
+
+
+class InferenceWorkerPool:
+    """
+    Thread pool shared by all chunks of an inference run, with metrics on the
+    pool queue depth and the time it takes for submitted calls to start.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = THREAD_NAME_PREFIX):
+        self._max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._is_shutdown = False
+        # threads that have run at least one call, a call that runs on a thread
+        # not seen before paid the thread start overhead
+        self._known_threads: Set[int] = set()
+        self._reset_stats()
+        logger.info(f"InferenceWorkerPool, created pool with max_workers={max_workers}")
+
+    def _reset_stats(self) -> None:
+        self._queue_depth: int = 0
+        self._queue_depth_max: int = 0
+        self._calls: int = 0
+        self._dispatch_delays: List[float] = []
+        self._thread_start_delays: List[float] = []
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """The underlying executor."""
+        return self._executor
+
+    @property
+    def max_workers(self) -> int:
+        """The maximum number of threads in the pool."""
+        return self._max_workers
+
+    def _wrap(self, fn: Callable, args: tuple, submit_time: float, state: Dict) -> Callable:
+        def _run():
+            start_time = time.perf_counter()
+            thread_id = threading.get_ident()
+            with self._lock:
+                state["started"] = True
+                # a call cancelled while waiting was already removed from the queue depth
+                if state["cancelled"] is False:
+                    self._queue_depth -= 1
+                self._dispatch_delays.append(start_time - submit_time)
+                if thread_id not in self._known_threads:
+                    self._known_threads.add(thread_id)
+                    self._thread_start_delays.append(start_time - submit_time)
+            return fn(*args)
+        return _run
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """
+        Run a blocking function on the pool and wait for its result. If the caller is
+        cancelled the call is abandoned, a call that is already running on a thread
+        runs to completion and its result is discarded.
+        """
+        if self._is_shutdown:
+            raise RuntimeError("InferenceWorkerPool has been shut down")
+        with self._lock:
+            self._queue_depth += 1
+            self._calls += 1
+            self._queue_depth_max = max(self._queue_depth_max, self._queue_depth)
+        loop = asyncio.get_running_loop()
+        state = dict(started=False, cancelled=False)
+        try:
+            return await loop.run_in_executor(self._executor,
+                                              self._wrap(fn, args, time.perf_counter(), state))
+        except asyncio.CancelledError:
+            with self._lock:
+                if state["started"] is False:
+                    state["cancelled"] = True
+                    self._queue_depth -= 1
+            raise
+
+    def stats(self, reset: bool = True) -> Dict:
+        """
+        Get the pool metrics since the last reset. The queue depth counts calls that
+        were submitted but not yet started because all threads were busy.
+
+        Args:
+            reset: Reset the metrics after reading them, used to get per chunk metrics
+
+        Returns:
+            Dictionary with the pool metrics
+        """
+        with self._lock:
+            delays = self._dispatch_delays
+            thread_start_delays = self._thread_start_delays
+            stats = dict(worker_pool_max_workers=self._max_workers,
+                         worker_pool_calls=self._calls,
+                         worker_pool_queue_depth_max=self._queue_depth_max,
+                         worker_pool_dispatch_delay_mean=sum(delays) / len(delays) if delays else None,
+                         worker_pool_dispatch_delay_max=max(delays) if delays else None,
+                         worker_pool_threads_started=len(thread_start_delays),
+                         worker_pool_thread_start_overhead_mean=sum(thread_start_delays) / len(thread_start_delays) \
+                                                                if thread_start_delays else None)
+            if reset is True:
+                queue_depth = self._queue_depth
+                self._reset_stats()
+                # calls still waiting for a thread carry over to the next period
+                self._queue_depth = queue_depth
+        return stats
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shut down the pool, waits for running calls to finish by default.
+        """
+        if self._is_shutdown:
+            return
+        self._is_shutdown = True
+        logger.info(f"InferenceWorkerPool, shutting down pool with max_workers={self._max_workers}, "
+                    f"threads used={len(self._known_threads)}")
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+
+def _weighted_mean(stats_list: List[Dict], mean_key: str, count_key: str) -> Optional[float]:
+    pairs = [(s[mean_key], s[count_key]) for s in stats_list if s[mean_key] is not None]
+    count = sum(c for _, c in pairs)
+    return sum(m * c for m, c in pairs) / count if count else None
+
+
+def merge_stats(stats_list: List[Dict]) -> Dict:
+    """
+    Merge the stats of the worker pools of multiple processes into a single
+    set of metrics, used by the multi-process runner.
+    """
+    def max_values(key: str) -> Optional[float]:
+        return max([s[key] for s in stats_list if s[key] is not None], default=None)
+
+    return dict(worker_pool_max_workers=sum(s["worker_pool_max_workers"] for s in stats_list),
+                worker_pool_calls=sum(s["worker_pool_calls"] for s in stats_list),
+                worker_pool_queue_depth_max=max_values("worker_pool_queue_depth_max"),
+                worker_pool_dispatch_delay_mean=_weighted_mean(stats_list,
+                                                               "worker_pool_dispatch_delay_mean",
+                                                               "worker_pool_calls"),
+                worker_pool_dispatch_delay_max=max_values("worker_pool_dispatch_delay_max"),
+                worker_pool_threads_started=sum(s["worker_pool_threads_started"] for s in stats_list),
+                worker_pool_thread_start_overhead_mean=_weighted_mean(stats_list,
+                                                                      "worker_pool_thread_start_overhead_mean",
+                                                                      "worker_pool_threads_started"))
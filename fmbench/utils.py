@@ -8,12 +8,15 @@ import shutil
 import logging
 import requests
 import tempfile
+import atexit
 import posixpath
+import threading
 import unicodedata
 from pathlib import Path
-import concurrent.futures
 from fmbench import globals
 from fmbench import defaults
+from fmbench.scripts.boto3_clients import get_client
+from fmbench.scripts.s3_uploader import S3Uploader, DEFAULT_MAX_CONCURRENCY
 from transformers import AutoTokenizer
 from botocore.exceptions import NoCredentialsError
 from typing import Union, Dict, List, Tuple, Optional
@@ -101,7 +104,7 @@ def load_config(config_file: Union[Path, str]) -> Dict:
     if config_file.startswith("s3://"):
         try:
             # Parse S3 URI
-            s3_client = boto3.client("s3")
+            s3_client = get_client("s3")
             bucket, key = config_file.replace("s3://", "").split("/", 1)
 
             # Get object from S3 and load YAML
@@ -210,9 +213,9 @@ def upload_file_to_s3(bucket: str, local_path: str, s3_path: str) -> None:
     if _is_write_local_only():
         return
 
-    s3 = boto3.resource("s3")
     try:
-        s3.Bucket(bucket).upload_file(local_path, s3_path)
+        # managed transfer on the pooled client, large files are sent as multipart uploads
+        get_client("s3").upload_file(local_path, bucket, s3_path)
     except Exception as e:
         logger.error(f"upload_file_to_s3, An error occurred: {e}")
 
@@ -244,8 +247,8 @@ def _write_to_local(data, dir1, dir2, file_name):
         Path(file).write_bytes(data)
 
 
-# Function to write data to S3
-def write_to_s3(data, bucket_name, dir1, dir2, file_name):
+def _write_local_copy(data, dir1, dir2, file_name) -> bool:
+    # writes the local copy of a file if configured, returns True if the file is only written locally
     if _is_write_local_or_both():
         # If the file name starts with 'hf:', then it means that the hugging face dataset
         # is going to be loaded at runtime and is supposed to be sent to the /tmp/fmbench-read/source_data
@@ -254,11 +257,16 @@ def write_to_s3(data, bucket_name, dir1, dir2, file_name):
             _write_to_local_read(data, dir1, dir2, file_name)
         else:
             _write_to_local(data, dir1, dir2, file_name)
-    if _is_write_local_only():
+    return _is_write_local_only()
+
+
+# Function to write data to S3
+def write_to_s3(data, bucket_name, dir1, dir2, file_name):
+    if _write_local_copy(data, dir1, dir2, file_name):
         return
 
-    # Initialize S3 client
-    s3_client = boto3.client("s3")
+    # Pooled S3 client shared by all the threads
+    s3_client = get_client("s3")
 
     # Construct the S3 file path
     s3_file_path = posixpath.join(nt_to_posix(dir1), nt_to_posix(dir2), file_name)
@@ -273,16 +281,43 @@ def write_to_s3(data, bucket_name, dir1, dir2, file_name):
         logger.error(f"write_to_s3, An error occurred: {e}")
 
 
+# one background uploader per process for write_to_s3_async, see s3_uploader.py
+_s3_uploader: Optional[S3Uploader] = None
+_s3_uploader_lock = threading.Lock()
+
+
+def _get_s3_uploader() -> S3Uploader:
+    global _s3_uploader
+    with _s3_uploader_lock:
+        if _s3_uploader is None:
+            _s3_uploader = S3Uploader(lambda: get_client("s3", max_pool_connections=DEFAULT_MAX_CONCURRENCY))
+            # the upload threads are daemon threads, upload the enqueued files before the process exits
+            atexit.register(_s3_uploader.close)
+    return _s3_uploader
+
+
+# Function to write data to S3 in the background, returns once the file is enqueued, blocks
+# while the upload queue is full. Call flush_s3_writes to wait for the uploads
+def write_to_s3_async(data, bucket_name, dir1, dir2, file_name) -> None:
+    if _write_local_copy(data, dir1, dir2, file_name):
+        return
+    s3_file_path = posixpath.join(nt_to_posix(dir1), nt_to_posix(dir2), file_name)
+    _get_s3_uploader().enqueue(data, bucket_name, s3_file_path)
+
+
+# Function to wait for the writes of write_to_s3_async, returns the S3 keys that could not be written
+def flush_s3_writes() -> List[str]:
+    if _s3_uploader is None:
+        return []
+    return _s3_uploader.flush()
+
+
 # Function to concurrently write multiple data to S3
 # input_list: List[Tuple[data, bucket_name, dir1, dir2, file_name]
 def write_multiple_to_s3(input_list: List[Tuple[None, str, str, str, str]]) -> None:
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        tasks = []
-        for input_tuple in input_list:
-            tasks.append(executor.submit(lambda: write_to_s3(*input_tuple)))
-
-    for completed_task in concurrent.futures.as_completed(tasks):
-        completed_task.result()
+    for input_tuple in input_list:
+        write_to_s3_async(*input_tuple)
+    flush_s3_writes()
 
 
 def _read_from_local(s3_file_path: str) -> str:
@@ -301,7 +336,7 @@ def read_from_s3(bucket_name, s3_file_path):
         return _read_from_local(s3_file_path)
 
     # Initialize S3 client
-    s3_client = boto3.client("s3")
+    s3_client = get_client("s3")
     s3_file_path = nt_to_posix(s3_file_path)
 
     try:
@@ -342,7 +377,7 @@ def get_s3_object(bucket: str, key: str, decode="True") -> str:
         key = nt_to_posix(key)
         logger.debug(f"get_s3_object, bucket_name={bucket}, key={key}")
         # Create an S3 client
-        s3_client = boto3.client("s3")
+        s3_client = get_client("s3")
         # Retrieve the object from S3
         response = s3_client.get_object(Bucket=bucket, Key=key)
         # Read the content of the file
@@ -382,7 +417,7 @@ def list_s3_files(bucket, prefix, suffix=".json"):
         return _list_local_files(bucket, prefix, suffix)
 
     filter_key_by_suffix = lambda k, s: True if s is None else k.endswith(s)
-    s3_client = boto3.client("s3")
+    s3_client = get_client("s3")
     next_continuation_token = None
 
     return_list = []
@@ -490,7 +525,7 @@ def download_multiple_files_from_s3(bucket_name, prefix, local_dir):
     logger.info(
         f"download_multiple_files_from_s3, bucket_name={bucket_name}, prefix={prefix}, local_dir={local_dir}"
     )
-    s3_client = boto3.client("s3")
+    s3_client = get_client("s3")
 
     # Ensure the local directory exists
     if not os.path.exists(local_dir):
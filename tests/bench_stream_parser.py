@@ -0,0 +1,108 @@
+"""
+Microbenchmark of the response stream parsing, run with
+
+    python -m tests.bench_stream_parser [num_tokens] [num_streams]
+
+Compares the previous parsing of a SageMaker response stream (a BytesIO that is re-seeked
+and never compacted, the response built with += and searched for the stop token after every
+token) with the LineBuffer based parsing of stream_responses. Both parse the same stream of
+PayloadPart events, in which a JSON line is sometimes split across two events.
+"""
+
+import io
+import sys
+import json
+import time
+from typing import Dict, List
+from fmbench.scripts.stream_parser import iter_lines
+
+STOP_TOKEN: str = "<|eot_id|>"
+
+
+class BaselineLineIterator:
+    """The LineIterator that stream_responses used before the LineBuffer."""
+
+    def __init__(self, stream):
+        self.byte_iterator = iter(stream)
+        self.buffer = io.BytesIO()
+        self.read_pos = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            self.buffer.seek(self.read_pos)
+            line = self.buffer.readline()
+            if line and line[-1] == ord('\n'):
+                self.read_pos += len(line)
+                return line[:-1]
+            chunk = next(self.byte_iterator)
+            self.buffer.seek(0, io.SEEK_END)
+            self.buffer.write(chunk['PayloadPart']['Bytes'])
+
+
+def baseline_parse(events: List[Dict]) -> str:
+    response_text = ""
+    for event in BaselineLineIterator(events):
+        data = json.loads(event[event.find(b"{"):].decode('utf-8'))
+        token_text = data['token']['text']
+        if token_text and token_text != STOP_TOKEN:
+            time.perf_counter()
+            response_text += token_text
+        if STOP_TOKEN in response_text:
+            break
+    return response_text
+
+
+def line_buffer_parse(events: List[Dict]) -> str:
+    parts: List[str] = []
+    tail = ""
+    for event in iter_lines(events):
+        data = json.loads(event[event.find("{"):])
+        token_text = data['token']['text']
+        if token_text and token_text != STOP_TOKEN:
+            time.perf_counter()
+            parts.append(token_text)
+            tail = tail + token_text
+            if STOP_TOKEN in tail:
+                break
+            tail = tail[-(len(STOP_TOKEN) - 1):]
+    return "".join(parts)
+
+
+def make_events(num_tokens: int) -> List[Dict]:
+    lines = b"".join(b"data:" + json.dumps({"token": {"id": i, "text": f" word{i % 50}"}}).encode() + b"\n"
+                     for i in range(num_tokens))
+    # split every third line across two events
+    events: List[Dict] = []
+    pos = 0
+    while pos < len(lines):
+        end = lines.find(b"\n", pos) + 1
+        if len(events) % 3 == 0 and end - pos > 4:
+            events.append({"PayloadPart": {"Bytes": lines[pos:pos + 4]}})
+            pos += 4
+        events.append({"PayloadPart": {"Bytes": lines[pos:end]}})
+        pos = end
+    return events
+
+
+def run(parse, events: List[Dict], num_streams: int) -> float:
+    start = time.perf_counter()
+    for _ in range(num_streams):
+        parse(events)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    num_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    num_streams = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    events = make_events(num_tokens)
+    assert baseline_parse(events) == line_buffer_parse(events)
+    baseline = run(baseline_parse, events, num_streams)
+    line_buffer = run(line_buffer_parse, events, num_streams)
+    tokens = num_tokens * num_streams
+    print(f"{num_streams} streams of {num_tokens} tokens")
+    print(f"baseline:    {baseline:.3f}s, {tokens / baseline:,.0f} tokens/s")
+    print(f"line buffer: {line_buffer:.3f}s, {tokens / line_buffer:,.0f} tokens/s, "
+          f"{baseline / line_buffer:.1f}x")
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+from fmbench.scripts.boto3_clients import get_client, clear_clients
+from fmbench.scripts.bedrock_predictor_converseAPI import get_bedrock_runtime_client
+
+
+def test_clients_are_cached_per_configuration():
+    clear_clients()
+    client = get_client("bedrock-runtime", region_name="us-east-1", max_pool_connections=64)
+    assert get_client("bedrock-runtime", region_name="us-east-1", max_pool_connections=64) is client
+    assert get_client("bedrock-runtime", region_name="us-west-2", max_pool_connections=64) is not client
+    config = client.meta.config
+    assert config.max_pool_connections == 64
+    assert config.retries["mode"] == "adaptive"
+    assert config.tcp_keepalive is True
+    # the pool is never smaller than the botocore default
+    assert get_client("bedrock-runtime", region_name="us-east-1", max_pool_connections=2).meta.config.max_pool_connections == 10
+
+
+def test_concurrent_get_client_creates_a_single_client():
+    clear_clients()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        clients = list(executor.map(lambda _: get_client("bedrock", region_name="us-east-1"), range(64)))
+    assert all(c is clients[0] for c in clients)
+
+
+def test_bedrock_runtime_client_does_not_retry():
+    clear_clients()
+    client = get_bedrock_runtime_client(region_name="us-east-1", max_pool_connections=64)
+    # throttled requests are retried by the predictor, not inside the measured latency
+    assert client.meta.config.retries == {"mode": "standard", "total_max_attempts": 1}
+    assert client is not get_client("bedrock-runtime", region_name="us-east-1", max_pool_connections=64)
@@ -0,0 +1,55 @@
+import time
+import pytest
+from botocore.exceptions import ClientError
+from fmbench.scripts.bedrock_predictor_converseAPI import (ConverseStreamParser,
+                                                           invoke_bedrock_converse_stream)
+
+
+def make_events(deltas, output_tokens, delay=0.02):
+    yield {"messageStart": {"role": "assistant"}}
+    for text in deltas:
+        time.sleep(delay)
+        yield {"contentBlockDelta": {"delta": {"text": text}, "contentBlockIndex": 0}}
+    yield {"contentBlockStop": {"contentBlockIndex": 0}}
+    yield {"messageStop": {"stopReason": "end_turn"}}
+    yield {"metadata": {"usage": {"inputTokens": 12, "outputTokens": output_tokens, "totalTokens": 12 + output_tokens},
+                        "metrics": {"latencyMs": 100}}}
+
+
+class FakeBedrockRuntime:
+    def __init__(self, events):
+        self._events = events
+        self.request = None
+
+    def converse_stream(self, **kwargs):
+        self.request = kwargs
+        return {"stream": self._events}
+
+
+def test_converse_stream_timings_and_usage():
+    client = FakeBedrockRuntime(make_events(["Hello", " there,", " how are", " you?"], output_tokens=7))
+    result = invoke_bedrock_converse_stream("model-id", [], 0.1, 50, 0.9, bedrock_client=client)
+    assert client.request["inferenceConfig"] == {"temperature": 0.1, "maxTokens": 50, "topP": 0.9}
+    assert result["generated_text"] == "Hello there, how are you?"
+    assert (result["prompt_tokens"], result["completion_tokens"]) == (12, 7)
+    assert result["TTFT"] == pytest.approx(0.02, abs=0.015)
+    assert result["TTLT"] == pytest.approx(0.08, abs=0.03)
+    # 3 delta intervals spread over the 6 tokens after the first one
+    assert result["TPOT"] == pytest.approx((result["TTLT"] - result["TTFT"]) / 6)
+    assert result["latency"] >= result["TTLT"]
+
+
+def test_converse_stream_without_text():
+    parser = ConverseStreamParser(time.perf_counter())
+    for event in make_events([], output_tokens=0, delay=0):
+        parser.process(event)
+    result = parser.result()
+    assert result["generated_text"] == "" and result["TTFT"] is None and result["TPOT"] is None
+    assert parser.stop_reason == "end_turn"
+
+
+def test_converse_stream_exception_event_raises_client_error():
+    parser = ConverseStreamParser(time.perf_counter())
+    with pytest.raises(ClientError) as e:
+        parser.process({"throttlingException": {"message": "Too many requests"}})
+    assert e.value.response["Error"]["Code"] == "ThrottlingException"
@@ -0,0 +1,87 @@
+import socket
+import asyncio
+import multiprocessing
+import pytest
+from fmbench.scripts.load_generator import LOAD_MODE_CHUNKED, LOAD_MODE_OPEN_LOOP, ARRIVAL_CONSTANT
+from fmbench.scripts.distributed_runner import DistributedRunner, parse_worker_address, run_worker
+from tests.test_multiprocess_runner import FakeSender
+
+TOKEN: str = "test-token"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def worker_addresses():
+    # local worker processes acting as hosts
+    ctx = multiprocessing.get_context("spawn")
+    ports = [free_port() for _ in range(3)]
+    processes = [ctx.Process(target=run_worker, args=("127.0.0.1", port, FakeSender, TOKEN), daemon=True)
+                 for port in ports]
+    for p in processes:
+        p.start()
+    yield [f"127.0.0.1:{port}" for port in ports]
+    for p in processes:
+        p.terminate()
+        p.join()
+
+
+def test_parse_worker_address():
+    assert parse_worker_address("10.0.0.1:6000") == ("10.0.0.1", 6000)
+    assert parse_worker_address("worker-1") == ("worker-1", 5555)
+
+
+def test_records_from_all_workers_are_merged(worker_addresses):
+    payloads = [{"inputs": i} for i in range(9)]
+
+    async def run():
+        runner = DistributedRunner(worker_addresses, dict(service_time=0.05), start_delay_seconds=0.5,
+                                   token=TOKEN)
+        await runner.start()
+        try:
+            chunked = await runner.run(payloads, 9, "payload.jsonl", dict(mode=LOAD_MODE_CHUNKED))
+            open_loop = await runner.run(payloads, 3, "payload.jsonl",
+                                         dict(mode=LOAD_MODE_OPEN_LOOP,
+                                              request_rate=60,
+                                              arrival_distribution=ARRIVAL_CONSTANT,
+                                              duration_seconds=None))
+            return chunked, open_loop, runner.stats()
+        finally:
+            runner.shutdown()
+
+    (responses, elapsed), (open_loop_responses, _), stats = asyncio.run(run())
+    assert sorted(r["payload"] for r in responses) == list(range(9))
+    assert len({r["pid"] for r in responses}) == 3
+    # all the workers start at the same time so the chunk takes about one service time
+    assert elapsed < 0.5
+    assert sorted(r["payload"] for r in open_loop_responses) == list(range(9))
+    assert all("intended_start_time" in r for r in open_loop_responses)
+    assert stats["worker_pool_calls"] == 9
+
+
+def test_coordinators_without_the_token_are_rejected(worker_addresses):
+    async def run(token):
+        runner = DistributedRunner(worker_addresses[:1], dict(service_time=0.01), start_delay_seconds=0.1, token=token)
+        await runner.start()
+        try:
+            return await runner.run([{"inputs": 0}], 1, "payload.jsonl", dict(mode=LOAD_MODE_CHUNKED))
+        finally:
+            runner.shutdown()
+
+    with pytest.raises(RuntimeError, match="authentication failed"):
+        asyncio.run(run("wrong-token"))
+    # the worker still accepts a coordinator with the token
+    responses, _ = asyncio.run(run(TOKEN))
+    assert [r["payload"] for r in responses] == [0]
+
+
+def test_a_token_is_required(monkeypatch):
+    monkeypatch.delenv("FMBENCH_WORKER_TOKEN", raising=False)
+    with pytest.raises(ValueError, match="FMBENCH_WORKER_TOKEN"):
+        DistributedRunner(["127.0.0.1:5555"], {})
+    monkeypatch.setenv("FMBENCH_WORKER_TOKEN", TOKEN)
+    assert DistributedRunner(["127.0.0.1:5555"], {}).num_processes == 1
@@ -0,0 +1,103 @@
+import time
+import asyncio
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from fmbench.scripts.http_client import (RequestTimings,
+                                         AsyncClientHolder,
+                                         create_client,
+                                         get_client_settings)
+
+SERVICE_TIME: float = 0.05
+
+
+class Handler(BaseHTTPRequestHandler):
+    # keep-alive connections
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_GET(self):
+        Handler.connections.add(self.client_address)
+        time.sleep(SERVICE_TIME)
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    Handler.connections = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+
+
+def test_get_client_settings():
+    settings = get_client_settings({"timeout": 30, "http2": False}, {"max_concurrency": 8}, 180)
+    assert settings == dict(timeout=30, connect_timeout=None, max_connections=8, http2=False)
+    settings = get_client_settings(None, None, None)
+    assert settings["timeout"] is None and settings["max_connections"] == 100
+    assert get_client_settings({"max_connections": 4}, {"max_concurrency": 8}, 180)["max_connections"] == 4
+
+
+def test_client_reuses_connections_and_records_timings(server_url):
+    client = create_client(get_client_settings({"http2": False}, {"max_concurrency": 2}, 10))
+    results = []
+    for _ in range(3):
+        timings = RequestTimings()
+        assert client.get(server_url, extensions={"trace": timings.trace}).text == "ok"
+        results.append(timings.to_dict())
+    client.close()
+    assert len(Handler.connections) == 1
+    assert results[0]["connect_time"] > 0
+    # kept-alive connection, no connect step
+    assert results[1]["connect_time"] == 0 and results[2]["tls_time"] == 0
+    assert all(r["time_to_first_byte"] >= SERVICE_TIME for r in results)
+
+
+def test_async_client_is_reused_on_the_same_event_loop(server_url):
+    holder = AsyncClientHolder(get_client_settings({"http2": False}, {"max_concurrency": 4}, 10))
+
+    async def run():
+        timings = [RequestTimings() for _ in range(8)]
+        responses = await asyncio.gather(*[holder.get().get(server_url, extensions={"trace": t.atrace})
+                                           for t in timings])
+        assert all(r.status_code == 200 for r in responses)
+        return holder.get(), [t.to_dict() for t in timings]
+
+    client, results = asyncio.run(run())
+    # at most max_connections connections for 8 concurrent requests
+    assert len(Handler.connections) <= 4
+    assert all(r["time_to_first_byte"] >= SERVICE_TIME for r in results)
+    # a new event loop gets a new client
+    assert asyncio.run(run())[0] is not client
+
+
+def test_async_client_is_closed_on_its_event_loop(server_url):
+    holder = AsyncClientHolder(get_client_settings({"http2": False}, None, 10))
+
+    async def request():
+        assert (await holder.get().get(server_url)).text == "ok"
+        return holder.get()
+
+    # closed from the running event loop
+    async def run_and_close():
+        client = await request()
+        holder.close()
+        await asyncio.sleep(0.01)
+        return client
+
+    assert asyncio.run(run_and_close()).is_closed
+    # closed after the event loop stopped but before it is closed, as the worker processes do
+    loop = asyncio.new_event_loop()
+    client = loop.run_until_complete(request())
+    holder.close()
+    assert client.is_closed
+    loop.close()
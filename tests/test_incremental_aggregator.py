@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+from fmbench.scripts.incremental_aggregator import IncrementalAggregator
+
+
+def make_records(n, concurrency, latency, start=0, **extra):
+    return [dict(uuid=f"id-{i}", experiment_name="exp", concurrency=concurrency, payload_file="p.jsonl",
+                 prompt="prompt", completion=None if i % 5 == 4 else "completion", prompt_tokens=10,
+                 completion_tokens=None if i % 5 == 4 else 20, latency=latency, time_to_first_token=None,
+                 inference_params={"max_tokens": 20}, **extra) for i in range(start, start + n)]
+
+
+def test_running_aggregates_per_combination(tmp_path):
+    aggregator = IncrementalAggregator(str(tmp_path))
+    # two chunks of the same combination and one chunk of another
+    aggregator.add(make_records(10, 1, latency=1.0), elapsed_seconds=5)
+    aggregator.add(make_records(10, 1, latency=3.0, start=10), elapsed_seconds=5)
+    aggregator.add(make_records(5, 2, latency=2.0, start=20), elapsed_seconds=2)
+    summary = aggregator.summary().set_index("concurrency")
+    assert aggregator.record_count == 25
+    row = summary.loc[1]
+    assert row.transactions == 20 and row.successes == 16 and row.error_rate == pytest.approx(0.2)
+    assert row.all_prompts_token_count == 200 and row.completion_token_count_mean == pytest.approx(20)
+    assert row.transactions_per_minute == pytest.approx(60 * 16 / 10)
+    # the percentiles of both chunks together and not the mean of their percentiles
+    assert row.latency_p50 == pytest.approx(1.0, rel=0.01) and row.latency_p95 == pytest.approx(3.0, rel=0.01)
+    assert row.TTFT_p50 is None or pd.isna(row.TTFT_p50)
+    assert summary.loc[2].transactions == 5
+    aggregator.close()
+
+
+def test_error_records_are_aggregated_with_their_combination(tmp_path):
+    aggregator = IncrementalAggregator(str(tmp_path))
+    # failed and timed out requests have no completion, tokens or latency
+    errors = [dict(uuid=f"error-{i}", experiment_name="exp", concurrency=1, payload_file="p.jsonl",
+                   prompt="prompt", completion=None, prompt_tokens=None, completion_tokens=None,
+                   latency=None, max_tokens=20) for i in range(2)]
+    aggregator.add(make_records(4, 1, latency=1.0) + errors, elapsed_seconds=5)
+    summary = aggregator.summary()
+    assert len(summary) == 1
+    row = summary.iloc[0]
+    assert row.transactions == 6 and row.successes == 4 and row.error_rate == pytest.approx(2 / 6)
+    # the elapsed time of the chunk is counted once
+    assert row.elapsed_seconds == 5 and row.transactions_per_minute == pytest.approx(60 * 4 / 5)
+    aggregator.close()
+
+
+def test_warmup_records_are_spilled_but_not_aggregated(tmp_path):
+    aggregator = IncrementalAggregator(str(tmp_path))
+    aggregator.add(make_records(4, 1, latency=9.0, phase="warmup") + make_records(4, 1, latency=1.0, phase="measure"),
+                   elapsed_seconds=4)
+    row = aggregator.summary().iloc[0]
+    assert row.transactions == 4 and row.latency_p99 == pytest.approx(1.0, rel=0.01)
+    assert aggregator.record_count == 8
+    aggregator.close()
+
+
+def test_records_csv_is_streamed_from_the_spool(tmp_path):
+    aggregator = IncrementalAggregator(str(tmp_path))
+    aggregator.add(make_records(3, 1, latency=1.0), elapsed_seconds=1)
+    # a later chunk with an extra column
+    aggregator.add(make_records(2, 2, latency=1.0, start=3, phase="measure"), elapsed_seconds=1)
+    path = tmp_path / "results.csv"
+    count = aggregator.write_records_csv(str(path), {"exp": {"instance_type": "ml.g5.xlarge", "instance_count": 1}})
+    aggregator.close()
+    df = pd.read_csv(path)
+    assert count == 5 and list(df.uuid) == [f"id-{i}" for i in range(5)]
+    assert list(df.columns[-3:]) == ["phase", "instance_type", "instance_count"]
+    assert df.phase.isna().sum() == 3 and (df.instance_type == "ml.g5.xlarge").all()
+    # the same text as pandas writes for a dictionary
+    assert df.inference_params[0] == "{'max_tokens': 20}"
+    assert list(tmp_path.glob("fmbench-records-*")) == []
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fmbench.scripts.latency_histogram import (LatencyHistogram,
+                                               get_histograms,
+                                               merge_histograms,
+                                               summarize_histograms)
+
+
+def test_percentiles_within_relative_accuracy():
+    rng = np.random.default_rng(7)
+    values = rng.lognormal(mean=0.0, sigma=1.0, size=20_000)
+    histogram = LatencyHistogram()
+    histogram.record_values(values)
+    for q, expected in zip([50, 95, 99], np.percentile(values, [50, 95, 99], method="inverted_cdf")):
+        assert histogram.percentile(q) == pytest.approx(expected, rel=0.01)
+    assert histogram.percentile(0) == values.min() and histogram.percentile(100) == values.max()
+    assert histogram.mean == pytest.approx(values.mean())
+    assert LatencyHistogram().percentiles([50, 99]) == [None, None]
+
+
+def test_merged_chunks_give_the_percentiles_of_all_requests():
+    # a fast chunk and a chunk with a slow tail, the mean of their p99 hides the tail
+    rng = np.random.default_rng(1)
+    fast = rng.uniform(0.9, 1.1, size=1000)
+    slow = np.concatenate([rng.uniform(0.9, 1.1, size=900), rng.uniform(9, 11, size=100)])
+    chunks = [get_histograms([{"latency": v} for v in chunk])["latency_histogram"] for chunk in [fast, slow]]
+    merged = merge_histograms(chunks + [None, float("nan")])
+    assert merged.count == 2000
+    p99 = np.percentile(np.concatenate([fast, slow]), 99, method="inverted_cdf")
+    assert merged.percentile(99) == pytest.approx(p99, rel=0.01)
+    assert np.mean([np.percentile(c, 99) for c in [fast, slow]]) < 0.6 * p99
+    # serialization round trip
+    assert LatencyHistogram.from_dict(merged.to_json()).to_dict() == merged.to_dict()
+    with pytest.raises(ValueError):
+        merged.merge(LatencyHistogram(relative_accuracy=0.02))
+
+
+def test_summarize_histograms_per_group():
+    records = [{"latency": 1.0, "time_to_first_token": None}, {"latency": 3.0, "time_to_first_token": None}]
+    histograms = get_histograms(records)
+    assert histograms["TTFT_histogram"] is None
+    df = pd.DataFrame([dict(experiment_name="e", concurrency=c, **histograms) for c in [1, 1, 2]])
+    summary = summarize_histograms(df, ["experiment_name", "concurrency"])
+    assert list(summary.concurrency) == [1, 2]
+    assert summary.latency_p50.tolist() == pytest.approx([1.0, 1.0], rel=0.01)
+    assert summary.latency_p99.tolist() == pytest.approx([3.0, 3.0], rel=0.01)
+    assert summary.TTFT_p50.isna().all()
@@ -0,0 +1,98 @@
+import os
+import asyncio
+import urllib.request
+import pytest
+from fmbench.scripts.live_metrics import LiveMetrics, MetricsServer, get_live_metrics_config
+
+
+def record(latency, ttft=None, completion="completion", retry_wait_time=0):
+    return dict(completion=completion, completion_tokens=None if completion is None else 10,
+                latency=latency, time_to_first_token=ttft, retry_wait_time=retry_wait_time)
+
+
+def parse(text):
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line and not line.startswith("#")}
+
+
+def test_metrics_are_served_per_experiment_and_concurrency():
+    live_metrics = LiveMetrics(window_seconds=60)
+    server = MetricsServer(live_metrics, port=0)
+    try:
+        live_metrics.set_combination("exp", 2)
+        in_flight = live_metrics.request_started()
+        for latency in [0.2, 0.4, 3.0]:
+            live_metrics.request_finished(live_metrics.request_started(), record(latency, ttft=0.1))
+        live_metrics.request_finished(live_metrics.request_started(), record(1.0, completion=None))
+        live_metrics.request_finished(live_metrics.request_started(), record(0.3, retry_wait_time=2.0))
+        live_metrics.set_combination("exp", 4)
+        live_metrics.add_records([record(0.5)])
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            metrics = parse(response.read().decode())
+    finally:
+        server.shutdown()
+    labels = 'experiment="exp",concurrency="2"'
+    assert metrics[f"fmbench_requests_in_flight{{{labels}}}"] == 1
+    assert metrics[f'fmbench_requests_total{{{labels},status="success"}}'] == 4
+    assert metrics[f'fmbench_requests_total{{{labels},status="error"}}'] == 1
+    assert metrics[f"fmbench_throttled_requests_total{{{labels}}}"] == 1
+    assert metrics[f"fmbench_request_rate{{{labels}}}"] == pytest.approx(5 / 60)
+    assert metrics[f"fmbench_error_rate{{{labels}}}"] == pytest.approx(0.2)
+    # cumulative buckets
+    assert metrics[f'fmbench_latency_seconds_bucket{{{labels},le="0.25"}}'] == 1
+    assert metrics[f'fmbench_latency_seconds_bucket{{{labels},le="0.5"}}'] == 3
+    assert metrics[f'fmbench_latency_seconds_bucket{{{labels},le="+Inf"}}'] == 5
+    assert metrics[f"fmbench_latency_seconds_sum{{{labels}}}"] == pytest.approx(4.9)
+    assert metrics[f"fmbench_ttft_seconds_count{{{labels}}}"] == 3
+    assert metrics[f'fmbench_latency_window_seconds{{{labels},quantile="0.5"}}'] == pytest.approx(0.4)
+    assert metrics[f'fmbench_ttft_window_seconds{{{labels},quantile="0.95"}}'] == pytest.approx(0.1)
+    assert metrics['fmbench_requests_total{experiment="exp",concurrency="4",status="success"}'] == 1
+    assert in_flight == ("exp", "2")
+
+
+def test_window_metrics_only_use_recent_requests(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("fmbench.scripts.live_metrics.time.monotonic", lambda: now[0])
+    live_metrics = LiveMetrics(window_seconds=10)
+    live_metrics.set_combination('exp "a"', 1)
+    live_metrics.add_records([record(5.0)])
+    now[0] += 20
+    live_metrics.add_records([record(1.0), record(1.0, completion=None)])
+    metrics = parse(live_metrics.render())
+    labels = 'experiment="exp \\"a\\"",concurrency="1"'
+    assert metrics[f"fmbench_request_rate{{{labels}}}"] == pytest.approx(0.2)
+    assert metrics[f"fmbench_error_rate{{{labels}}}"] == pytest.approx(0.5)
+    assert metrics[f'fmbench_latency_window_seconds{{{labels},quantile="0.99"}}'] == pytest.approx(1.0)
+    assert metrics[f"fmbench_latency_seconds_count{{{labels}}}"] == 3
+
+
+def test_window_is_trimmed_without_scrapes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("fmbench.scripts.live_metrics.time.monotonic", lambda: now[0])
+    live_metrics = LiveMetrics(window_seconds=10)
+    for _ in range(100):
+        live_metrics.add_records([record(1.0)])
+        now[0] += 1
+    # only the requests of the last 10 seconds are kept even though render was never called
+    assert len(live_metrics._metrics[("", "")].window) == 11
+
+
+def test_async_get_inference_tracks_in_flight_requests():
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    inference = pytest.importorskip("fmbench.scripts.inference")
+    live_metrics = LiveMetrics()
+    live_metrics.set_combination("exp", 1)
+    seen = []
+
+    class Pool:
+        async def run(self, fn, *args):
+            seen.append(parse(live_metrics.render())['fmbench_requests_in_flight{experiment="exp",concurrency="1"}'])
+            return record(0.1)
+
+    response = asyncio.run(inference.async_get_inference(object(), {}, "p.jsonl", Pool(), live_metrics=live_metrics))
+    metrics = parse(live_metrics.render())
+    assert response["latency"] == 0.1 and seen == [1]
+    assert metrics['fmbench_requests_in_flight{experiment="exp",concurrency="1"}'] == 0
+    assert get_live_metrics_config({}) is None
+    assert get_live_metrics_config({"live_metrics": {"enabled": True, "port": 0}})["port"] == 0
@@ -0,0 +1,156 @@
+import time
+import asyncio
+import pytest
+from fmbench.scripts.load_generator import (LOAD_MODE_OPEN_LOOP,
+                                            LOAD_MODE_CLOSED_LOOP,
+                                            ARRIVAL_CONSTANT,
+                                            run_load,
+                                            assign_phases,
+                                            arrival_offsets,
+                                            run_open_loop,
+                                            run_closed_loop,
+                                            create_request_list,
+                                            get_load_generation_config)
+
+
+def make_send(service_time: float, in_flight: dict):
+    async def send(payload):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(service_time)
+        in_flight["now"] -= 1
+        return dict(payload=payload["inputs"], latency=service_time)
+    return send
+
+
+def test_get_load_generation_config_defaults_to_chunked():
+    load_generation = get_load_generation_config({}, {"name": "e1"})
+    assert load_generation["mode"] == "chunked"
+
+
+def test_get_load_generation_config_experiment_overrides_config():
+    config = {"load_generation": {"mode": LOAD_MODE_OPEN_LOOP, "request_rate": 5}}
+    experiment = {"name": "e1", "load_generation": {"request_rate": 10}}
+    load_generation = get_load_generation_config(config, experiment)
+    assert load_generation["mode"] == LOAD_MODE_OPEN_LOOP
+    assert load_generation["request_rate"] == 10
+
+
+def test_get_load_generation_config_invalid():
+    with pytest.raises(ValueError, match="not supported"):
+        get_load_generation_config({"load_generation": {"mode": "bogus"}}, {})
+    with pytest.raises(ValueError, match="request_rate"):
+        get_load_generation_config({"load_generation": {"mode": LOAD_MODE_OPEN_LOOP}}, {})
+
+
+def test_arrival_offsets():
+    assert arrival_offsets(4, 2, ARRIVAL_CONSTANT) == [0, 0.5, 1.0, 1.5]
+    offsets = arrival_offsets(2000, 100, seed=7)
+    assert offsets == arrival_offsets(2000, 100, seed=7)
+    assert offsets == sorted(offsets)
+    # mean inter-arrival time of a poisson process is 1/rate
+    assert abs(offsets[-1] / (len(offsets) - 1) - 0.01) < 0.002
+
+
+def test_closed_loop_keeps_n_in_flight_without_chunk_barrier():
+    in_flight = dict(now=0, max=0)
+    payloads = [{"inputs": i} for i in range(12)]
+    responses, elapsed = asyncio.run(run_closed_loop(make_send(0.05, in_flight), payloads, 4))
+    assert [r["payload"] for r in responses] == list(range(12))
+    assert in_flight["max"] == 4
+    # 12 requests of 50ms with 4 in flight take ~150ms
+    assert elapsed < 0.3
+    for r in responses:
+        assert r["actual_start_time"] >= r["intended_start_time"]
+        assert r["response_time"] >= r["queueing_delay"]
+
+
+def test_open_loop_records_queueing_delay_when_capped():
+    in_flight = dict(now=0, max=0)
+    payloads = [{"inputs": i} for i in range(10)]
+    # 10 requests arrive within 90ms but only 1 can be in flight and each takes 50ms
+    responses, _ = asyncio.run(run_open_loop(make_send(0.05, in_flight), payloads,
+                                             request_rate=100,
+                                             arrival_distribution=ARRIVAL_CONSTANT,
+                                             max_in_flight=1))
+    assert in_flight["max"] == 1
+    assert responses[-1]["queueing_delay"] > 0.3
+    assert responses[-1]["response_time"] > responses[-1]["latency"]
+
+
+def test_open_loop_does_not_wait_for_previous_requests():
+    in_flight = dict(now=0, max=0)
+    payloads = [{"inputs": i} for i in range(5)]
+    st = time.perf_counter()
+    responses, _ = asyncio.run(run_load(make_send(0.2, in_flight), payloads, 5,
+                                        dict(mode=LOAD_MODE_OPEN_LOOP,
+                                             request_rate=50,
+                                             arrival_distribution=ARRIVAL_CONSTANT)))
+    assert time.perf_counter() - st < 0.5
+    assert in_flight["max"] == 5
+    assert all(r["queueing_delay"] < 0.05 for r in responses)
+
+
+def test_run_load_closed_loop():
+    in_flight = dict(now=0, max=0)
+    payloads = [{"inputs": i} for i in range(3)]
+    responses, _ = asyncio.run(run_load(make_send(0.01, in_flight), payloads, 8,
+                                        dict(mode=LOAD_MODE_CLOSED_LOOP)))
+    assert len(responses) == 3
+
+
+def test_create_request_list_cycles_payloads():
+    assert create_request_list([1, 2, 3], 7) == [1, 2, 3, 1, 2, 3, 1]
+
+
+def test_get_load_generation_config_request_count_and_duration_are_exclusive():
+    with pytest.raises(ValueError, match="either"):
+        get_load_generation_config({"load_generation": {"mode": LOAD_MODE_CLOSED_LOOP,
+                                                        "request_count": 10,
+                                                        "duration_seconds": 5}}, {})
+
+
+def test_closed_loop_fixed_duration_cycles_payloads():
+    in_flight = dict(now=0, max=0)
+    payloads = [{"inputs": i} for i in range(3)]
+    responses, elapsed = asyncio.run(run_closed_loop(make_send(0.02, in_flight), payloads, 2,
+                                                     duration_seconds=0.2))
+    # 2 in flight for 200ms with 20ms requests is ~20 requests
+    assert len(responses) > 10
+    assert in_flight["max"] == 2
+    assert [r["payload"] for r in responses[:6]] == [0, 1, 2, 0, 1, 2]
+    assert elapsed < 0.3
+
+
+def test_open_loop_fixed_duration():
+    in_flight = dict(now=0, max=0)
+    payloads = [{"inputs": i} for i in range(2)]
+    responses, _ = asyncio.run(run_load(make_send(0.01, in_flight), payloads, 4,
+                                        dict(mode=LOAD_MODE_OPEN_LOOP,
+                                             request_rate=100,
+                                             arrival_distribution=ARRIVAL_CONSTANT,
+                                             duration_seconds=0.1)))
+    assert len(responses) == 10
+
+
+def test_get_load_generation_config_phases_set_duration():
+    load_generation = get_load_generation_config({"load_generation": {"mode": LOAD_MODE_CLOSED_LOOP}},
+                                                 {"load_generation": {"warmup_seconds": 10,
+                                                                      "measure_seconds": 60,
+                                                                      "cooldown_seconds": 5}})
+    assert load_generation["duration_seconds"] == 75
+    with pytest.raises(ValueError, match="measure_seconds"):
+        get_load_generation_config({"load_generation": {"mode": LOAD_MODE_CLOSED_LOOP,
+                                                        "warmup_seconds": 10}}, {})
+    with pytest.raises(ValueError, match="require"):
+        get_load_generation_config({"load_generation": {"measure_seconds": 10}}, {})
+
+
+def test_assign_phases():
+    responses = [{"intended_start_time": 100 + t} for t in (0, 1.5, 2, 5, 7.9, 8)]
+    boundaries = assign_phases(responses, dict(warmup_seconds=2, measure_seconds=6, cooldown_seconds=1))
+    assert [r["phase"] for r in responses] == ["warmup", "warmup", "measure", "measure", "measure", "cooldown"]
+    assert boundaries["measure_start_time"] == 102
+    assert boundaries["cooldown_start_time"] == 108
+    assert boundaries["run_end_time"] == 109
+    assert boundaries["measure_requests"] == 3
@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from fmbench.scripts.micro_batcher import MicroBatcher
+
+
+def test_batches_by_size_and_wait():
+    batches = []
+
+    async def send_batch(items):
+        batches.append(list(items))
+        await asyncio.sleep(0.01)
+        return [i * 10 for i in items]
+
+    async def run():
+        batcher = MicroBatcher(send_batch, batch_size=4, max_wait_ms=50)
+        # 6 concurrent items: a full batch of 4 right away and a partial batch of 2 after max_wait_ms
+        return await asyncio.gather(*[batcher.submit(i) for i in range(6)])
+
+    results = asyncio.run(run())
+    assert batches == [[0, 1, 2, 3], [4, 5]]
+    assert [r.value for r in results] == [0, 10, 20, 30, 40, 50]
+    assert [r.batch_size for r in results] == [4, 4, 4, 4, 2, 2]
+    # the full batch is sent immediately, the partial batch waits for max_wait_ms
+    assert all(r.wait_time < 0.04 for r in results[:4])
+    assert all(0.04 <= r.wait_time < 0.5 for r in results[4:])
+
+
+def test_batch_failure_is_raised_in_every_caller():
+    async def send_batch(items):
+        raise RuntimeError("endpoint unavailable")
+
+    async def run():
+        batcher = MicroBatcher(send_batch, batch_size=2, max_wait_ms=5)
+        return await asyncio.gather(*[batcher.submit(i) for i in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_batch_size_needs_to_be_positive():
+    with pytest.raises(ValueError):
+        MicroBatcher(lambda items: items, batch_size=0)
@@ -0,0 +1,98 @@
+import os
+import asyncio
+import pytest
+from fmbench.scripts.rate_limiter import configure_rate_limits
+from fmbench.scripts.load_generator import LOAD_MODE_CHUNKED, LOAD_MODE_CLOSED_LOOP
+from fmbench.scripts.multiprocess_runner import (MultiProcessRunner,
+                                                 shard_payloads,
+                                                 shard_concurrency,
+                                                 shard_load_generation)
+
+
+class FakeSender:
+    """Sender used in the worker processes, records which process sent each payload."""
+
+    def __init__(self, service_time: float):
+        self._service_time = service_time
+        self._calls = 0
+
+    async def send(self, payload, payload_file):
+        self._calls += 1
+        await asyncio.sleep(self._service_time)
+        return dict(payload=payload["inputs"], payload_file=payload_file, pid=os.getpid(),
+                    latency=self._service_time)
+
+    def stats(self):
+        # like the worker pool, the stats are reset when they are read
+        calls, self._calls = self._calls, 0
+        return dict(worker_pool_max_workers=1,
+                    worker_pool_calls=calls,
+                    worker_pool_queue_depth_max=0,
+                    worker_pool_dispatch_delay_mean=None,
+                    worker_pool_dispatch_delay_max=None,
+                    worker_pool_threads_started=0,
+                    worker_pool_thread_start_overhead_mean=None)
+
+    def shutdown(self):
+        pass
+
+
+class FailingSender:
+    def __init__(self):
+        raise ValueError("no predictor")
+
+
+def test_sharding():
+    assert shard_payloads([1, 2, 3, 4, 5], 2) == [[1, 3, 5], [2, 4]]
+    assert shard_concurrency(5, 2) == [3, 2]
+    assert sum(shard_concurrency(7, 3)) == 7
+    shard = shard_load_generation(dict(mode="open_loop", request_rate=10, seed=1), 1, 2)
+    assert shard["request_rate"] == 5 and shard["seed"] == 2 and shard["rate_limit_share"] == 0.5
+
+
+def test_records_from_all_processes_are_merged():
+    payloads = [{"inputs": i} for i in range(8)]
+    with MultiProcessRunner(2, FakeSender, dict(service_time=0.05)) as runner:
+        responses, elapsed = asyncio.run(runner.run(payloads, 4, "payload.jsonl",
+                                                    dict(mode=LOAD_MODE_CHUNKED)))
+        assert sorted(r["payload"] for r in responses) == list(range(8))
+        assert len({r["pid"] for r in responses}) == 2
+        assert all(r["payload_file"] == "payload.jsonl" for r in responses)
+        assert runner.stats()["worker_pool_calls"] == 8
+        # processes are reused for the next chunk
+        responses, _ = asyncio.run(runner.run(payloads[:3], 4, "payload.jsonl",
+                                              dict(mode=LOAD_MODE_CLOSED_LOOP, duration_seconds=None)))
+        assert sorted(r["payload"] for r in responses) == [0, 1, 2]
+        assert all("queueing_delay" in r for r in responses)
+    # start up time of the processes is not part of the elapsed time
+    assert elapsed < 1
+
+
+def test_rate_limit_share_reaches_the_predictor(monkeypatch):
+    # the bedrock predictor creates AWS clients and loads the litellm cost map at import
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    pytest.importorskip("litellm")
+    from fmbench.scripts.inference import InferenceSender
+    model_id = "anthropic.claude-3-haiku-20240307-v1:0"
+    sender = InferenceSender(dict(inference_script="bedrock_predictor.py",
+                                  endpoint_name=model_id,
+                                  inference_spec={"parameters": {"max_tokens": 16}},
+                                  metadata=None),
+                             max_workers=1,
+                             rate_limits={model_id: {"requests_per_minute": 600, "tokens_per_minute": 60000}})
+    try:
+        # the limiter used for the requests of the predictor is paced at the share of the worker
+        rate_limiter = sender._predictor._rate_limiter
+        assert (rate_limiter._requests._rate, rate_limiter._tokens._rate) == (10, 1000)
+        sender.set_rate_limit_share(0.25)
+        rate_limiter = sender._predictor._rate_limiter
+        assert (rate_limiter._requests._rate, rate_limiter._tokens._rate) == (2.5, 250)
+    finally:
+        configure_rate_limits(None)
+        sender.shutdown()
+
+
+def test_sender_creation_failure_raises():
+    with pytest.raises(RuntimeError, match="no predictor"):
+        MultiProcessRunner(1, FailingSender, {})
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+openai_compatible_predictor = pytest.importorskip("fmbench.scripts.openai_compatible_predictor")
+
+TOKENS = ["Hello", " there", ",", " how", " are", " you", "?"]
+TOKEN_DELAY: float = 0.02
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Stub of an OpenAI compatible server (vLLM, TGI) with and without streaming."""
+    protocol_version = "HTTP/1.1"
+    requests = []
+    throttled = 0
+    status = 200
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        Handler.requests.append((self.path, body))
+        if Handler.throttled > 0 or Handler.status != 200:
+            Handler.throttled -= 1
+            self.send_response(429 if Handler.status == 200 else Handler.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        tokens = TOKENS[:body.get("max_tokens", len(TOKENS))]
+        usage = {"prompt_tokens": 11, "completion_tokens": len(tokens), "total_tokens": 11 + len(tokens)}
+        chat = self.path.endswith("/chat/completions")
+        if not body.get("stream"):
+            choice = {"message": {"role": "assistant", "content": "".join(tokens)}} if chat else {"text": "".join(tokens)}
+            data = json.dumps({"choices": [choice], "usage": usage}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [{"choices": [{"delta": {"content": t}} if chat else {"text": t}]} for t in tokens]
+        if body.get("stream_options", {}).get("include_usage"):
+            chunks.append({"choices": [], "usage": usage})
+        for chunk in chunks:
+            time.sleep(TOKEN_DELAY)
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    Handler.requests = []
+    Handler.throttled = 0
+    Handler.status = 200
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+
+
+def create(base_url, **inference_spec):
+    spec = dict(model_id="stub-model", http2=False, parameters={"temperature": 0.1, "max_tokens": 100})
+    return openai_compatible_predictor.create_predictor(base_url, spec | inference_spec, {"max_concurrency": 4})
+
+
+def test_chat_completion(base_url):
+    predictor = create(base_url)
+    response = predictor.get_prediction({"inputs": "Hi", "max_tokens": 3})
+    predictor.shutdown()
+    path, body = Handler.requests[0]
+    assert path == "/v1/chat/completions"
+    assert body["model"] == "stub-model" and body["messages"] == [{"role": "user", "content": "Hi"}]
+    # the max_tokens of the payload overrides the configured parameters
+    assert body["max_tokens"] == 3 and "stream" not in body
+    assert response["response_json"]["generated_text"] == "Hello there,"
+    assert response["prompt_tokens"] == 11 and response["completion_tokens"] == 3
+    assert response["token_count_model"] is None
+    assert response["time_to_first_token"] is None and response["latency"] > 0
+
+
+def test_streaming_timings_and_usage(base_url):
+    predictor = create(base_url, stream=True, token_timings=True)
+    response = predictor.get_prediction({"inputs": "Hi"})
+    predictor.shutdown()
+    assert Handler.requests[0][1]["stream_options"] == {"include_usage": True}
+    assert response["response_json"]["generated_text"] == "".join(TOKENS)
+    assert response["prompt_tokens"] == 11 and response["completion_tokens"] == len(TOKENS)
+    assert TOKEN_DELAY <= response["time_to_first_token"] < response["time_to_last_token"] <= response["latency"]
+    assert response["time_per_output_token"] == pytest.approx(TOKEN_DELAY, rel=0.5)
+    assert len(response["token_times"]) == len(TOKENS)
+    assert response["time_to_first_byte"] is not None
+
+
+def test_async_streaming_completions_api(base_url):
+    predictor = create(base_url, api="completions", stream=True)
+
+    async def run():
+        return await asyncio.gather(*[predictor.aget_prediction({"inputs": f"prompt {i}"}) for i in range(4)])
+
+    responses = asyncio.run(run())
+    predictor.shutdown()
+    assert {path for path, _ in Handler.requests} == {"/v1/completions"}
+    assert all(r["response_json"]["generated_text"] == "".join(TOKENS) for r in responses)
+    assert all(r["completion_tokens"] == len(TOKENS) and r["time_to_first_token"] > 0 for r in responses)
+    # the concurrent requests are streamed in parallel
+    assert max(r["latency"] for r in responses) < 4 * len(TOKENS) * TOKEN_DELAY
+
+
+def test_throttled_requests_are_retried(base_url, monkeypatch):
+    monkeypatch.setattr(openai_compatible_predictor, "INITIAL_RETRY_DELAY", 0.01)
+    Handler.throttled = 2
+    predictor = create(base_url)
+    response = asyncio.run(predictor.aget_prediction({"inputs": "Hi"}))
+    predictor.shutdown()
+    assert len(Handler.requests) == 3
+    assert response["retry_wait_time"] == pytest.approx(0.03)
+    assert response["response_json"]["generated_text"] == "".join(TOKENS)
+
+
+def test_failed_requests_produce_error_records(base_url):
+    inference = pytest.importorskip("fmbench.scripts.inference")
+    Handler.status = 500
+    predictor = create(base_url)
+    payload = {"inputs": "Hi"}
+    responses = [predictor.get_prediction(payload), asyncio.run(predictor.aget_prediction(payload))]
+    predictor.shutdown()
+    # connection refused
+    unreachable = create("http://127.0.0.1:1/v1")
+    responses.append(unreachable.get_prediction(payload))
+    unreachable.shutdown()
+    # a server error is not retried
+    assert len(Handler.requests) == 2
+    for response in responses:
+        assert response["completion_tokens"] is None and response["latency"] is None
+        record = inference.create_inference_response(predictor, payload, payload, "p.jsonl", response, "id")
+        assert record["completion_tokens"] is None and record["retry_wait_time"] == 0
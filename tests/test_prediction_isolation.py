@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the predictor modules create AWS clients and load the litellm cost map at import
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+litellm_predictor = pytest.importorskip("fmbench.scripts.litellm_predictor")
+from fmbench.scripts.worker_pool import InferenceWorkerPool
+from fmbench.scripts.fmbench_predictor import PredictionRecord
+
+NUM_REQUESTS: int = 200
+CONCURRENCY: int = 32
+
+
+class MockModelHandler(BaseHTTPRequestHandler):
+    """OpenAI compatible chat completions endpoint that echoes the prompt after a random delay."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = request["messages"][0]["content"]
+        # random service times so that the requests complete out of order
+        time.sleep(random.uniform(0, 0.02))
+        body = json.dumps({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request["model"],
+            "choices": [{"index": 0,
+                         "message": {"role": "assistant", "content": f"echo {prompt}"},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt.split()),
+                      "completion_tokens": len(prompt.split()) + 1,
+                      "total_tokens": 2 * len(prompt.split()) + 1},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def predictor():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockModelHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["OPENAI_API_KEY"] = "mock"
+    yield litellm_predictor.create_predictor("gpt-4o", {"parameters": {"max_tokens": 16}}, None)
+    server.shutdown()
+
+
+def check_no_contamination(payloads, responses):
+    assert len(responses) == len(payloads)
+    for payload, response in zip(payloads, responses):
+        assert response["response_json"]["generated_text"] == f"echo {payload['inputs']}"
+        assert response["prompt_tokens"] == len(payload["inputs"].split())
+
+
+def make_payloads():
+    return [{"inputs": f"request {i} " + "word " * random.randint(0, 8)} for i in range(NUM_REQUESTS)]
+
+
+def test_prediction_record_is_immutable():
+    record = PredictionRecord(generated_text="a", latency=1.0, prompt_tokens=1, completion_tokens=1)
+    with pytest.raises(AttributeError):
+        record.generated_text = "b"
+    # every response is a new object
+    assert record.to_response() is not record.to_response()
+    assert record.to_response()["response_json"] is not record.to_response()["response_json"]
+
+
+def test_no_cross_request_contamination_with_threads(predictor):
+    payloads = make_payloads()
+    worker_pool = InferenceWorkerPool(CONCURRENCY)
+
+    async def run():
+        return await asyncio.gather(*[worker_pool.run(predictor.get_prediction, p) for p in payloads])
+
+    try:
+        check_no_contamination(payloads, asyncio.run(run()))
+        assert worker_pool.stats()["worker_pool_threads_started"] > 1
+    finally:
+        worker_pool.shutdown()
+
+
+def test_no_cross_request_contamination_with_async_predictions(predictor):
+    payloads = make_payloads()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(payload):
+        async with semaphore:
+            return await predictor.aget_prediction(payload)
+
+    async def run():
+        return await asyncio.gather(*[one(p) for p in payloads])
+
+    check_no_contamination(payloads, asyncio.run(run()))
@@ -0,0 +1,98 @@
+import time
+import asyncio
+import threading
+import pytest
+from fmbench.scripts.rate_limiter import (TokenBucket,
+                                          RateLimiter,
+                                          get_rate_limiter,
+                                          scale_rate_limits,
+                                          configure_rate_limits)
+
+
+def test_token_bucket_allows_burst_then_paces():
+    # 600 per minute = 10 per second, burst of 2 tokens
+    bucket = TokenBucket(600, burst_seconds=0.2)
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == 0
+    # the next reservations wait 0.1 seconds more each
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve(1) == pytest.approx(0.2, abs=0.01)
+    # a reservation larger than the burst puts the bucket in debt
+    assert bucket.reserve(5) == pytest.approx(0.7, abs=0.01)
+
+
+def test_rate_limiter_paces_threads_to_the_request_rate():
+    # 1200 requests per minute = 20 per second, no burst beyond a single request
+    limiter = RateLimiter(requests_per_minute=1200, burst_seconds=0.05)
+    start_times = []
+    lock = threading.Lock()
+
+    def send():
+        limiter.acquire()
+        with lock:
+            start_times.append(time.monotonic())
+
+    threads = [threading.Thread(target=send) for _ in range(11)]
+    st = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 11 requests at 20/s take 0.5 seconds
+    assert 0.45 < max(start_times) - st < 0.7
+
+
+def test_rate_limiter_uses_the_most_restrictive_limit():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=60000, burst_seconds=0.1)
+    assert limiter.limits_tokens
+    waits = [asyncio.run(limiter.aacquire(50)) for _ in range(3)]
+    # 100 tokens of burst at 1000 tokens per second, the third request waits for 50 tokens
+    assert waits[:2] == [0, 0]
+    assert 0.03 < waits[2] < 0.07
+    assert RateLimiter(requests_per_minute=60).limits_tokens is False
+
+
+def test_configure_rate_limits():
+    rate_limits = {"model-a": dict(requests_per_minute=100, tokens_per_minute=1000)}
+    assert scale_rate_limits(rate_limits, 0.5) == {"model-a": dict(requests_per_minute=50, tokens_per_minute=500)}
+    configure_rate_limits(rate_limits)
+    assert get_rate_limiter("model-a") is not None
+    assert get_rate_limiter("model-b") is None
+    configure_rate_limits(None)
+    assert get_rate_limiter("model-a") is None
+
+
+class FakeBedrockRuntime:
+    def __init__(self):
+        self.requests = []
+
+    def converse(self, **kwargs):
+        self.requests.append(kwargs)
+        return {"output": {"message": {"content": [{"text": "Hi"}]}},
+                "usage": {"inputTokens": 5, "outputTokens": 1}}
+
+
+def test_converse_requests_are_charged_for_their_tokens(monkeypatch):
+    # the bedrock predictor creates AWS clients and loads the litellm cost map at import
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    bedrock_predictor = pytest.importorskip("fmbench.scripts.bedrock_predictor")
+    model_id = "anthropic.claude-3-haiku-20240307-v1:0"
+    client = FakeBedrockRuntime()
+    monkeypatch.setattr(bedrock_predictor, "get_bedrock_runtime_client", lambda *args, **kwargs: client)
+    # 100 tokens per second, the bucket starts with 100 tokens
+    configure_rate_limits({model_id: {"tokens_per_minute": 6000}})
+    try:
+        predictor = bedrock_predictor.create_predictor(
+            model_id, {"parameters": {"max_tokens": 16, "use_boto3": True}}, None)
+        bucket = get_rate_limiter(model_id)._tokens
+        # 5 prompt tokens and max_tokens for each request
+        response = predictor.get_prediction({"inputs": "hello there how are you"})
+        assert response["response_json"]["generated_text"] == "Hi"
+        assert bucket._tokens == pytest.approx(100 - 21, abs=1)
+        response = asyncio.run(predictor.aget_prediction({"inputs": "hello there how are you"}))
+        assert response["response_json"]["generated_text"] == "Hi"
+        assert bucket._tokens == pytest.approx(100 - 42, abs=2)
+        assert client.requests[0]["messages"] == [{"role": "user", "content": [{"text": "hello there how are you"}]}]
+    finally:
+        configure_rate_limits(None)
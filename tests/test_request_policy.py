@@ -0,0 +1,117 @@
+import os
+import time
+import asyncio
+import pytest
+from fmbench.scripts.worker_pool import InferenceWorkerPool
+from fmbench.scripts.request_policy import RequestPolicy, get_request_policy_config
+
+
+def _sender(latencies):
+    """Returns a send function whose n-th call takes latencies[n] seconds."""
+    calls = []
+
+    async def send():
+        latency = latencies[len(calls)]
+        calls.append(latency)
+        await asyncio.sleep(latency)
+        return dict(completion="ok", latency=latency)
+    return send, calls
+
+
+def test_get_request_policy_config():
+    assert get_request_policy_config({}, {"name": "e"}) is None
+    config = {"request_policy": {"timeout_seconds": 30}}
+    experiment = {"name": "e", "request_policy": {"hedging": {"enabled": True, "quantile": 0.9}}}
+    settings = get_request_policy_config(config, experiment)
+    # the sections of the experiment override the top level sections
+    assert settings["timeout_seconds"] == 30
+    assert settings["hedging"] is True and settings["hedge_quantile"] == 0.9
+    assert get_request_policy_config(config, {"name": "e"})["hedging"] is False
+
+
+def test_timeout_cancels_request():
+    send, _ = _sender([5])
+    policy = RequestPolicy(timeout_seconds=0.1)
+    s = time.perf_counter()
+    response = asyncio.run(policy.run(send, lambda: dict(completion=None, latency=None)))
+    assert time.perf_counter() - s < 1
+    assert response == dict(completion=None, latency=None, timed_out=True)
+
+
+def test_timeout_abandons_blocking_request():
+    pool = InferenceWorkerPool(2)
+
+    async def send():
+        return await pool.run(lambda: time.sleep(0.5) or dict(completion="ok", latency=0.5))
+
+    async def run():
+        policy = RequestPolicy(timeout_seconds=0.05)
+        # the second and third requests are cancelled while they wait for a thread
+        return await asyncio.gather(*[policy.run(send, lambda: dict(completion=None)) for _ in range(4)])
+
+    responses = asyncio.run(run())
+    assert all(r["timed_out"] is True for r in responses)
+    pool.shutdown()
+    assert pool.stats()["worker_pool_calls"] == 4
+    # the abandoned calls are not counted as waiting
+    assert pool._queue_depth == 0
+
+
+def test_hedged_request_latency():
+    # the primary takes 0.5 seconds, the hedge sent after 0.1 seconds takes 0.05 seconds
+    send, calls = _sender([0.5, 0.05])
+    policy = RequestPolicy(hedging=True, hedge_delay_seconds=0.1)
+    response = asyncio.run(policy.run(send, lambda: dict(completion=None)))
+    assert len(calls) == 2
+    assert response["latency"] == 0.5 and response["hedged"] is True
+    assert response["hedge_latency"] == 0.05
+    assert response["hedged_latency"] == pytest.approx(0.15)
+
+
+def test_hedge_delay_from_latency_quantile():
+    send, calls = _sender([0.01] * 5)
+    policy = RequestPolicy(hedging=True, hedge_quantile=0.95, hedge_min_samples=5)
+
+    async def run():
+        return [await policy.run(send, lambda: dict(completion=None)) for _ in range(5)]
+
+    responses = asyncio.run(run())
+    # no hedges before there are enough latencies for the quantile
+    assert len(calls) == 5 and not any(r["hedged"] for r in responses)
+    assert policy.hedge_delay() == pytest.approx(0.01)
+
+
+class _Predictor:
+    endpoint_name = "endpoint"
+    inference_parameters = {"max_tokens": 10}
+
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+
+    def get_prediction(self, payload):
+        time.sleep(self.delay)
+        raise self.error
+
+
+def test_timed_out_and_failed_requests_produce_error_records():
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    inference = pytest.importorskip("fmbench.scripts.inference")
+    pool = InferenceWorkerPool(2)
+    payload = {"inputs": "prompt"}
+
+    async def run():
+        return await asyncio.gather(
+            inference.async_get_inference(_Predictor(delay=0.5, error=RuntimeError("late")), payload, "p.jsonl",
+                                          pool, RequestPolicy(timeout_seconds=0.05)),
+            inference.async_get_inference(_Predictor(error=ValueError("bad response")), payload, "p.jsonl",
+                                          pool, RequestPolicy(timeout_seconds=5)))
+
+    timed_out, failed = asyncio.run(run())
+    pool.shutdown()
+    for record in [timed_out, failed]:
+        assert record["endpoint_name"] == "endpoint" and record["prompt"] == "prompt"
+        assert record["max_tokens"] == 10 and record["completion"] is None and record["latency"] is None
+        # errors are aggregated with the combination of their payload file
+        assert record["payload_file"] == "p.jsonl"
+    assert timed_out["timed_out"] is True and failed["timed_out"] is False
@@ -0,0 +1,58 @@
+import pytest
+from fmbench.scripts.result_sink import (ResultSink,
+                                         PARQUET_AVAILABLE,
+                                         RESULT_FORMAT_JSONL,
+                                         RESULT_FORMAT_PARQUET,
+                                         get_result_sink_config,
+                                         read_results)
+
+
+def make_records(n, start=0):
+    return [dict(uuid=f"id-{i}", prompt="a long prompt " * 50, latency=0.1 * i,
+                 time_to_first_token=None, inference_params={"temperature": 0.1}) for i in range(start, start + n)]
+
+
+def run_sink(result_format, **kwargs):
+    parts = {}
+    sink = ResultSink(lambda data, file_name: parts.__setitem__(file_name, data),
+                      result_format=result_format, **kwargs)
+    return sink, parts
+
+
+@pytest.mark.parametrize("result_format", [RESULT_FORMAT_JSONL, RESULT_FORMAT_PARQUET])
+def test_records_are_written_in_parts(result_format):
+    if result_format == RESULT_FORMAT_PARQUET and not PARQUET_AVAILABLE:
+        pytest.skip("pyarrow is not installed")
+    sink, parts = run_sink(result_format, max_rows=4)
+    sink.append(make_records(6))
+    # the first 4 records fill a part, the other 2 stay in the buffer
+    assert len(parts) == 1
+    sink.append(make_records(3, start=6))
+    sink.close()
+    assert len(parts) == 3 and sink.records_written == 9
+    # unique names, one sequence number per part
+    names = sorted(parts)
+    assert len(set(names)) == 3 and names[0].endswith("-00000" + (".jsonl.gz" if result_format == RESULT_FORMAT_JSONL
+                                                                  else ".parquet"))
+    records = [r for name in names for r in read_results(parts[name]).to_dict(orient="records")]
+    assert [r["uuid"] for r in records] == [f"id-{i}" for i in range(9)]
+    assert records[3]["latency"] == pytest.approx(0.3)
+    assert records[0]["inference_params"] == '{"temperature": 0.1}'
+
+
+def test_flush_on_bytes_and_interval():
+    sink, parts = run_sink(RESULT_FORMAT_JSONL, max_bytes=1000)
+    sink.append(make_records(3))
+    # each record is more than 700 bytes
+    assert len(parts) == 1
+    sink, parts = run_sink(RESULT_FORMAT_JSONL, flush_interval_seconds=0)
+    sink.append(make_records(1))
+    assert len(parts) == 1
+    assert sink.flush() is None
+
+
+def test_get_result_sink_config():
+    settings = get_result_sink_config({"result_sink": {"max_rows": 100, "format": "jsonl"}})
+    assert settings["max_rows"] == 100 and settings["result_format"] == RESULT_FORMAT_JSONL
+    with pytest.raises(ValueError):
+        get_result_sink_config({"result_sink": {"format": "csv"}})
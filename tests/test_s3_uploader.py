@@ -0,0 +1,66 @@
+import time
+import threading
+import pytest
+from fmbench.scripts import s3_uploader
+from fmbench.scripts.s3_uploader import S3Uploader
+
+
+class FakeS3Client:
+    def __init__(self, failures=0, delay=0.0):
+        self.objects = {}
+        self.multipart = []
+        self.failures = failures
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failed = self.failures > 0
+            self.failures -= 1 if failed else 0
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        if failed:
+            raise RuntimeError("SlowDown")
+        self.objects[(Bucket, Key)] = Body
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None):
+        self.multipart.append(key)
+        self.objects[(bucket, key)] = fileobj.read()
+
+
+def test_every_file_is_uploaded_once_with_bounded_concurrency():
+    client = FakeS3Client(delay=0.01)
+    uploader = S3Uploader(lambda: client, max_concurrency=4, max_queue_size=2)
+    for i in range(40):
+        uploader.enqueue(f"data {i}", "bucket", f"key-{i}")
+    assert uploader.flush() == []
+    assert uploader.uploaded == 40
+    assert client.objects == {("bucket", f"key-{i}"): f"data {i}".encode() for i in range(40)}
+    assert client.max_in_flight <= 4
+    uploader.close()
+
+
+def test_failed_uploads_are_retried_and_reported(monkeypatch):
+    monkeypatch.setattr(s3_uploader, "INITIAL_RETRY_DELAY", 0.001)
+    client = FakeS3Client(failures=2)
+    uploader = S3Uploader(lambda: client, max_concurrency=1)
+    uploader.enqueue(b"x", "bucket", "retried")
+    assert uploader.flush() == [] and ("bucket", "retried") in client.objects
+    client.failures = 10
+    uploader.enqueue(b"x", "bucket", "failed")
+    assert uploader.close() == ["failed"]
+
+
+def test_large_files_use_multipart_uploads():
+    client = FakeS3Client()
+    uploader = S3Uploader(lambda: client, max_concurrency=2, multipart_threshold=1024)
+    uploader.enqueue(b"a" * 100, "bucket", "small")
+    uploader.enqueue(b"b" * 4096, "bucket", "large")
+    uploader.close()
+    assert client.multipart == ["large"]
+    assert client.objects[("bucket", "large")] == b"b" * 4096
@@ -0,0 +1,53 @@
+import pytest
+from fmbench.scripts.saturation_search import SaturationSearch, get_saturation_search_config
+
+
+def run_search(search: SaturationSearch, saturation_point: int):
+    """Latency is 1s up to the saturation point and 5s above it."""
+    levels = []
+    while (concurrency := search.next_concurrency()) is not None:
+        levels.append(concurrency)
+        search.record(concurrency, 1 if concurrency <= saturation_point else 5, 0)
+    return levels
+
+
+def test_probe_then_binary_search():
+    search = SaturationSearch(1, 256, latency_budget=2, error_rate_budget=0)
+    levels = run_search(search, saturation_point=40)
+    assert levels == [1, 2, 4, 8, 16, 32, 64, 48, 40, 44, 42, 41]
+    assert search.best_concurrency == 40
+
+
+def test_stops_when_max_concurrency_passes():
+    search = SaturationSearch(2, 20, latency_budget=2, error_rate_budget=0)
+    assert run_search(search, saturation_point=100) == [2, 4, 8, 16, 20]
+    assert search.best_concurrency == 20
+
+
+def test_stops_when_min_concurrency_fails():
+    search = SaturationSearch(4, 64, latency_budget=2, error_rate_budget=0)
+    assert run_search(search, saturation_point=1) == [4]
+    assert search.best_concurrency is None
+
+
+def test_error_rate_budget_and_missing_latency_fail():
+    search = SaturationSearch(1, 8, latency_budget=2, error_rate_budget=0.1)
+    assert search.passes(1.0, 0.05)
+    assert not search.passes(1.0, 0.2)
+    assert not search.passes(None, 0)
+    # latency latitude of 1%
+    assert search.passes(2.01, 0)
+
+
+def test_get_saturation_search_config():
+    config = {"report": {"latency_budget": 3, "error_rate_budget": 0.05},
+              "saturation_search": {"enabled": True}}
+    assert get_saturation_search_config({}, {"concurrency_levels": [1, 2]}) is None
+    settings = get_saturation_search_config(config, {"concurrency_levels": [1, 8, 32],
+                                                     "saturation_search": {"min_concurrency": 2}})
+    assert settings["max_concurrency"] == 32
+    assert settings["min_concurrency"] == 2
+    assert settings["latency_budget"] == 3
+    with pytest.raises(ValueError, match="min_concurrency"):
+        get_saturation_search_config(config, {"saturation_search": {"min_concurrency": 4,
+                                                                    "max_concurrency": 2}})
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import pytest
+from fmbench.scripts.stream_parser import LineBuffer, SSEDecoder, iter_lines
+
+
+def _split(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_line_buffer_lines_split_across_chunks():
+    lines = [json.dumps({"token": {"id": i, "text": f" tök{i}"}}) for i in range(100)]
+    data = ("\n".join(lines) + "\r\n").encode("utf-8")
+    # small chunks also split the multi-byte characters
+    buffer = LineBuffer(compact_threshold=64)
+    received = []
+    for chunk in _split(data, 7):
+        buffer.feed(chunk)
+        received.extend(buffer.pop_lines())
+        # the consumed bytes are compacted away
+        assert len(buffer._buffer) < 200
+    assert received == lines
+    assert buffer.flush() is None
+
+
+def test_iter_lines_event_streams():
+    sagemaker_events = [{"PayloadPart": {"Bytes": b'data:{"a": 1}\ndata:{"a"'}},
+                        {"PayloadPart": {"Bytes": b': 2}\n'}},
+                        {"PayloadPart": {"Bytes": b'data:{"a": 3}'}}]
+    assert list(iter_lines(sagemaker_events)) == ['data:{"a": 1}', 'data:{"a": 2}', 'data:{"a": 3}']
+    bedrock_events = [{"chunk": {"bytes": b'{"outputText": "x"}'}},
+                      {"chunk": {"bytes": b'{"outputText": "y"}'}}]
+    assert list(iter_lines(bedrock_events)) == ['{"outputText": "x"}', '{"outputText": "y"}']
+
+
+def test_sse_decoder():
+    stream = (b": keep-alive\n\n"
+              b"data: {\"choices\": [{\"delta\": {\"content\": \"Hi\"}}]}\n\n"
+              b"event: message\ndata: line 1\ndata: line 2\n\n"
+              b"data: [DONE]\n\n")
+    decoder = SSEDecoder()
+    payloads = []
+    for chunk in _split(stream, 5):
+        payloads.extend(decoder.feed(chunk))
+    payloads.extend(decoder.flush())
+    assert json.loads(payloads[0])["choices"][0]["delta"]["content"] == "Hi"
+    assert payloads[1:] == ["line 1\nline 2"]
+    assert decoder.done is True
+
+
+def test_sagemaker_response_stream_stop_token():
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    stream_responses = pytest.importorskip("fmbench.scripts.stream_responses")
+    tokens = ["Hello", " world", "<|e", "ot|>", " ignored"]
+    data = b"".join(b"data:" + json.dumps({"token": {"id": i, "text": t}}).encode() + b"\n"
+                    for i, t in enumerate(tokens))
+    events = [{"PayloadPart": {"Bytes": chunk}} for chunk in _split(data, 11)]
+    result = stream_responses.get_response_stream(events, time.perf_counter(), None, "<|eot|>", is_sagemaker=True)
+    # the stop token split across two tokens ends the stream
+    assert json.loads(result["response"])[0]["generated_text"] == "Hello world<|eot|>"
+
+
+def test_token_timings_side_file():
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    stream_responses = pytest.importorskip("fmbench.scripts.stream_responses")
+    from fmbench.scripts.token_timings import (TOKEN_TIMES_KEY, pop_token_times, write_token_timings,
+                                               read_token_timings, split_token_times)
+    data = b"".join(b"data:" + json.dumps({"token": {"id": i, "text": f" t{i}"}}).encode() + b"\n"
+                    for i in range(50))
+    events = [{"PayloadPart": {"Bytes": data}}]
+    result = stream_responses.get_response_stream(events, time.perf_counter(), None, None,
+                                                  is_sagemaker=True, record_token_times=True)
+    assert result[TOKEN_TIMES_KEY].typecode == "f" and len(result[TOKEN_TIMES_KEY]) == 50
+    assert stream_responses.get_response_stream(events, time.perf_counter(), None, None,
+                                                is_sagemaker=True)[TOKEN_TIMES_KEY] is None
+
+    responses = [dict(uuid="a", experiment_name="e", payload_file="p", concurrency=2,
+                      token_times=result[TOKEN_TIMES_KEY]),
+                 # the distributed runner sends the timings as a list
+                 dict(uuid="b", experiment_name="e", payload_file="p", concurrency=2, token_times=[0.5, 0.75]),
+                 dict(uuid="c", experiment_name="e", payload_file="p", concurrency=2, token_times=None)]
+    timings = read_token_timings(write_token_timings(pop_token_times(responses)))
+    # the timings are taken out of the records
+    assert all(TOKEN_TIMES_KEY not in r for r in responses)
+    assert list(timings["uuid"]) == ["a", "b"]
+    per_request = split_token_times(timings)
+    assert list(per_request[0]) == list(result[TOKEN_TIMES_KEY])
+    assert list(per_request[1]) == [0.5, 0.75]
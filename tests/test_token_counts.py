@@ -0,0 +1,52 @@
+import os
+import time
+import pytest
+from types import SimpleNamespace
+
+# the stream helpers create a SageMaker client and load the litellm cost map at import
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+stream_responses = pytest.importorskip("fmbench.scripts.stream_responses")
+from fmbench.scripts.token_counts import count_missing_tokens
+
+
+class Delta(dict):
+    """Delta of a streamed chunk, litellm deltas support get() like a dict."""
+
+
+def _chunk(text=None, usage=None):
+    choices = [SimpleNamespace(delta=Delta(content=text))] if text is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def test_stream_usage_chunk_is_used():
+    events = [_chunk("Hello"), _chunk(" world"),
+              # the usage chunk of stream_options.include_usage has no choices
+              _chunk(usage=SimpleNamespace(prompt_tokens=12, completion_tokens=2))]
+    result = stream_responses.get_response_stream(iter(events), time.perf_counter(), None, None)
+    assert result["prompt_tokens"] == 12
+    assert result["completion_tokens"] == 2
+    assert '"generated_text": "Hello world"' in result["response"]
+
+
+def test_stream_without_usage_has_no_counts():
+    events = [_chunk("Hello"), _chunk(" world")]
+    result = stream_responses.get_response_stream(iter(events), time.perf_counter(), None, None)
+    assert result["prompt_tokens"] is None
+    assert result["completion_tokens"] is None
+
+
+def test_count_missing_tokens_only_fills_missing_counts():
+    responses = [
+        # usage reported by the provider
+        dict(prompt="a b c", completion="d e", prompt_tokens=3, completion_tokens=2, token_count_model=None),
+        # no usage, counted with the tokenizer
+        dict(prompt="what is the capital of france?", completion="paris is the capital of france",
+             prompt_tokens=None, completion_tokens=None, token_count_model="gpt-4o"),
+        # failed request
+        dict(prompt="x", completion=None, prompt_tokens=None, completion_tokens=None, token_count_model="gpt-4o"),
+    ]
+    assert count_missing_tokens(responses) == 1
+    assert (responses[0]["prompt_tokens"], responses[0]["completion_tokens"]) == (3, 2)
+    assert responses[1]["prompt_tokens"] > 0 and responses[1]["completion_tokens"] > 0
+    assert responses[2]["prompt_tokens"] is None and responses[2]["completion_tokens"] is None
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from fmbench.scripts.load_generator import (LOAD_MODE_REPLAY,
+                                            run_load,
+                                            get_load_generation_config)
+from fmbench.scripts.trace_replay import (parse_trace,
+                                          create_replay_requests,
+                                          get_payload_file_buckets)
+
+FILTERS = [dict(language="en", min_length_in_tokens=1, max_length_in_tokens=500,
+                payload_file="payload_{lang}_{min}-{max}.jsonl"),
+           dict(language="en", min_length_in_tokens=500, max_length_in_tokens=1000,
+                payload_file="payload_{lang}_{min}-{max}.jsonl")]
+
+
+def test_parse_trace_sorts_and_computes_offsets():
+    trace = parse_trace(['{"timestamp": 100.5, "prompt_tokens": 10}',
+                         '',
+                         '{"timestamp": "1970-01-01T00:01:40+00:00", "prompt": "hi", "max_tokens": 5}'])
+    assert [e["offset"] for e in trace] == [0, 0.5]
+    assert trace[0]["prompt"] == "hi"
+    with pytest.raises(ValueError, match="prompt_tokens"):
+        parse_trace(['{"timestamp": 1}'])
+
+
+def test_create_replay_requests_matches_payload_files():
+    buckets = get_payload_file_buckets(FILTERS, ["payload_en_1-500.jsonl", "payload_en_500-1000.jsonl"])
+    payloads_by_file = {"payload_en_1-500.jsonl": [{"inputs": "s1"}, {"inputs": "s2"}],
+                        "payload_en_500-1000.jsonl": [{"inputs": "l1"}]}
+    trace = parse_trace(['{"timestamp": 0, "prompt_tokens": 10}',
+                         '{"timestamp": 1, "prompt_tokens": 700, "max_tokens": 64}',
+                         '{"timestamp": 2, "prompt_tokens": 20}',
+                         '{"timestamp": 4, "prompt_tokens": 5000}',
+                         '{"timestamp": 6, "prompt": "custom"}'])
+    requests = create_replay_requests(trace, payloads_by_file, buckets, time_compression=2)
+    assert [r["inputs"] for r in requests] == ["s1", "l1", "s2", "l1", "custom"]
+    assert [r["arrival_offset"] for r in requests] == [0, 0.5, 1, 2, 3]
+    assert requests[1]["max_tokens"] == 64
+    # the payloads of the payload files are not modified
+    assert payloads_by_file["payload_en_500-1000.jsonl"] == [{"inputs": "l1"}]
+
+
+def test_replay_sends_at_trace_offsets():
+    async def send(payload):
+        await asyncio.sleep(0.01)
+        return dict(payload=payload["inputs"])
+
+    payloads = [{"inputs": i, "arrival_offset": offset} for i, offset in enumerate([0, 0.1, 0.1, 0.25])]
+    load_generation = get_load_generation_config({"load_generation": {"mode": LOAD_MODE_REPLAY,
+                                                                      "trace_file": "trace.jsonl"}}, {})
+    responses, elapsed = asyncio.run(run_load(send, payloads, 4, load_generation))
+    start = responses[0]["intended_start_time"]
+    offsets = [round(r["intended_start_time"] - start, 3) for r in responses]
+    assert offsets == [0, 0.1, 0.1, 0.25]
+    assert all(r["queueing_delay"] < 0.05 for r in responses)
+    assert 0.25 < elapsed < 0.4
+
+
+def test_replay_config_requires_trace_file():
+    with pytest.raises(ValueError, match="trace_file"):
+        get_load_generation_config({"load_generation": {"mode": LOAD_MODE_REPLAY}}, {})
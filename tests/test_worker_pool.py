@@ -0,0 +1,59 @@
+import time
+import asyncio
+import threading
+import pytest
+from fmbench.scripts.worker_pool import InferenceWorkerPool, get_max_concurrency
+
+
+def test_get_max_concurrency():
+    config = {"experiments": [{"concurrency_levels": [1, 2, 8]},
+                              {"concurrency_levels": [4]},
+                              {}]}
+    assert get_max_concurrency(config) == 8
+
+
+def test_pool_is_reused_across_chunks_and_reports_queue_depth():
+    thread_ids = set()
+
+    def blocking(i):
+        thread_ids.add(threading.get_ident())
+        time.sleep(0.02)
+        return i
+
+    async def run_chunks(pool):
+        all_stats = []
+        for _ in range(3):
+            results = await asyncio.gather(*[pool.run(blocking, i) for i in range(6)])
+            assert results == list(range(6))
+            all_stats.append(pool.stats())
+        return all_stats
+
+    with InferenceWorkerPool(max_workers=2) as pool:
+        all_stats = asyncio.run(run_chunks(pool))
+
+    # the same 2 threads are used for every chunk
+    assert len(thread_ids) == 2
+    first, second, _ = all_stats
+    assert first["worker_pool_calls"] == 6
+    # 6 calls on 2 threads, at least 4 of them had to wait for a thread
+    assert 4 <= first["worker_pool_queue_depth_max"] <= 6
+    assert first["worker_pool_threads_started"] == 2
+    assert first["worker_pool_thread_start_overhead_mean"] is not None
+    assert second["worker_pool_threads_started"] == 0
+    assert second["worker_pool_dispatch_delay_max"] >= 0.02
+
+
+def test_run_after_shutdown_raises():
+    pool = InferenceWorkerPool(max_workers=1)
+    pool.shutdown()
+    # shutdown is idempotent
+    pool.shutdown()
+    with pytest.raises(RuntimeError, match="shut down"):
+        asyncio.run(pool.run(print, "x"))
+
+
+def test_get_max_concurrency_includes_saturation_search():
+    config = {"saturation_search": {"enabled": True, "max_concurrency": 64},
+              "experiments": [{"concurrency_levels": [1, 2]},
+                              {"saturation_search": {"max_concurrency": 128}}]}
+    assert get_max_concurrency(config) == 128